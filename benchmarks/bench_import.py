@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+import subprocess
+import statistics
+
+MODULE = 'cdiquerygenestoterm.cdiquerygenestotermcmd'
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = os.path.join(ROOT_DIR, 'bin', 'cdiquerygenestotermcmd.py')
+
+# modules that must not be imported until a http request is made
+HEAVY_MODULES = ['requests', 'urllib3', 'chardet', 'charset_normalizer',
+                 'idna', 'numpy', 'aiohttp', 'tempfile', 'hashlib']
+
+
+def _parse_arguments(desc, args):
+    """
+    Parses command line arguments
+    :param desc:
+    :param args:
+    :return:
+    """
+    help_fm = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_fm)
+    parser.add_argument('--repeat', default=10, type=int,
+                        help='Number of times to run each measurement, '
+                             'median is reported')
+    parser.add_argument('--top', default=10, type=int,
+                        help='Number of slowest imports to list')
+    parser.add_argument('--check', action='store_true',
+                        help='If set, exit with 1 if any of the heavy '
+                             'modules are imported at startup')
+    return parser.parse_args(args)
+
+
+def _get_env():
+    """
+    Gets environment for subprocesses with this checkout on the path
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def get_import_times(code):
+    """
+    Runs **code** in a new interpreter with ``-X importtime``
+
+    :return: dict of module => (self microseconds, cumulative
+             microseconds) for modules imported by **code** and
+             not by interpreter startup
+    :rtype: dict
+    """
+    baseline = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                               'pass'], env=_get_env(),
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True, check=True)
+    startup = set([line.split('|')[2].strip()
+                   for line in baseline.stderr.splitlines()
+                   if line.startswith('import time:') and
+                   'cumulative' not in line])
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         env=_get_env(), stderr=subprocess.PIPE,
+                         universal_newlines=True, check=True)
+    times = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        selftime, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name in startup:
+            continue
+        times[name] = (int(selftime), int(cumulative))
+    return times
+
+
+def _get_loaded_heavy_modules(code):
+    """
+    Gets which of :py:const:`HEAVY_MODULES` are loaded after
+    running **code** in a new interpreter
+    """
+    code = ('import sys\n' + code + '\n'
+            'print(\',\'.join([m for m in ' + repr(HEAVY_MODULES) +
+            ' if m in sys.modules]))')
+    res = subprocess.run([sys.executable, '-c', code], env=_get_env(),
+                         stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True)
+    return [m for m in res.stdout.strip().split(',') if len(m) > 0]
+
+
+def get_imported_heavy_modules():
+    """
+    Gets which of :py:const:`HEAVY_MODULES` are loaded by importing
+    :py:const:`MODULE`, ignoring any loaded by interpreter startup
+    such as from ``.pth`` files in site-packages
+
+    :rtype: list
+    """
+    startup = set(_get_loaded_heavy_modules('pass'))
+    return [m for m in _get_loaded_heavy_modules('import ' + MODULE)
+            if m not in startup]
+
+
+def time_command(cmd, repeat):
+    """
+    Gets median wall time in milliseconds of running **cmd**
+    """
+    import time
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=_get_env(), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def main(args):
+    """
+    Benchmarks startup time of the command line tool
+    """
+    desc = """
+    Reports time to import the command line tool, measured with
+    python -X importtime, the slowest modules it imports and wall
+    time of running the script with --help. Also lists any heavy
+    modules, such as requests, that got imported at startup. These
+    should only be imported once a http request is made.
+    """
+    theargs = _parse_arguments(desc, args[1:])
+
+    cumulative = []
+    slowest = {}
+    for i in range(theargs.repeat):
+        times = get_import_times('import ' + MODULE)
+        cumulative.append(sum([t[0] for t in times.values()]))
+        for name, (selftime, _) in times.items():
+            slowest.setdefault(name, []).append(selftime)
+
+    print('Import of ' + MODULE + ': ' +
+          str(round(statistics.median(cumulative) / 1000.0, 2)) + ' ms')
+    print('Slowest imports (median self time):')
+    ranked = sorted([(statistics.median(v), k)
+                     for k, v in slowest.items()], reverse=True)
+    for selftime, name in ranked[0:theargs.top]:
+        print('  ' + name.ljust(50) + str(round(selftime / 1000.0, 2)) +
+              ' ms')
+
+    print('Wall time of ' + os.path.basename(SCRIPT) + ' --help: ' +
+          str(round(time_command([sys.executable, SCRIPT, '--help'],
+                                 theargs.repeat), 1)) + ' ms')
+    print('Wall time of python -c pass: ' +
+          str(round(time_command([sys.executable, '-c', 'pass'],
+                                 theargs.repeat), 1)) + ' ms')
+
+    heavy = get_imported_heavy_modules()
+    if len(heavy) > 0:
+        print('Heavy modules imported at startup: ' + ', '.join(heavy))
+        if theargs.check is True:
+            return 1
+    else:
+        print('No heavy modules imported at startup')
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
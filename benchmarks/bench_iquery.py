@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+# benchmarks is not a package, so the mock server next to this
+# script is made importable however the script is started
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_iquery_server import MockIQueryServer  # noqa: E402
+from cdiquerygenestoterm import cdiquerygenestotermcmd  # noqa: E402
+
+PATHS = ['single', 'batch', 'concurrent']
+
+
+def _parse_arguments(desc, args):
+    """
+    Parses command line arguments
+    :param desc:
+    :param args:
+    :return:
+    """
+    help_fm = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_fm)
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='Comma delimited execution paths to '
+                             'benchmark. Any of ' + ', '.join(PATHS))
+    parser.add_argument('--numsets', default=50, type=int,
+                        help='Number of gene sets to map')
+    parser.add_argument('--genes_per_set', default=20, type=int,
+                        help='Number of genes in each gene set')
+    parser.add_argument('--min_latency', default=0.2, type=float,
+                        help='Minimum seconds for a task to complete '
+                             'on mock server')
+    parser.add_argument('--max_latency', default=1.0, type=float,
+                        help='Maximum seconds for a task to complete '
+                             'on mock server')
+    parser.add_argument('--numresults', default=200, type=int,
+                        help='Number of results in each completed '
+                             'result returned by mock server')
+    parser.add_argument('--numhits', default=20, type=int,
+                        help='Number of hit genes in each result')
+    parser.add_argument('--max_inflight', default=10, type=int,
+                        help='Tasks in flight for concurrent path')
+    parser.add_argument('--polling_interval', default=0.1, type=float,
+                        help='Passed to --polling_interval')
+    parser.add_argument('--polling_strategy', default='fixed',
+                        choices=['fixed', 'backoff'],
+                        help='Passed to --polling_strategy')
+    return parser.parse_args(args)
+
+
+def get_percentile(values, percentile):
+    """
+    Gets **percentile** of **values** using nearest rank
+
+    :param values: sorted values
+    :type values: list
+    :param percentile: 0 to 100
+    :return: value or None if **values** is empty
+    """
+    if len(values) == 0:
+        return None
+    rank = int(round(percentile / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def run_path(path, genesets, theargs, max_inflight):
+    """
+    Maps **genesets** using execution **path**
+
+    :return: number of gene sets mapped to a term
+    :rtype: int
+    """
+    if path == 'single':
+        # fresh connections for every request as done when
+        # running cdiquerygenestotermcmd.py once per gene set
+        mapped = 0
+        for setid, genes in genesets:
+            if cdiquerygenestotermcmd.run_iquery_for_genes(genes,
+                                                           theargs):
+                mapped += 1
+        return mapped
+
+    theargs.max_inflight = 1
+    if path == 'concurrent':
+        theargs.max_inflight = max_inflight
+    session = cdiquerygenestotermcmd.create_session_from_args(theargs)
+    try:
+        return len([r for s, r in cdiquerygenestotermcmd.
+                    iter_iquery_results(genesets, theargs,
+                                        session=session)
+                    if r is not None])
+    finally:
+        session.close()
+
+
+def main(args):
+    """
+    Benchmarks execution paths against a local mock iQuery server
+    """
+    desc = """
+    Benchmarks mapping of gene sets against a local mock
+    iQuery server for the single (one run_iquery_for_genes() call
+    per gene set with new connections), batch (iter_iquery_results()
+    with one task in flight and a shared session) and
+    concurrent (iter_iquery_results() with --max_inflight tasks)
+    execution paths. Reported per path is wall time, gene set latency
+    percentiles from submission to result download, mean number of
+    http requests per task and peak Python memory allocated.
+    """
+    theargs = _parse_arguments(desc, args[1:])
+    server = MockIQueryServer(min_latency=theargs.min_latency,
+                              max_latency=theargs.max_latency,
+                              numresults=theargs.numresults,
+                              numhits=theargs.numhits)
+    server.start()
+    genesets = [(str(i), ['GENE' + str(i) + '_' + str(j)
+                          for j in range(theargs.genes_per_set)])
+                for i in range(theargs.numsets)]
+    header = ['path', 'mapped', 'wall_s', 'sets_per_s', 'p50_ms',
+              'p90_ms', 'p99_ms', 'max_ms', 'requests_per_task',
+              'peak_mem_mb']
+    sys.stdout.write('\t'.join(header) + '\n')
+    try:
+        for path in theargs.paths.split(','):
+            if path not in PATHS:
+                sys.stderr.write('Unknown path: ' + path + '\n')
+                return 1
+            server.reset()
+            cmdargs = cdiquerygenestotermcmd.\
+                _parse_arguments('bench',
+                                 ['bench', '--url', server.get_url(),
+                                  '--polling_interval',
+                                  str(theargs.polling_interval),
+                                  '--polling_strategy',
+                                  theargs.polling_strategy,
+                                  '--pool_size',
+                                  str(theargs.max_inflight)])
+            tracemalloc.start()
+            start = time.monotonic()
+            mapped = run_path(path, genesets, cmdargs,
+                              theargs.max_inflight)
+            wall = time.monotonic() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            tasks = list(server.tasks.values())
+            latencies = sorted([(t.result_fetched - t.created) * 1000.0
+                                for t in tasks
+                                if t.result_fetched is not None])
+            requests_per_task = 0.0
+            if len(tasks) > 0:
+                requests_per_task = sum([t.requests for t in tasks]) /\
+                    float(len(tasks))
+            row = [path, str(mapped), '%.3f' % wall,
+                   '%.2f' % (len(genesets) / wall)]
+            for pct in [50, 90, 99, 100]:
+                val = get_percentile(latencies, pct)
+                row.append('NA' if val is None else '%.1f' % val)
+            row.append('%.2f' % requests_per_task)
+            row.append('%.2f' % (peak / 1048576.0))
+            sys.stdout.write('\t'.join(row) + '\n')
+            sys.stdout.flush()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import random
+import argparse
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm.local import LocalEnrichmentEngine
+from cdiquerygenestoterm.index import GeneIndex
+from cdiquerygenestoterm.snapshot import load_binary_snapshot
+from cdiquerygenestoterm.snapshot import write_binary_snapshot
+from cdiquerygenestoterm.parallel import iter_iquery_results_parallel
+
+
+def _parse_arguments(desc, args):
+    """
+    Parses command line arguments
+    :param desc:
+    :param args:
+    :return:
+    """
+    help_fm = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_fm)
+    parser.add_argument('--networks', default=5000, type=int,
+                        help='Number of networks in fake snapshot')
+    parser.add_argument('--universe', default=20000, type=int,
+                        help='Number of genes in fake snapshot')
+    parser.add_argument('--queries', default=2000, type=int,
+                        help='Number of gene sets to map')
+    parser.add_argument('--min_genes', default=5, type=int,
+                        help='Minimum genes per gene set')
+    parser.add_argument('--max_genes', default=100, type=int,
+                        help='Maximum genes per gene set')
+    parser.add_argument('--processes', default=4, type=int,
+                        help='Number of worker processes to also map '
+                             'gene sets with')
+    return parser.parse_args(args)
+
+
+def generate_networks(numnetworks, universe, seed=1):
+    """
+    Generates fake snapshot networks of 10 to 500 genes drawn from
+    **universe** genes where lower numbered genes are more common,
+    as with real networks
+
+    :return: networks
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    networks = []
+    for i in range(numnetworks):
+        size = rng.randint(10, 500)
+        genes = set()
+        while len(genes) < size:
+            genes.add('GENE' + str(int(universe * rng.random() ** 2)))
+        networks.append({'name': 'network ' + str(i),
+                         'source': 'source' + str(i % 4),
+                         'url': 'http://ndexbio.org/network/' + str(i),
+                         'nodes': size,
+                         'genes': sorted(genes)})
+    return networks
+
+
+def generate_genesets(numgenesets, universe, min_genes, max_genes,
+                      seed=2):
+    """
+    Generates **numgenesets** canonical gene sets
+
+    :return: gene sets
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    genesets = []
+    for i in range(numgenesets):
+        size = rng.randint(min_genes, max_genes)
+        genesets.append(sorted(set(['GENE' + str(rng.randrange(universe))
+                                    for _ in range(size)])))
+    return genesets
+
+
+def main(args):
+    """
+    Times mapping of gene sets with the local enrichment engine
+    """
+    desc = """
+    Builds a local enrichment engine from a fake snapshot and
+    reports time to build it, time to load it with a memory mapped
+    index or from a binary snapshot and gene sets mapped per second,
+    using the binary snapshot, including selection of the best
+    result, in this process and on --processes worker processes.
+    """
+    theargs = _parse_arguments(desc, args[1:])
+    cmdargs = cdiquerygenestotermcmd._parse_arguments('bench', ['x'])
+    networks = generate_networks(theargs.networks, theargs.universe)
+    genesets = generate_genesets(theargs.queries, theargs.universe,
+                                 theargs.min_genes, theargs.max_genes)
+
+    start = time.perf_counter()
+    engine = LocalEnrichmentEngine(networks)
+    build_secs = time.perf_counter() - start
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        indexfile = os.path.join(temp_dir, 'index.bin')
+        engine.get_index().write(indexfile)
+        start = time.perf_counter()
+        engine = LocalEnrichmentEngine(networks,
+                                       index=GeneIndex.load(indexfile))
+        load_secs = time.perf_counter() - start
+
+        snapshotfile = os.path.join(temp_dir, 'snapshot.bin')
+        write_binary_snapshot(snapshotfile, networks)
+        start = time.perf_counter()
+        engine = load_binary_snapshot(snapshotfile)
+        snapshot_secs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for genes in genesets:
+            cdiquerygenestotermcmd.get_local_result(genes, cmdargs,
+                                                    engine)
+        query_secs = time.perf_counter() - start
+
+        cmdargs = cdiquerygenestotermcmd._parse_arguments(
+            'bench', ['x', '--snapshot', snapshotfile])
+        start = time.perf_counter()
+        for _ in iter_iquery_results_parallel(
+                [(str(i), genes) for i, genes in enumerate(genesets)],
+                cmdargs, theargs.processes):
+            pass
+        parallel_secs = time.perf_counter() - start
+    finally:
+        shutil.rmtree(temp_dir)
+
+    sys.stdout.write('networks\tgenesets\tbuild_ms\tindex_load_ms\t'
+                     'snapshot_load_ms\tgenesets_per_sec\tprocesses\t'
+                     'parallel_genesets_per_sec\n')
+    sys.stdout.write('%d\t%d\t%.1f\t%.1f\t%.1f\t%.1f\t%d\t%.1f\n' %
+                     (theargs.networks, len(genesets), build_secs * 1000,
+                      load_secs * 1000, snapshot_secs * 1000,
+                      len(genesets) / query_secs, theargs.processes,
+                      len(genesets) / parallel_secs))
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import sys
+import random
+import timeit
+import argparse
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm import vectorized
+
+
+def _parse_arguments(desc, args):
+    """
+    Parses command line arguments
+    :param desc:
+    :param args:
+    :return:
+    """
+    help_fm = argparse.ArgumentDefaultsHelpFormatter
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=help_fm)
+    parser.add_argument('--sizes', default='100,1000,10000,100000',
+                        help='Comma delimited number of results to '
+                             'benchmark selection on')
+    parser.add_argument('--repeat', default=5, type=int,
+                        help='Number of times to time each selection, '
+                             'fastest time is reported')
+    parser.add_argument('--topk', default=10, type=int,
+                        help='Number of results to select for top-k '
+                             'benchmarks')
+    return parser.parse_args(args)
+
+
+def generate_result(numresults, numsources=4, seed=1):
+    """
+    Generates fake iQuery result with **numresults** results
+    spread over **numsources** sources
+
+    :return: result
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    sources = [{'sourceName': 'source' + str(i), 'results': []}
+               for i in range(numsources)]
+    for i in range(numresults):
+        hits = ['GENE' + str(j) for j in range(rng.randint(1, 20))]
+        sources[i % numsources]['results'].append(
+            {'description': 'source: network ' + str(i),
+             'details': {'PValue': rng.random() ** 4,
+                         'similarity': rng.random()},
+             'url': 'http://ndexbio.org/network/' + str(i),
+             'nodes': rng.randint(10, 500),
+             'hitGenes': hits})
+    return {'sources': sources}
+
+
+def _time(func, repeat):
+    """
+    Gets fastest time in milliseconds of **repeat** calls to **func**
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000.0
+
+
+def main(args):
+    """
+    Compares pure Python result selection in
+    cdiquerygenestotermcmd with the NumPy based selection in
+    cdiquerygenestoterm.vectorized
+    """
+    desc = """
+    Times selection of best results from fake iQuery results
+    of increasing size using the pure Python loop in
+    get_best_result_by_similarity(), the heap in get_top_results()
+    and the NumPy implementation in vectorized.get_top_results()
+    with and without filters and Benjamini-Hochberg adjustment.
+    """
+    theargs = _parse_arguments(desc, args[1:])
+    if not vectorized.is_available():
+        sys.stderr.write('numpy is not installed, only pure Python '
+                         'selection will be timed\n')
+    k = theargs.topk
+    header = ['results', 'best_loop_ms', 'heap_topk_ms',
+              'numpy_topk_ms', 'heap_filter_ms', 'numpy_filter_bh_ms']
+    sys.stdout.write('\t'.join(header) + '\n')
+    for size in [int(s) for s in theargs.sizes.split(',')]:
+        qres = generate_result(size)
+        row = [str(size)]
+        row.append(_time(lambda: cdiquerygenestotermcmd.
+                         get_best_result_by_similarity(qres),
+                         theargs.repeat))
+        row.append(_time(lambda: cdiquerygenestotermcmd.
+                         get_top_results(qres, k=k,
+                                         rankby='combined'),
+                         theargs.repeat))
+
+        def heap_filter():
+            filtered = {'sources': [{'results': [r for r in s['results']
+                                                 if r['details']['PValue']
+                                                 <= 0.05 and
+                                                 len(r['hitGenes']) >= 3]}
+                                    for s in qres['sources']]}
+            return cdiquerygenestotermcmd.get_top_results(filtered, k=k,
+                                                          rankby='combined')
+
+        if vectorized.is_available():
+            row.append(_time(lambda: vectorized.
+                             get_top_results(qres, k=k,
+                                             rankby='combined'),
+                             theargs.repeat))
+            row.append(_time(heap_filter, theargs.repeat))
+            row.append(_time(lambda: vectorized.
+                             get_top_results(qres, k=k,
+                                             rankby='combined',
+                                             max_pvalue=0.05,
+                                             min_hits=3,
+                                             pvalue_adjust='bh'),
+                             theargs.repeat))
+        else:
+            row.append('NA')
+            row.append(_time(heap_filter, theargs.repeat))
+            row.append('NA')
+        sys.stdout.write('\t'.join([r if isinstance(r, str)
+                                    else '%.3f' % r for r in row]) + '\n')
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
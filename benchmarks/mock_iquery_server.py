@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+BASE_PATH = '/integratedsearch/v1/'
+
+
+class MockTask(object):
+    """
+    A task submitted to :py:class:`MockIQueryServer`
+    """
+
+    def __init__(self, genes, latency):
+        """
+        Constructor
+
+        :param genes: genes submitted
+        :type genes: list
+        :param latency: seconds until task reports completion
+        :type latency: float
+        """
+        self.genes = genes
+        self.latency = latency
+        self.created = time.monotonic()
+        self.completed = None
+        self.requests = 1
+        self.result_fetched = None
+
+    def get_progress(self):
+        """
+        Gets progress from 0 to 100 based on time since creation
+        """
+        if self.latency <= 0:
+            return 100
+        elapsed = time.monotonic() - self.created
+        return min(100, int(100.0 * elapsed / self.latency))
+
+
+class MockIQueryServer(ThreadingHTTPServer):
+    """
+    Local stand in for the iQuery integrated search REST service.
+    Tasks report progress proportional to time since submission
+    and complete after a latency drawn uniformly from
+    **min_latency** to **max_latency** seconds. Completed results
+    have **numresults** results each with **numhits** hit genes.
+    Every request is counted per task.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), min_latency=0.5,
+                 max_latency=2.0, numresults=100, numhits=10, seed=1):
+        """
+        Constructor
+
+        :param address: (host, port) to listen on, port 0 picks
+                        a free port
+        :type address: tuple
+        """
+        super(MockIQueryServer, self).__init__(address,
+                                               MockIQueryRequestHandler)
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.numresults = numresults
+        self.numhits = numhits
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def get_url(self):
+        """
+        Gets base url of server to pass as --url
+        """
+        return 'http://' + self.server_address[0] + ':' +\
+               str(self.server_address[1])
+
+    def create_task(self, genes):
+        """
+        Creates task for **genes**
+
+        :return: id of task
+        :rtype: str
+        """
+        with self.lock:
+            latency = self._rng.uniform(self.min_latency, self.max_latency)
+            taskid = str(uuid.uuid4())
+            self.tasks[taskid] = MockTask(genes, latency)
+            return taskid
+
+    def get_result(self, task):
+        """
+        Builds completed result for **task**
+
+        :return: result in same format as iQuery
+        :rtype: dict
+        """
+        results = []
+        for i in range(self.numresults):
+            results.append({'description': 'mock: network ' + str(i),
+                            'details': {'PValue': 1.0 / (i + 1),
+                                        'similarity': 1.0 / (i + 2)},
+                            'url': 'http://localhost/network/' + str(i),
+                            'nodes': 10 + i,
+                            'hitGenes': (task.genes * self.numhits)
+                            [0:self.numhits]})
+        return {'sources': [{'sourceName': 'enrichment',
+                             'results': results}]}
+
+    def reset(self):
+        """
+        Removes all tasks
+        """
+        with self.lock:
+            self.tasks = {}
+
+    def start(self):
+        """
+        Starts serving on a background thread
+
+        :return: the thread
+        :rtype: :py:class:`threading.Thread`
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class MockIQueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles requests for :py:class:`MockIQueryServer`
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are separate writes so without this
+    # keep-alive connections stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _get_task(self, taskid):
+        with self.server.lock:
+            task = self.server.tasks.get(taskid)
+            if task is not None:
+                task.requests += 1
+            return task
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length).decode('utf-8'))
+        if self.path != BASE_PATH:
+            self._send_json(404, {'error': 'not found'})
+            return
+        taskid = self.server.create_task(query['geneList'])
+        self._send_json(202, {'id': taskid})
+
+    def do_GET(self):
+        if not self.path.startswith(BASE_PATH):
+            self._send_json(404, {'error': 'not found'})
+            return
+        parts = self.path[len(BASE_PATH):].split('/')
+        task = self._get_task(parts[0])
+        if task is None:
+            self._send_json(404, {'error': 'no such task'})
+            return
+        progress = task.get_progress()
+        if len(parts) > 1 and parts[1] == 'status':
+            status = 'processing'
+            if progress == 100:
+                status = 'complete'
+                if task.completed is None:
+                    task.completed = time.monotonic()
+            self._send_json(200, {'progress': progress,
+                                  'status': status})
+            return
+        if progress < 100:
+            self._send_json(404, {'error': 'task not complete'})
+            return
+        task.result_fetched = time.monotonic()
+        self._send_json(200, self.server.get_result(task))
+
+
+def main(args):
+    """
+    Runs mock server in foreground
+    """
+    parser = argparse.ArgumentParser(description='Runs mock iQuery server',
+                                     formatter_class=argparse.
+                                     ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--port', default=8080, type=int,
+                        help='Port to listen on')
+    parser.add_argument('--min_latency', default=0.5, type=float,
+                        help='Minimum seconds for a task to complete')
+    parser.add_argument('--max_latency', default=2.0, type=float,
+                        help='Maximum seconds for a task to complete')
+    parser.add_argument('--numresults', default=100, type=int,
+                        help='Number of results in completed result')
+    parser.add_argument('--numhits', default=10, type=int,
+                        help='Number of hit genes per result')
+    theargs = parser.parse_args(args[1:])
+    server = MockIQueryServer(address=('127.0.0.1', theargs.port),
+                              min_latency=theargs.min_latency,
+                              max_latency=theargs.max_latency,
+                              numresults=theargs.numresults,
+                              numhits=theargs.numhits)
+    sys.stdout.write('Listening on ' + server.get_url() + '\n')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
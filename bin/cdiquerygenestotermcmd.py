@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+
+# Slim entry point installed as the command line script. Python
+# never caches bytecode for the script it runs so all the code lives
+# in cdiquerygenestoterm.cdiquerygenestotermcmd where it is compiled
+# once and loaded from __pycache__ on later runs
+import sys
+
+from cdiquerygenestoterm.cdiquerygenestotermcmd import main
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
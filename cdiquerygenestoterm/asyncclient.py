@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import asyncio
+
+from cdiquerygenestoterm.cdiquerygenestotermcmd import SOURCE_LIST
+from cdiquerygenestoterm.cdiquerygenestotermcmd import read_inputfile
+from cdiquerygenestoterm.cdiquerygenestotermcmd import get_user_agent
+from cdiquerygenestoterm.cdiquerygenestotermcmd import is_task_done
+from cdiquerygenestoterm.cdiquerygenestotermcmd import is_prunable
+from cdiquerygenestoterm.cdiquerygenestotermcmd import\
+    create_best_result_object_hook
+from cdiquerygenestoterm.cdiquerygenestotermcmd import get_polling_strategy
+from cdiquerygenestoterm.cdiquerygenestotermcmd import get_max_wait
+from cdiquerygenestoterm.cdiquerygenestotermcmd import get_output_for_result
+from cdiquerygenestoterm.cdiquerygenestotermcmd import\
+    get_cache_key_for_genes
+from cdiquerygenestoterm.cdiquerygenestotermcmd import _get_cached_result
+from cdiquerygenestoterm.cdiquerygenestotermcmd import _get_canonicalizer
+from cdiquerygenestoterm.canonical import group_genesets
+from cdiquerygenestoterm.reader import get_genes_from_string
+from cdiquerygenestoterm.term import to_jsonable
+from cdiquerygenestoterm.polling import FixedPollingStrategy
+from cdiquerygenestoterm.polling import PollTimer
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+def is_available():
+    """
+    Checks if aiohttp is installed. It is needed by
+    :py:func:`create_session` and by the functions in this module
+    when no session is passed in. The coroutines in this module
+    never block the event loop so many queries can be run at once
+    on a single thread
+
+    :return: True if aiohttp is installed
+    :rtype: bool
+    """
+    return aiohttp is not None
+
+
+def _check_available():
+    """
+    :raises ImportError: if aiohttp is not installed
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for the async client, '
+                          'install it with: pip install aiohttp')
+
+
+def create_session(pool_size=100, keep_alive=True):
+    """
+    Creates :py:class:`aiohttp.ClientSession` for use with the
+    coroutines in this module. Must be called while an event loop
+    is running and the session should be closed by the caller
+
+    :param pool_size: maximum number of connections open at once
+    :type pool_size: int
+    :param keep_alive: if False connections are closed after
+                       every request
+    :type keep_alive: bool
+    :raises ImportError: if aiohttp is not installed
+    :return: session
+    :rtype: :py:class:`aiohttp.ClientSession`
+    """
+    _check_available()
+    connector = aiohttp.TCPConnector(limit=pool_size,
+                                     force_close=not keep_alive)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def _get_request_errors():
+    """
+    Gets exceptions that denote a failed request
+
+    :rtype: tuple
+    """
+    if aiohttp is None:
+        return asyncio.TimeoutError, OSError
+    return asyncio.TimeoutError, OSError, aiohttp.ClientError
+
+
+def _get_client_timeout(timeout):
+    """
+    Gets **timeout** in the form passed to
+    :py:meth:`aiohttp.ClientSession.request`
+
+    :param timeout: timeout in seconds
+    :type timeout: float
+    """
+    if aiohttp is None:
+        return timeout
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+async def _request(session, method, url, timeout=30, **kwargs):
+    """
+    Makes http request with **session** that fails if the request
+    and reading of the response take longer than **timeout**.
+    The timeout is enforced by the client and not
+    :py:func:`asyncio.wait_for` which can swallow a cancellation
+    that arrives as the request completes
+
+    :param session: session to make request with
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param method: http method
+    :type method: str
+    :param url: url
+    :type url: str
+    :param timeout: timeout for http request in seconds
+    :raises asyncio.TimeoutError: if request timed out
+    :return: (status code, body) tuple
+    :rtype: tuple
+    """
+    async with session.request(method, url,
+                               timeout=_get_client_timeout(timeout),
+                               **kwargs) as res:
+        return res.status, await res.text()
+
+
+async def submit_query_async(resturl, genes, user_agent, session,
+                             timeout=30):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.submit_query`
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param genes: genes to query
+    :type genes: list
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param session: session to use for request
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param timeout: timeout for http request in seconds
+    :return: id of task or None if service did not accept query
+    :rtype: str
+    """
+    query = {'geneList': genes,
+             'sourceList': SOURCE_LIST}
+    status, text = await _request(session, 'POST',
+                                  resturl + '/integratedsearch/v1/',
+                                  timeout=timeout,
+                                  json=query,
+                                  headers={'Content-Type':
+                                           'application/json',
+                                           'User-Agent': user_agent})
+    if status != 202:
+        sys.stderr.write('Got error status from service: ' +
+                         str(status) + ' : ' + text + '\n')
+        return None
+    return json.loads(text)['id']
+
+
+async def get_task_status_async(resturl, taskid, user_agent, session,
+                                timeout=30):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.get_task_status`
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param taskid: id of task
+    :type taskid: str
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param session: session to use for request
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param timeout: timeout for http request in seconds
+    :return: status of task as a dict with ``progress`` and
+             ``status`` or None if service returned an error
+    :rtype: dict
+    """
+    status, text = await _request(session, 'GET',
+                                  resturl + '/integratedsearch/v1/' +
+                                  taskid + '/status',
+                                  timeout=timeout,
+                                  headers={'Content-Type':
+                                           'application/json',
+                                           'User_agent': user_agent})
+    if status != 200:
+        sys.stderr.write('Received error : ' + str(status) +
+                         ' while polling for completion')
+        return None
+    return json.loads(text)
+
+
+async def get_completed_result_async(resturl, taskid, user_agent, session,
+                                     timeout=30, prune=False):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.get_completed_result`
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param taskid: id of task
+    :type taskid: str
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param session: session to use for request
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param timeout: timeout for http request in seconds
+    :param prune: if True, every result other than the one
+                  with best similarity is reduced to only its
+                  similarity during parsing to save memory
+    :type prune: bool
+    :return: result from iQuery or None if service returned an error
+    :rtype: dict
+    """
+    status, text = await _request(session, 'GET',
+                                  resturl + '/integratedsearch/v1/' +
+                                  taskid,
+                                  timeout=timeout,
+                                  headers={'Content-Type':
+                                           'application/json',
+                                           'User_agent': user_agent})
+    if status != 200:
+        sys.stderr.write('Received http error: ' + str(status) + '\n')
+        return None
+    if prune is True:
+        return json.loads(text, object_hook=create_best_result_object_hook())
+    return json.loads(text)
+
+
+async def wait_for_result_async(resturl, taskid, user_agent, session,
+                                polling_interval=1, timeout=30,
+                                retrycount=180, polling_strategy=None,
+                                max_wait=None):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.wait_for_result`
+    that waits between checks with :py:func:`asyncio.sleep`
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param taskid: id of task
+    :type taskid: str
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param session: session to use for requests
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param polling_interval: seconds to wait between checks,
+                             ignored if **polling_strategy** is set
+    :param timeout: timeout for each http request in seconds
+    :param retrycount: maximum number of checks, ignored if
+                       **max_wait** is set
+    :param polling_strategy: decides time to wait between checks
+    :type polling_strategy:
+        :py:class:`~cdiquerygenestoterm.polling.PollingStrategy`
+    :param max_wait: seconds to wait for task to complete
+    :type max_wait: float
+    :return: True if task completed successfully False otherwise
+    :rtype: bool
+    """
+    if polling_strategy is None:
+        polling_strategy = FixedPollingStrategy(interval=polling_interval)
+    max_polls = None
+    if max_wait is None:
+        max_polls = retrycount
+    timer = PollTimer(polling_strategy, max_wait=max_wait,
+                      max_polls=max_polls)
+    while timer.is_expired() is False:
+        progress = None
+        try:
+            jsonres = await get_task_status_async(resturl, taskid,
+                                                  user_agent, session,
+                                                  timeout=timeout)
+            if is_task_done(jsonres):
+                if jsonres['status'] != 'complete':
+                    sys.stderr.write('Got error: ' + str(jsonres) + '\n')
+                    return False
+                return True
+            if jsonres is not None:
+                progress = jsonres['progress']
+        except _get_request_errors() as e:
+            sys.stderr.write('Received exception waiting for task'
+                             'completion: ' + str(e))
+
+        timer.record_poll(progress=progress)
+        if timer.is_expired():
+            break
+        await asyncio.sleep(timer.get_time_until_next_poll())
+    return False
+
+
+async def _query_genes_async(genes, theargs, session):
+    """
+    Runs a task for **genes** on iQuery.
+    See :py:func:`run_iquery_for_genes_async`
+    """
+    resturl = theargs.url
+    user_agent = get_user_agent()
+
+    taskid = await submit_query_async(resturl, genes, user_agent, session,
+                                      timeout=theargs.timeout)
+    if taskid is None:
+        return None
+
+    if await wait_for_result_async(resturl, taskid, user_agent, session,
+                                   timeout=theargs.timeout,
+                                   retrycount=theargs.retrycount,
+                                   polling_interval=theargs.
+                                   polling_interval,
+                                   polling_strategy=get_polling_strategy(
+                                       theargs),
+                                   max_wait=get_max_wait(theargs)) is False:
+        return None
+
+    resjson = await get_completed_result_async(resturl, taskid, user_agent,
+                                               session,
+                                               timeout=theargs.timeout,
+                                               prune=is_prunable(theargs))
+    return get_output_for_result(resjson, theargs)
+
+
+async def run_iquery_for_genes_async(genes, theargs, session,
+                                     task_timeout=None, cache=None,
+                                     canonicalizer=None, canonical=False):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.run_iquery_for_genes`
+
+    Cancelling the returned coroutine stops polling right away,
+    the task is left to finish on iQuery.
+
+    :param genes: genes to query
+    :type genes: list
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param task_timeout: seconds the whole query, from submission to
+                         getting the result, may take or None for
+                         no limit
+    :type task_timeout: float
+    :param cache: cache of results, reads and writes are blocking
+                  file operations
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param canonical: if True, **genes** are already in canonical
+                      form and are used as is
+    :type canonical: bool
+    :return: mapped term as a dict or None if no term was found
+             or **task_timeout** was exceeded
+    :rtype: dict
+    """
+    if canonical is False:
+        genes = _get_canonicalizer(canonicalizer).canonicalize(genes)
+    if genes is None:
+        sys.stderr.write('No genes found in query\n')
+        return None
+    cachekey = None
+    if cache is not None:
+        cachekey = get_cache_key_for_genes(genes, theargs)
+        theres = _get_cached_result(cache, cachekey, theargs)
+        if theres is not None:
+            return to_jsonable(theres)
+    try:
+        if task_timeout is None or not hasattr(asyncio, 'timeout'):
+            theres = await asyncio.wait_for(_query_genes_async(genes,
+                                                               theargs,
+                                                               session),
+                                            task_timeout)
+        else:
+            # unlike wait_for this never swallows a cancellation
+            async with asyncio.timeout(task_timeout):
+                theres = await _query_genes_async(genes, theargs, session)
+    except asyncio.TimeoutError:
+        sys.stderr.write('Query of ' + str(len(genes)) + ' genes did not '
+                         'complete within ' + str(task_timeout) +
+                         ' seconds\n')
+        return None
+    if cache is not None and theres is not None:
+        cache.put(cachekey, theres)
+    return theres
+
+
+async def run_iquery_batch_async(genesets, theargs, session=None,
+                                 task_timeout=None, cache=None,
+                                 canonicalizer=None):
+    """
+    Queries every gene set in **genesets** at the same time on the
+    running event loop with no more than ``theargs.max_inflight``
+    tasks on iQuery at once. Gene sets with identical canonical
+    genes are queried once. Failure of a single gene set is written
+    to standard error and its result is set to None
+
+    :param genesets: (id, genes) tuples where genes can be None
+    :type genesets: list
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests, if None one is
+                    created via :py:func:`create_session` and closed
+                    when done
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param task_timeout: seconds each query may take or None
+    :type task_timeout: float
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :raises ImportError: if **session** is None and aiohttp is
+                         not installed
+    :return: mapped term (or None) keyed by gene set id in
+             same order as **genesets**
+    :rtype: dict
+    """
+    if session is None:
+        async with create_session(pool_size=theargs.pool_size,
+                                  keep_alive=not theargs.
+                                  disable_keepalive) as session:
+            return await run_iquery_batch_async(genesets, theargs,
+                                                session=session,
+                                                task_timeout=task_timeout,
+                                                cache=cache,
+                                                canonicalizer=canonicalizer)
+
+    semaphore = asyncio.Semaphore(max(1, theargs.max_inflight))
+
+    async def _run(genes):
+        if genes is None:
+            return None
+        async with semaphore:
+            try:
+                return await run_iquery_for_genes_async(
+                    genes, theargs, session, task_timeout=task_timeout,
+                    cache=cache, canonical=True)
+            except Exception as e:
+                # CancelledError is not an Exception so cancellation
+                # still propagates
+                sys.stderr.write('Caught exception querying ' +
+                                 str(len(genes)) + ' genes: ' +
+                                 str(e) + '\n')
+                return None
+
+    canonicalizer = _get_canonicalizer(canonicalizer)
+    groups = group_genesets(genesets, canonicalizer=canonicalizer)
+    results = await asyncio.gather(*[_run(genes)
+                                     for genes, _ in groups])
+    bysetid = {}
+    for (_, setids), theres in zip(groups, results):
+        for setid in setids:
+            bysetid[setid] = theres
+    return dict([(setid, bysetid[setid]) for setid, _ in genesets])
+
+
+async def run_iquery_async(inputfile, theargs, session=None,
+                           task_timeout=None, cache=None,
+                           canonicalizer=None):
+    """
+    Async version of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.run_iquery`
+
+    :param inputfile: file with comma separated genes
+    :type inputfile: str
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests, if None one is
+                    created via :py:func:`create_session` and closed
+                    when done
+    :type session: :py:class:`aiohttp.ClientSession`
+    :param task_timeout: seconds the query may take or None
+    :type task_timeout: float
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :raises ImportError: if **session** is None and aiohttp is
+                         not installed
+    :return: mapped term as a dict or None if no term was found
+    :rtype: dict
+    """
+    genes = get_genes_from_string(read_inputfile(inputfile))
+    if genes is None:
+        sys.stderr.write('No genes found in input')
+        return None
+    if session is None:
+        async with create_session(pool_size=theargs.pool_size,
+                                  keep_alive=not theargs.
+                                  disable_keepalive) as session:
+            return await run_iquery_for_genes_async(
+                genes, theargs, session, task_timeout=task_timeout,
+                cache=cache, canonicalizer=canonicalizer)
+    return await run_iquery_for_genes_async(genes, theargs, session,
+                                            task_timeout=task_timeout,
+                                            cache=cache,
+                                            canonicalizer=canonicalizer)
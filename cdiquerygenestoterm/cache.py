@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import hashlib
+
+from cdiquerygenestoterm.canonical import DEFAULT_CANONICALIZER
+from cdiquerygenestoterm.canonical import get_folded_key
+
+
+def normalize_genes(genes):
+    """
+    Normalizes **genes** so the same set of genes given in
+    a different order, case or with duplicates, surrounding
+    whitespace or empty entries results in the same list
+
+    :param genes: genes
+    :type genes: list
+    :return: sorted, de-duplicated, upper cased genes
+    :rtype: list
+    """
+    genes = DEFAULT_CANONICALIZER.canonicalize(genes)
+    if genes is None:
+        return []
+    return list(get_folded_key(genes))
+
+
+def get_cache_key(genes, sourcelist, resturl, options=None):
+    """
+    Gets key that identifies a query of **genes** against
+    **sourcelist** on iQuery service at **resturl**
+
+    :param genes: genes in query
+    :type genes: list
+    :param sourcelist: sources queried
+    :type sourcelist: list
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param options: JSON serializable options that change the
+                    result stored under the key or None
+    :type options: dict
+    :return: hex digest
+    :rtype: str
+    """
+    keydata = {'genes': normalize_genes(genes),
+               'sourceList': sorted(sourcelist),
+               'url': resturl.rstrip('/')}
+    if options is not None:
+        keydata['options'] = options
+    payload = json.dumps(keydata, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Persistent cache of mapped term results stored as one JSON
+    file per entry under a directory. Entries older than **ttl**
+    seconds are treated as missing and once more than
+    **max_entries** are stored the least recently written
+    entries are removed.
+    """
+
+    RESULT_KEY = 'result'
+    CREATED_KEY = 'created'
+
+    # fraction of max_entries to keep when evicting so the
+    # directory is not rescanned on every write once full
+    EVICT_TO_FRACTION = 0.9
+
+    def __init__(self, cachedir, ttl=None, max_entries=None,
+                 clock=time.time):
+        """
+        Constructor
+
+        :param cachedir: directory to store cache in, created if
+                         it does not exist
+        :type cachedir: str
+        :param ttl: seconds an entry is valid for, None means forever
+        :type ttl: float
+        :param max_entries: maximum number of entries to keep, None
+                            means no limit
+        :type max_entries: int
+        :param clock: function returning current time in seconds
+        """
+        self._cachedir = cachedir
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._clock = clock
+        os.makedirs(cachedir, exist_ok=True)
+        self._entry_count = len(self._get_entry_paths())
+
+    def _get_entry_path(self, key):
+        """
+        Gets path to file for **key**
+        """
+        return os.path.join(self._cachedir, key[0:2], key + '.json')
+
+    def _get_entry_paths(self):
+        """
+        Gets paths to all entries in cache
+        """
+        paths = []
+        for subdir in os.scandir(self._cachedir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.json'):
+                    paths.append(entry.path)
+        return paths
+
+    def get_entry_count(self):
+        """
+        Gets number of entries in cache
+
+        :rtype: int
+        """
+        return self._entry_count
+
+    def get(self, key):
+        """
+        Gets result stored under **key**
+
+        :param key: key from :py:func:`get_cache_key`
+        :type key: str
+        :return: result or None if not in cache or expired
+        :rtype: dict
+        """
+        try:
+            with open(self._get_entry_path(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._ttl is not None and\
+                self._clock() - entry[ResultCache.CREATED_KEY] > self._ttl:
+            return None
+        return entry[ResultCache.RESULT_KEY]
+
+    def put(self, key, result):
+        """
+        Stores **result** under **key**, replacing any existing
+        entry. The write is atomic so concurrent readers never
+        see a partial entry.
+
+        :param key: key from :py:func:`get_cache_key`
+        :type key: str
+        :param result: JSON serializable result
+        :type result: dict
+        """
+        import tempfile
+        path = self._get_entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        existed = os.path.isfile(path)
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({ResultCache.CREATED_KEY: self._clock(),
+                           ResultCache.RESULT_KEY: result}, f)
+            os.replace(tmppath, path)
+        except Exception:
+            if os.path.isfile(tmppath):
+                os.remove(tmppath)
+            raise
+        if not existed:
+            self._entry_count += 1
+        if self._max_entries is not None and\
+                self._entry_count > self._max_entries:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes least recently written entries until no more than
+        :py:const:`EVICT_TO_FRACTION` of **max_entries** remain.
+        Expired entries are not removed explicitly, but being
+        older they go first.
+        """
+        if self._max_entries is None:
+            return
+        target = int(self._max_entries * ResultCache.EVICT_TO_FRACTION)
+        entries = []
+        for path in self._get_entry_paths():
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((mtime, path))
+        entries.sort()
+        keep = len(entries)
+        for mtime, path in entries:
+            if keep <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            keep -= 1
+        self._entry_count = keep
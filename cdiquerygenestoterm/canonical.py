@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import csv
+from collections import OrderedDict
+
+
+def load_aliases(aliasfile):
+    """
+    Loads table of gene aliases from **aliasfile** which has one
+    ``<alias>`` ``<symbol>`` pair per line separated by a tab or
+    comma. Blank lines and lines starting with ``#`` are skipped.
+
+    :param aliasfile: path to file
+    :type aliasfile: str
+    :raises ValueError: if a line does not have two columns
+    :return: upper cased alias => upper cased symbol
+    :rtype: dict
+    """
+    aliases = {}
+    with open(aliasfile, 'r', newline='') as f:
+        for linenum, line in enumerate(f, start=1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            delimiter = '\t' if '\t' in line else ','
+            row = next(csv.reader([line], delimiter=delimiter))
+            if len(row) != 2 or len(row[0].strip()) == 0 or\
+                    len(row[1].strip()) == 0:
+                raise ValueError('Expected <alias> and <symbol> on line ' +
+                                 str(linenum) + ' of ' + aliasfile)
+            aliases[row[0].strip().upper()] = row[1].strip().upper()
+    return aliases
+
+
+def get_folded_key(genes):
+    """
+    Gets key of canonical **genes** that is the same for gene sets
+    differing only in case, used to group and cache them
+
+    :param genes: canonical genes, see
+                  :py:meth:`GeneCanonicalizer.canonicalize`
+    :type genes: list
+    :return: upper cased genes or None if **genes** is None
+    :rtype: tuple
+    """
+    if genes is None:
+        return None
+    return tuple([gene.upper() for gene in genes])
+
+
+class GeneCanonicalizer(object):
+    """
+    Turns a list of genes into the canonical form sent to iQuery.
+    Genes are trimmed and, if in **aliases**, ignoring case, replaced
+    by their symbol. Empty entries and duplicates, ignoring case, are
+    dropped and the genes are sorted, ignoring case, so the same set
+    of genes given in any order is the same query. Case is kept as
+    given, the first spelling of a gene winning, so genes sent to
+    iQuery and the hit genes it reports are as the caller wrote them.
+    Use :py:func:`get_folded_key` to compare gene sets ignoring case
+    """
+
+    def __init__(self, aliases=None):
+        """
+        Constructor
+
+        :param aliases: upper cased alias => symbol, see
+                        :py:func:`load_aliases`
+        :type aliases: dict
+        """
+        if aliases is None:
+            aliases = {}
+        self._aliases = aliases
+
+    def canonicalize(self, genes):
+        """
+        Gets canonical form of **genes**
+
+        :param genes: genes
+        :type genes: list
+        :return: sorted and de-duplicated symbols, both ignoring
+                 case, or None if **genes** is None or has no genes
+        :rtype: list
+        """
+        if genes is None:
+            return None
+        # upper cased symbol => symbol as first given
+        symbols = {}
+        for gene in genes:
+            if gene is None:
+                continue
+            gene = gene.strip()
+            if len(gene) == 0:
+                continue
+            folded = gene.upper()
+            symbol = self._aliases.get(folded)
+            if symbol is not None:
+                gene = symbol
+                folded = symbol.upper()
+            if folded not in symbols:
+                symbols[folded] = gene
+        if len(symbols) == 0:
+            return None
+        return [symbols[folded] for folded in sorted(symbols)]
+
+
+DEFAULT_CANONICALIZER = GeneCanonicalizer()
+
+
+def group_genesets(genesets, canonicalizer=DEFAULT_CANONICALIZER):
+    """
+    Groups **genesets** whose canonical genes are identical so each
+    unique set only needs to be queried once
+
+    :param genesets: iterable of (id, list of genes) tuples
+    :param canonicalizer: used to get canonical genes
+    :type canonicalizer: :py:class:`GeneCanonicalizer`
+    :return: (canonical genes, ids) tuples in order the first id of
+             each group was found. Gene sets whose genes differ only
+             in case are grouped under the genes of the first one.
+             Gene sets without genes are grouped under None
+    :rtype: list
+    """
+    groups = OrderedDict()
+    for setid, genes in genesets:
+        genes = canonicalizer.canonicalize(genes)
+        key = get_folded_key(genes)
+        if key not in groups:
+            groups[key] = (genes, [])
+        groups[key][1].append(setid)
+    return list(groups.values())
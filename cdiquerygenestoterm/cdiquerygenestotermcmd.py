@@ -2,16 +2,71 @@
 
 import os
 import sys
+import copy
 import argparse
 import json
-import requests
 import time
+import math
+import threading
+import heapq
 import cdiquerygenestoterm
+from cdiquerygenestoterm.polling import FixedPollingStrategy
+from cdiquerygenestoterm.polling import BackoffPollingStrategy
+from cdiquerygenestoterm.polling import PollTimer
+from cdiquerygenestoterm.memo import MappedTermMemo
+from cdiquerygenestoterm.journal import TaskJournal
+from cdiquerygenestoterm.canonical import DEFAULT_CANONICALIZER
+from cdiquerygenestoterm.canonical import GeneCanonicalizer
+from cdiquerygenestoterm.term import MappedTerm
+from cdiquerygenestoterm.term import to_jsonable
+from cdiquerygenestoterm.term import from_jsonable
+from cdiquerygenestoterm.result import SOURCES_KEY
+from cdiquerygenestoterm.result import RESULTS_KEY
+from cdiquerygenestoterm.result import DETAILS_KEY
+from cdiquerygenestoterm.result import SIMILARITY_KEY
+from cdiquerygenestoterm.result import PVALUE_KEY
+from cdiquerygenestoterm.result import RANK_BY_SIMILARITY
+from cdiquerygenestoterm.result import RANK_BY_PVALUE
+from cdiquerygenestoterm.result import RANK_BY_COMBINED
+from cdiquerygenestoterm.result import RANK_BY_CHOICES
+from cdiquerygenestoterm.reader import open_inputfile
+from cdiquerygenestoterm.reader import iter_genesets
+from cdiquerygenestoterm.reader import get_genes_from_string
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.metrics import NULL_TASK_METRICS
+from cdiquerygenestoterm.metrics import COUNTER_CACHE_HITS
+from cdiquerygenestoterm.metrics import COUNTER_JOURNAL_HITS
+from cdiquerygenestoterm.metrics import COUNTER_LOCAL_ANSWERS
+from cdiquerygenestoterm.metrics import COUNTER_LOCAL_FALLBACKS
+from cdiquerygenestoterm.metrics import COUNTER_MEMO_HITS
+from cdiquerygenestoterm.metrics import COUNTER_POLLS
+from cdiquerygenestoterm.metrics import SPAN_DOWNLOAD
+from cdiquerygenestoterm.metrics import SPAN_LOCAL
+from cdiquerygenestoterm.metrics import SPAN_MAP
+from cdiquerygenestoterm.metrics import SPAN_PARSE
+from cdiquerygenestoterm.metrics import SPAN_POLL
+from cdiquerygenestoterm.metrics import SPAN_SUBMIT
+from cdiquerygenestoterm.metrics import SPAN_TOTAL
+from cdiquerygenestoterm.metrics import SPAN_WAIT
 
-SOURCES_KEY = 'sources'
-RESULTS_KEY = 'results'
-DETAILS_KEY = 'details'
-SIMILARITY_KEY = 'similarity'
+# requests, and modules that depend on it, along with the cache
+# are imported only when needed since importing them takes longer
+# than the rest of this tool takes to start. Keep it that way,
+# see benchmarks/bench_import.py
+
+SOURCE_LIST = ['enrichment']
+
+# how gene sets are resolved with --snapshot, see --resolution
+RESOLUTION_LOCAL = 'local'
+RESOLUTION_HYBRID = 'hybrid'
+RESOLUTION_CHOICES = [RESOLUTION_LOCAL, RESOLUTION_HYBRID]
+
+# where a term came from with --resolution hybrid, see RESOLUTION_KEY
+RESOLVED_MEMO = 'memo'
+RESOLVED_CACHE = 'cache'
+RESOLVED_JOURNAL = 'journal'
+RESOLVED_LOCAL = 'local'
+RESOLVED_REMOTE = 'remote'
 
 
 def _parse_arguments(desc, args):
@@ -24,8 +79,39 @@ def _parse_arguments(desc, args):
     help_fm = argparse.ArgumentDefaultsHelpFormatter
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=help_fm)
-    parser.add_argument('input',
-                        help='comma delimited list of genes in file')
+    parser.add_argument('input', nargs='?',
+                        help='comma delimited list of genes in file. '
+                             'Not needed with --daemon or '
+                             '--write_snapshot')
+    parser.add_argument('--batch', action='store_true',
+                        help='If set, input is treated as a file of '
+                             'multiple gene sets, see --input_format. '
+                             'Output is a JSON object of '
+                             'id => result')
+    parser.add_argument('--input_format', default='auto',
+                        choices=['auto', 'lines', 'jsonl', 'newline',
+                                 'json'],
+                        help='Format of input in --batch mode. '
+                             'lines: one comma delimited list of genes '
+                             'per line, optionally prefixed with an id '
+                             'and a tab. jsonl: one JSON object with '
+                             'genes and optionally id per line. '
+                             'newline: one gene per line with gene '
+                             'sets separated by blank lines. json: '
+                             'JSON object of id => list of genes. auto '
+                             'picks lines, jsonl or json from the first '
+                             'line. Input can be gzipped. All but json '
+                             'are read one gene set at a time')
+    parser.add_argument('--output_format', default='json',
+                        choices=['json', 'jsonl'],
+                        help='Format of output in --batch mode. json: '
+                             'a JSON object of id => result written '
+                             'once all gene sets are done. jsonl: one '
+                             'line of {"id": <id>, "result": <result>} '
+                             'per gene set written as soon as it is '
+                             'done, in order of completion, so memory '
+                             'use does not grow with number of gene '
+                             'sets')
     parser.add_argument('--url', default='http://public.ndexbio.org',
                         help='Endpoint of REST service')
     parser.add_argument('--polling_interval', default=1,
@@ -41,79 +127,891 @@ def _parse_arguments(desc, args):
                              'request. Take this value times'
                              'the --polling_interval to determine'
                              'how long this tool will wait'
-                             'for a completed result')
-    return parser.parse_args(args)
+                             'for a completed result. Ignored if '
+                             '--max_wait is set')
+    parser.add_argument('--polling_strategy', default='fixed',
+                        choices=['fixed', 'backoff'],
+                        help='How to wait between checks on task '
+                             'completion. fixed waits '
+                             '--polling_interval seconds. backoff '
+                             'checks quickly at first then waits '
+                             'exponentially longer, with jitter, up '
+                             'to --max_polling_interval seconds '
+                             'using progress reported by the service '
+                             'to estimate time remaining')
+    parser.add_argument('--max_polling_interval', default=10,
+                        type=float,
+                        help='Maximum time in seconds to wait between '
+                             'checks on task completion when '
+                             '--polling_strategy is backoff')
+    parser.add_argument('--max_wait', type=float,
+                        help='Time in seconds to wait for a task to '
+                             'complete. If unset, '
+                             '--retrycount is used for fixed '
+                             'strategy and --retrycount times '
+                             '--polling_interval for backoff')
+    parser.add_argument('--topk', type=int,
+                        help='If set, output is a JSON list of up to '
+                             'this many terms ranked by --rankby '
+                             'instead of a single term')
+    parser.add_argument('--rankby', default=RANK_BY_SIMILARITY,
+                        choices=RANK_BY_CHOICES,
+                        help='How to rank results. similarity ranks '
+                             'by highest cosine similarity, pvalue by '
+                             'lowest p-value and combined by '
+                             'similarity times -log10(p-value). Ties '
+                             'go to the result listed first by the '
+                             'service')
+    parser.add_argument('--max_pvalue', type=float,
+                        help='If set, ignore results with a p-value '
+                             'above this value. Requires numpy')
+    parser.add_argument('--min_hits', type=int,
+                        help='If set, ignore results with fewer hit '
+                             'genes than this value. Requires numpy')
+    parser.add_argument('--pvalue_adjust', default='none',
+                        choices=['none', 'bh'],
+                        help='Multiple testing adjustment of p-values. '
+                             'bh is Benjamini-Hochberg. Adjusted '
+                             'p-values are used for --max_pvalue, '
+                             'ranking and are output as p_value. '
+                             'Requires numpy. NumPy is only used when '
+                             'filtering or adjusting p-values with '
+                             'these flags and is not a speedup, '
+                             'results are otherwise pruned and ranked '
+                             'faster without it')
+    parser.add_argument('--cachedir',
+                        help='Directory to cache results in. If set, '
+                             'gene sets already queried are returned '
+                             'from this cache without contacting the '
+                             'REST service')
+    parser.add_argument('--cache_ttl', default=2592000, type=float,
+                        help='Time in seconds a cached result is valid')
+    parser.add_argument('--cache_max_entries', default=100000, type=int,
+                        help='Maximum number of results to keep in '
+                             'cache. Oldest results are removed first')
+    parser.add_argument('--refresh_cache', action='store_true',
+                        help='If set, cached results are ignored, but '
+                             'new results are still written to cache')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='If set, cache is not read or written '
+                             'even if --cachedir is set')
+    parser.add_argument('--aliases',
+                        help='File with one <alias> and <symbol> pair, '
+                             'tab or comma delimited, per line. Genes '
+                             'matching an alias, ignoring case, are '
+                             'replaced with the symbol before '
+                             'querying. Genes are always trimmed, '
+                             'de-duplicated and sorted, ignoring case')
+    parser.add_argument('--snapshot',
+                        help='JSON snapshot, optionally gzipped, or '
+                             'binary snapshot, see --write_snapshot, of '
+                             'the networks iQuery searches. If set, gene '
+                             'sets are mapped locally with '
+                             'hypergeometric p values and cosine '
+                             'similarity without contacting iQuery')
+    parser.add_argument('--resolution', default=RESOLUTION_LOCAL,
+                        choices=RESOLUTION_CHOICES,
+                        help='How gene sets not in a cache are resolved '
+                             'when --snapshot is set. local maps them '
+                             'only with --snapshot. hybrid maps them with '
+                             '--snapshot and queries iQuery if no term '
+                             'is found locally or the best local '
+                             'similarity is below --min_local_similarity. '
+                             'With hybrid, each term gets a resolution '
+                             'of memo, cache, journal, local or remote '
+                             'saying where it came from')
+    parser.add_argument('--min_local_similarity', default=0.0,
+                        type=float,
+                        help='With --resolution hybrid, gene sets whose '
+                             'best similarity in --snapshot is below '
+                             'this are sent to iQuery')
+    parser.add_argument('--write_snapshot',
+                        help='If set, --snapshot, which must be JSON, '
+                             'is converted to a binary snapshot written '
+                             'to this path and the tool exits. A binary '
+                             'snapshot given to --snapshot is memory '
+                             'mapped so it loads almost instantly and '
+                             'is shared by every process using it')
+    parser.add_argument('--snapshot_index',
+                        help='File with index of genes to networks in '
+                             '--snapshot. If it is newer than '
+                             '--snapshot it is memory mapped, otherwise '
+                             'the index is built and written to it')
+    parser.add_argument('--memo_size', default=10000, type=int,
+                        help='Maximum number of results to keep in '
+                             'memory in --batch mode so duplicate gene '
+                             'sets are only queried once. 0 disables')
+    parser.add_argument('--journal',
+                        help='File to record submitted tasks and their '
+                             'results in when in --batch mode. If the '
+                             'file exists, gene sets already done are '
+                             'not queried again and tasks still '
+                             'running are polled instead of being '
+                             'resubmitted, allowing a failed run to be '
+                             'resumed')
+    parser.add_argument('--max_inflight', default=5, type=int,
+                        help='Maximum number of iQuery tasks to have '
+                             'submitted and running at once in '
+                             '--batch mode')
+    parser.add_argument('--processes', default=1, type=int,
+                        help='Number of worker processes to run gene '
+                             'sets on in --batch mode. Each worker has '
+                             'its own connection pool and up to '
+                             '--max_inflight tasks running. Output '
+                             'order is unchanged. Cannot be used with '
+                             '--journal')
+    parser.add_argument('--shard_size', default=50, type=int,
+                        help='Number of gene sets sent to a worker '
+                             'process at a time if --processes is '
+                             'more than 1')
+    parser.add_argument('--pool_size', default=10, type=int,
+                        help='Maximum number of connections to keep '
+                             'open to REST service')
+    parser.add_argument('--http_retries', default=3, type=int,
+                        help='Number of times to retry a http request '
+                             'that failed to connect or received a '
+                             '502 or 504 error. Submission of '
+                             'queries is only retried on connection '
+                             'failures')
+    parser.add_argument('--throttle_retries', default=5, type=int,
+                        help='Number of times to retry a http request, '
+                             'including submission of queries, that '
+                             'received a 429 or 503 error. Waits the '
+                             'time in the Retry-After header or '
+                             'backs off exponentially if not set')
+    parser.add_argument('--submit_rate', type=float,
+                        help='If set, maximum number of queries '
+                             'submitted per second')
+    parser.add_argument('--poll_rate', type=float,
+                        help='If set, maximum number of task status '
+                             'checks per second')
+    parser.add_argument('--disable_keepalive', action='store_true',
+                        help='If set, connections are closed after '
+                             'every request')
+    parser.add_argument('--metrics',
+                        help='If set, write JSON summary of time spent '
+                             'submitting, waiting on, polling, '
+                             'downloading, parsing and mapping results '
+                             'along with number of polls, bytes '
+                             'received and http status codes for each '
+                             'gene set and over the whole run to this '
+                             'file')
+    parser.add_argument('--prometheus_textfile',
+                        help='If set, write counters of tasks '
+                             'submitted, completed, failed and in '
+                             'flight, cache hits and histograms of '
+                             'polls per task and end to end latency '
+                             'in Prometheus text format to this file, '
+                             'for the node exporter textfile '
+                             'collector, when the run ends or, in '
+                             '--daemon mode, after every job')
+    parser.add_argument('--prometheus_listen',
+                        help='If set, serve the metrics of '
+                             '--prometheus_textfile at /metrics on '
+                             'this <host>:<port> while running. In '
+                             '--daemon mode they are also served at '
+                             '/metrics on --listen')
+    parser.add_argument('--daemon', action='store_true',
+                        help='If set, run until interrupted taking '
+                             'jobs via http on --listen and/or from '
+                             '--spooldir. A job is a JSON object with '
+                             'either genes (list of genes) or '
+                             'genesets (id => list of genes) and the '
+                             'result is the same JSON written to '
+                             'standard out without and with --batch')
+    parser.add_argument('--listen', default='127.0.0.1:8089',
+                        help='<host>:<port> to accept jobs POSTed as '
+                             'JSON on in --daemon mode. Set to empty '
+                             'string to disable')
+    parser.add_argument('--spooldir',
+                        help='Directory to take jobs from in --daemon '
+                             'mode. Jobs are <name>.json files with a '
+                             'JSON job or <name>.txt files with comma '
+                             'delimited genes. Results are written to '
+                             '<name>.result and errors to <name>.error')
+    parser.add_argument('--spool_interval', default=1.0, type=float,
+                        help='Time in seconds between checks of '
+                             '--spooldir for new jobs')
+    parser.add_argument('--workers', default=8, type=int,
+                        help='Number of jobs to run at once in '
+                             '--daemon mode')
+    theargs = parser.parse_args(args)
+    if theargs.input is None and theargs.daemon is False and\
+            theargs.write_snapshot is None:
+        parser.error('input is required unless --daemon or '
+                     '--write_snapshot is set')
+    return theargs
 
 
 def read_inputfile(inputfile):
     """
+    Reads **inputfile**, decompressing it if gzipped
 
-    :param inputfile:
-    :return:
+    :param inputfile: path to file
+    :type inputfile: str
+    :return: contents of file
+    :rtype: str
     """
-    with open(inputfile, 'r') as f:
+    with open_inputfile(inputfile) as f:
         return f.read()
 
 
+def get_user_agent():
+    """
+    Gets user agent sent with every request to iQuery
+
+    :return: user agent
+    :rtype: str
+    """
+    return 'cdiquerygenestoterm/' + cdiquerygenestoterm.__version__
+
+
+def create_session(pool_size=10, max_retries=3, backoff_factor=0.5,
+                   keep_alive=True, submit_rate=None, poll_rate=None,
+                   throttle_retries=5):
+    """
+    Creates :py:class:`requests.Session` that reuses connections
+    to the REST service. Pass the returned session to the functions
+    in this module so every request made shares the same connection
+    pool and rate limits.
+
+    Requests are sent through a
+    :py:class:`~cdiquerygenestoterm.ratelimit.RateLimitedAdapter`
+    so submissions and status checks can be rate limited and
+    requests that got a 429 or 503 error are retried.
+
+    :param pool_size: maximum number of connections to keep per host
+    :type pool_size: int
+    :param max_retries: number of times to retry a request that
+                        failed to connect or got a 502 or 504
+                        error. Only GET requests are retried on
+                        these errors
+    :type max_retries: int
+    :param backoff_factor: factor used to compute sleep between
+                           retries (see :py:class:`urllib3.util.Retry`)
+    :type backoff_factor: float
+    :param keep_alive: if False connections are closed after every
+                       request
+    :type keep_alive: bool
+    :param submit_rate: maximum submissions per second or None
+    :type submit_rate: float
+    :param poll_rate: maximum status checks per second or None
+    :type poll_rate: float
+    :param throttle_retries: number of times to retry a request
+                             that got a 429 or 503 error
+    :type throttle_retries: int
+    :return: session
+    :rtype: :py:class:`requests.Session`
+    """
+    import requests
+    from urllib3.util import Retry
+    from cdiquerygenestoterm.ratelimit import TokenBucket
+    from cdiquerygenestoterm.ratelimit import RateLimitedAdapter
+    retry_args = {'total': max_retries,
+                  'connect': max_retries,
+                  'backoff_factor': backoff_factor,
+                  'status_forcelist': (502, 504),
+                  'raise_on_status': False}
+    try:
+        retry = Retry(allowed_methods=frozenset(['GET']), **retry_args)
+    except TypeError:
+        # older versions of urllib3
+        retry = Retry(method_whitelist=frozenset(['GET']), **retry_args)
+
+    submit_bucket = TokenBucket(rate=submit_rate,
+                                burst=int(max(1, submit_rate or 1)))
+    poll_bucket = TokenBucket(rate=poll_rate,
+                              burst=int(max(1, poll_rate or 1)))
+    adapter = RateLimitedAdapter(submit_bucket=submit_bucket,
+                                 poll_bucket=poll_bucket,
+                                 throttle_retries=throttle_retries,
+                                 backoff_factor=backoff_factor,
+                                 pool_connections=pool_size,
+                                 pool_maxsize=pool_size,
+                                 max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if keep_alive is False:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+class LazySession(object):
+    """
+    Stands in for :py:class:`requests.Session` creating the real
+    session, and importing :py:mod:`requests`, the first time it
+    is used so runs that never make a http request, such as a
+    cache hit, skip that cost
+    """
+
+    def __init__(self, factory):
+        """
+        Constructor
+
+        :param factory: function that takes no arguments and
+                        returns the session
+        """
+        self._factory = factory
+        self._session = None
+        self._lock = threading.Lock()
+
+    def get_session(self):
+        """
+        Gets session creating it if needed
+
+        :rtype: :py:class:`requests.Session`
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._factory()
+        return self._session
+
+    def is_created(self):
+        """
+        Checks if session has been created
+
+        :rtype: bool
+        """
+        return self._session is not None
+
+    def close(self):
+        """
+        Closes session if it was created
+        """
+        if self._session is not None:
+            self._session.close()
+
+    def __getattr__(self, name):
+        return getattr(self.get_session(), name)
+
+
+def create_session_from_args(theargs):
+    """
+    Creates session via :py:func:`create_session` using
+    values from command line arguments **theargs**
+
+    :param theargs: parsed command line arguments
+    :return: session
+    :rtype: :py:class:`requests.Session`
+    """
+    return create_session(pool_size=theargs.pool_size,
+                          max_retries=theargs.http_retries,
+                          keep_alive=not theargs.disable_keepalive,
+                          submit_rate=theargs.submit_rate,
+                          poll_rate=theargs.poll_rate,
+                          throttle_retries=theargs.throttle_retries)
+
+
+def create_cache_from_args(theargs):
+    """
+    Creates :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    using values from command line arguments **theargs**
+
+    :param theargs: parsed command line arguments
+    :return: cache or None if ``theargs.cachedir`` is unset or
+             ``theargs.no_cache`` is True
+    :rtype: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    """
+    if theargs.cachedir is None or theargs.no_cache is True:
+        return None
+    from cdiquerygenestoterm.cache import ResultCache
+    return ResultCache(os.path.abspath(theargs.cachedir),
+                       ttl=theargs.cache_ttl,
+                       max_entries=theargs.cache_max_entries)
+
+
+def create_exporter_from_args(theargs):
+    """
+    Creates :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    if command line arguments **theargs** ask for Prometheus metrics
+
+    :param theargs: parsed command line arguments
+    :return: exporter or None if neither ``theargs.prometheus_textfile``
+             nor ``theargs.prometheus_listen`` is set
+    :rtype: :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    """
+    if theargs.prometheus_textfile is None and\
+            theargs.prometheus_listen is None:
+        return None
+    from cdiquerygenestoterm.exporter import PrometheusExporter
+    return PrometheusExporter()
+
+
+def create_metrics_from_args(theargs, exporter=None):
+    """
+    Creates :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    if command line arguments **theargs** or **exporter** need it
+
+    :param theargs: parsed command line arguments
+    :param exporter: exporter to tell of every task
+    :type exporter:
+        :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    :return: metrics or None if ``theargs.metrics`` and **exporter**
+             are None
+    :rtype: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    """
+    if theargs.metrics is None and exporter is None:
+        return None
+    return RunMetrics(listener=exporter,
+                      keep_tasks=theargs.metrics is not None)
+
+
+def start_exporter_server(exporter, listen):
+    """
+    Serves **exporter** at ``/metrics`` on a daemon thread
+
+    :param exporter: exporter to serve
+    :type exporter:
+        :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    :param listen: <host>:<port> to listen on, if None
+                   nothing is started
+    :type listen: str
+    :return: server or None if **listen** is None
+    :rtype: :py:class:`http.server.ThreadingHTTPServer`
+    """
+    if exporter is None or listen is None:
+        return None
+    from cdiquerygenestoterm.exporter import create_http_server
+    host, port = listen.rsplit(':', 1)
+    server = create_http_server(exporter, host=host, port=int(port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_canonicalizer_from_args(theargs):
+    """
+    Creates :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    using alias table in ``theargs.aliases`` if set
+
+    :param theargs: parsed command line arguments
+    :return: canonicalizer
+    :rtype: :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    """
+    if theargs.aliases is None:
+        return DEFAULT_CANONICALIZER
+    from cdiquerygenestoterm.canonical import load_aliases
+    return GeneCanonicalizer(aliases=load_aliases(os.path.abspath(
+        theargs.aliases)))
+
+
+def create_engine_from_args(theargs):
+    """
+    Loads :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    from ``theargs.snapshot`` if set, using index in
+    ``theargs.snapshot_index`` if set
+
+    :param theargs: parsed command line arguments
+    :return: engine or None if ``theargs.snapshot`` is not set
+    :rtype: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    """
+    if theargs.snapshot is None:
+        return None
+    from cdiquerygenestoterm.local import load_snapshot
+    indexfile = None
+    if theargs.snapshot_index is not None:
+        indexfile = os.path.abspath(theargs.snapshot_index)
+    return load_snapshot(os.path.abspath(theargs.snapshot),
+                         indexfile=indexfile)
+
+
+def write_snapshot_from_args(theargs):
+    """
+    Converts JSON snapshot in ``theargs.snapshot`` to binary snapshot
+    written to ``theargs.write_snapshot``, see
+    :py:func:`~cdiquerygenestoterm.snapshot.convert_snapshot`
+
+    :param theargs: parsed command line arguments
+    :raises ValueError: if ``theargs.snapshot`` is not set or is not
+                        a valid JSON snapshot
+    :return: 0 upon success
+    :rtype: int
+    """
+    if theargs.snapshot is None:
+        raise ValueError('--snapshot must be set with --write_snapshot')
+    from cdiquerygenestoterm.snapshot import convert_snapshot
+    numnetworks = convert_snapshot(os.path.abspath(theargs.snapshot),
+                                   os.path.abspath(theargs.write_snapshot))
+    sys.stderr.write('Wrote ' + str(numnetworks) + ' networks to ' +
+                     theargs.write_snapshot + '\n')
+    return 0
+
+
+def _get_canonicalizer(canonicalizer):
+    """
+    Gets canonicalizer to use
+
+    :param canonicalizer: canonicalizer or None
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :return: **canonicalizer** or one without aliases if None
+    :rtype: :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    """
+    if canonicalizer is None:
+        return DEFAULT_CANONICALIZER
+    return canonicalizer
+
+
+def _get_cached_result(cache, key, theargs):
+    """
+    Gets result for **key** from **cache** unless
+    ``theargs.refresh_cache`` is set
+
+    :return: cached result or None
+    :rtype: :py:class:`~cdiquerygenestoterm.term.MappedTerm`
+    """
+    if cache is None or theargs.refresh_cache is True:
+        return None
+    return from_jsonable(cache.get(key))
+
+
+def _get_http(session):
+    """
+    Gets object to make http requests with
+
+    :param session: session or None
+    :return: **session** or :py:mod:`requests` if **session** is None
+    """
+    if session is None:
+        import requests
+        return requests
+    return session
+
+
+def _get_metrics(metrics):
+    """
+    Gets object to record metrics of a task with
+
+    :param metrics: metrics or None
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :return: **metrics** or a
+             :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+             that records nothing if **metrics** is None
+    :rtype: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    """
+    if metrics is None:
+        return NULL_TASK_METRICS
+    return metrics
+
+
+def _create_task_metrics(metrics, name):
+    """
+    Creates metrics for task **name** in **metrics**
+
+    :param metrics: metrics of run or None
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :return: metrics of task or None if **metrics** is None
+    :rtype: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    """
+    if metrics is None:
+        return None
+    return metrics.create_task(name)
+
+
+def _get_request_exception():
+    """
+    Gets base class of exceptions raised by :py:mod:`requests`.
+    Meant for ``except`` clauses which are only evaluated once an
+    exception is raised, by which time :py:mod:`requests` is
+    already imported
+
+    :rtype: type
+    """
+    import requests
+    return requests.exceptions.RequestException
+
+
+def submit_query(resturl, genes, user_agent, timeout=30,
+                 session=None, metrics=None):
+    """
+    Submits **genes** as a new enrichment task to iQuery
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param genes: genes to query
+    :type genes: list
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param timeout: timeout for http request in seconds
+    :param session: session to use for request, if None
+                    a new connection is made
+    :type session: :py:class:`requests.Session`
+    :param metrics: if set, time of request is added to the
+                    ``submit`` span, response is recorded and
+                    task is marked as submitted
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :return: id of task or None if service did not accept query
+    :rtype: str
+    """
+    metrics = _get_metrics(metrics)
+    query = {'geneList': genes,
+             'sourceList': SOURCE_LIST}
+    with metrics.span(SPAN_SUBMIT):
+        res = _get_http(session).post(resturl + '/integratedsearch/v1/',
+                                      json=query,
+                                      headers={'Content-Type':
+                                               'application/json',
+                                               'User-Agent': user_agent},
+                                      timeout=timeout)
+    metrics.record_response(res)
+    if res.status_code != 202:
+        sys.stderr.write('Got error status from service: ' +
+                         str(res.status_code) + ' : ' + res.text + '\n')
+        return None
+    taskid = res.json()['id']
+    metrics.record_submitted(taskid)
+    return taskid
+
+
+def get_task_status(resturl, taskid, user_agent, timeout=30,
+                    session=None, metrics=None):
+    """
+    Gets status of task with **taskid** from iQuery
+
+    :param resturl: base url of iQuery service
+    :type resturl: str
+    :param taskid: id of task
+    :type taskid: str
+    :param user_agent: user agent to pass in header
+    :type user_agent: str
+    :param timeout: timeout for http request in seconds
+    :param session: session to use for request, if None
+                    a new connection is made
+    :type session: :py:class:`requests.Session`
+    :param metrics: if set, ``polls`` is incremented, time of
+                    request is added to the ``poll`` span and
+                    response is recorded
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :raises requests.exceptions.RequestException: if request failed
+    :return: status of task as a dict with ``progress`` and
+             ``status`` or None if service returned an error
+    :rtype: dict
+    """
+    metrics = _get_metrics(metrics)
+    metrics.incr(COUNTER_POLLS)
+    with metrics.span(SPAN_POLL):
+        res = _get_http(session).get(resturl + '/integratedsearch/v1/' +
+                                     taskid + '/status',
+                                     headers={'Content-Type':
+                                              'application/json',
+                                              'User_agent': user_agent},
+                                     timeout=timeout)
+    metrics.record_response(res)
+    if res.status_code != 200:
+        sys.stderr.write('Received error : ' +
+                         str(res.status_code) +
+                         ' while polling for completion')
+        return None
+    return res.json()
+
+
+def is_task_done(status):
+    """
+    Checks if task **status** from :py:func:`get_task_status`
+    denotes a finished task
+
+    :param status: status of task
+    :type status: dict
+    :return: True if task is no longer running
+    :rtype: bool
+    """
+    return status is not None and status.get('progress') == 100
+
+
+def create_best_result_object_hook():
+    """
+    Creates an ``object_hook`` for :py:func:`json.loads` that
+    prunes results while they are parsed. Every result that can
+    no longer be the one picked by
+    :py:func:`get_best_result_by_similarity` is cleared, as soon
+    as it is parsed or a better result is found, down to just its
+    similarity score. This frees the memory held by the ``hitGenes``
+    and other fields of those results while parsing continues.
+
+    Since pruned results keep their position and similarity,
+    :py:func:`get_best_result_by_similarity` and
+    :py:func:`get_result_in_mapped_term_json` return the same
+    output for the pruned and the full result.
+
+    A new hook must be created for every document parsed.
+
+    :return: function to pass as ``object_hook``
+    """
+    state = {'best_similarity': -1.0, 'best_result': None}
+
+    def _prune(result, similarity):
+        result.clear()
+        result[DETAILS_KEY] = {SIMILARITY_KEY: similarity}
+
+    def _object_hook(obj):
+        details = obj.get(DETAILS_KEY)
+        if not isinstance(details, dict) or SIMILARITY_KEY not in details:
+            return obj
+        similarity = details[SIMILARITY_KEY]
+        best_similarity = state['best_similarity']
+
+        # same comparison as get_best_result_by_similarity()
+        if best_similarity == -1.0 or similarity > best_similarity:
+            if state['best_result'] is not None:
+                _prune(state['best_result'], best_similarity)
+            state['best_result'] = obj
+            state['best_similarity'] = similarity
+        else:
+            _prune(obj, similarity)
+        return obj
+
+    return _object_hook
+
+
 def get_completed_result(resturl, taskid, user_agent,
-                         timeout=30):
+                         timeout=30, session=None, prune=False,
+                         metrics=None):
     """
 
     :param resultasdict:
+    :param session: session to use for request, if None
+                    a new connection is made
+    :type session: :py:class:`requests.Session`
+    :param prune: if True, every result other than the one
+                  with best similarity is reduced to only its
+                  similarity during parsing to save memory.
+                  See :py:func:`create_best_result_object_hook`
+    :type prune: bool
+    :param metrics: if set, time of request is added to the
+                    ``download`` span, time to decode the JSON to
+                    the ``parse`` span and response is recorded
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
     :return:
     """
-    res = requests.get(resturl + '/integratedsearch/v1/' + taskid +
-                       '',
-                       headers={'Content-Type': 'application/json',
-                                'User_agent': user_agent},
-                       timeout=timeout)
+    metrics = _get_metrics(metrics)
+    with metrics.span(SPAN_DOWNLOAD):
+        res = _get_http(session).get(resturl + '/integratedsearch/v1/' +
+                                     taskid + '',
+                                     headers={'Content-Type':
+                                              'application/json',
+                                              'User_agent': user_agent},
+                                     timeout=timeout)
+    metrics.record_response(res)
     if res.status_code != 200:
         sys.stderr.write('Received http error: ' +
                          str(res.status_code) + '\n')
         return None
-    return res.json()
+    with metrics.span(SPAN_PARSE):
+        if prune is True:
+            return res.json(object_hook=create_best_result_object_hook())
+        return res.json()
+
+
+def get_polling_strategy(theargs):
+    """
+    Gets :py:class:`~cdiquerygenestoterm.polling.PollingStrategy`
+    set by ``theargs.polling_strategy``
+
+    :param theargs: parsed command line arguments
+    :return: strategy
+    :rtype: :py:class:`~cdiquerygenestoterm.polling.PollingStrategy`
+    """
+    if theargs.polling_strategy == 'backoff':
+        return BackoffPollingStrategy(initial_delay=min(0.25,
+                                                        theargs.
+                                                        polling_interval),
+                                      max_delay=theargs.
+                                      max_polling_interval)
+    return FixedPollingStrategy(interval=theargs.polling_interval)
+
+
+def get_max_wait(theargs):
+    """
+    Gets maximum time in seconds to wait for a task to complete.
+    This is ``theargs.max_wait`` if set. Otherwise for the fixed
+    polling strategy None is returned so ``theargs.retrycount``
+    limits the wait and for other strategies ``theargs.retrycount``
+    times ``theargs.polling_interval`` is returned.
+
+    :param theargs: parsed command line arguments
+    :return: seconds to wait or None
+    :rtype: float
+    """
+    if theargs.max_wait is not None:
+        return theargs.max_wait
+    if theargs.polling_strategy == 'fixed':
+        return None
+    return theargs.retrycount * theargs.polling_interval
 
 
 def wait_for_result(resturl, taskid, user_agent, polling_interval=1,
                     timeout=30,
-                    retrycount=180):
+                    retrycount=180, session=None,
+                    polling_strategy=None, max_wait=None, metrics=None):
     """
     Polls **resturl** with **taskid**
     :param resturl:
     :param taskid:
     :param user_agent:
-    :param polling_interval:
+    :param polling_interval: seconds to wait between checks,
+                             ignored if **polling_strategy** is set
     :param timeout:
-    :param retrycount:
+    :param retrycount: maximum number of checks, ignored if
+                       **max_wait** is set
+    :param session: session to use for requests, if None
+                    a new connection is made for every request
+    :type session: :py:class:`requests.Session`
+    :param polling_strategy: decides time to wait between checks
+    :type polling_strategy:
+        :py:class:`~cdiquerygenestoterm.polling.PollingStrategy`
+    :param max_wait: seconds to wait for task to complete
+    :type max_wait: float
+    :param metrics: if set, time spent in this function is added to
+                    the ``wait`` span along with metrics of every
+                    status check, see :py:func:`get_task_status`
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
     :return: True if task completed successfully False otherwise
     :rtype: bool
     """
-    counter = 0
-    while counter < retrycount:
+    with _get_metrics(metrics).span(SPAN_WAIT):
+        return _wait_for_result(resturl, taskid, user_agent,
+                                polling_interval=polling_interval,
+                                timeout=timeout, retrycount=retrycount,
+                                session=session,
+                                polling_strategy=polling_strategy,
+                                max_wait=max_wait, metrics=metrics)
+
+
+def _wait_for_result(resturl, taskid, user_agent, polling_interval=1,
+                     timeout=30, retrycount=180, session=None,
+                     polling_strategy=None, max_wait=None, metrics=None):
+    """
+    Polls for completion of task. See :py:func:`wait_for_result`
+    """
+    if polling_strategy is None:
+        polling_strategy = FixedPollingStrategy(interval=polling_interval)
+    max_polls = None
+    if max_wait is None:
+        max_polls = retrycount
+    timer = PollTimer(polling_strategy, max_wait=max_wait,
+                      max_polls=max_polls)
+    while timer.is_expired() is False:
+        progress = None
         try:
-            res = requests.get(resturl + '/integratedsearch/v1/' +
-                               taskid + '/status',
-                               headers={'Content-Type': 'application/json',
-                                        'User_agent': user_agent},
-                               timeout=timeout)
-
-            if res.status_code is 200:
-                jsonres = res.json()
-                if jsonres['progress'] == 100:
-                    if jsonres['status'] != 'complete':
-                        sys.stderr.write('Got error: ' + str(jsonres) + '\n')
-                        return False
-                    return True
-            else:
-                sys.stderr.write('Received error : ' +
-                                 str(res.status_code) +
-                                 ' while polling for completion')
-        except requests.exceptions.RequestException as e:
+            jsonres = get_task_status(resturl, taskid, user_agent,
+                                      timeout=timeout, session=session,
+                                      metrics=metrics)
+            if is_task_done(jsonres):
+                if jsonres['status'] != 'complete':
+                    sys.stderr.write('Got error: ' + str(jsonres) + '\n')
+                    return False
+                return True
+            if jsonres is not None:
+                progress = jsonres['progress']
+        except _get_request_exception() as e:
             sys.stderr.write('Received exception waiting for task'
                              'completion: ' + str(e))
 
-        counter += 1
-        time.sleep(polling_interval)
+        timer.record_poll(progress=progress)
+        if timer.is_expired():
+            break
+        time.sleep(timer.get_time_until_next_poll())
     return False
 
 
@@ -139,97 +1037,1157 @@ def get_best_result_by_similarity(resultasdict):
     return best_result
 
 
-def get_result_in_mapped_term_json(resultasdict):
+def get_result_score(result, rankby=RANK_BY_SIMILARITY):
     """
+    Gets score of **result** where a higher score is a better result
 
-    :param resultasdict:
-    :return:
+    :param result: a single result from iQuery
+    :type result: dict
+    :param rankby: one of :py:const:`RANK_BY_CHOICES`. For
+                   :py:const:`RANK_BY_SIMILARITY` score is the
+                   similarity, for :py:const:`RANK_BY_PVALUE` score
+                   is the negated p-value and for
+                   :py:const:`RANK_BY_COMBINED` score is similarity
+                   times -log10(p-value)
+    :type rankby: str
+    :raises ValueError: if **rankby** is not a known value
+    :return: score
+    :rtype: float
+    """
+    details = result[DETAILS_KEY]
+    if rankby == RANK_BY_SIMILARITY:
+        return details[SIMILARITY_KEY]
+    if rankby == RANK_BY_PVALUE:
+        return -details[PVALUE_KEY]
+    if rankby == RANK_BY_COMBINED:
+        return details[SIMILARITY_KEY] *\
+            -math.log10(max(details[PVALUE_KEY], sys.float_info.min))
+    raise ValueError('Unknown rank by value: ' + str(rankby))
+
+
+def get_top_results(resultasdict, k=1, rankby=RANK_BY_SIMILARITY):
+    """
+    Gets the **k** best results across all sources in
+    **resultasdict** ranked by :py:func:`get_result_score`.
+    A bounded heap is used so selection is O(n log k).
+    Results with equal scores are ordered by their position
+    in **resultasdict** with earlier results first. For
+    k = 1 and similarity this picks the same result as
+    :py:func:`get_best_result_by_similarity`
+
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :param k: maximum number of results to return
+    :type k: int
+    :param rankby: one of :py:const:`RANK_BY_CHOICES`
+    :type rankby: str
+    :return: best results, best first
+    :rtype: list
+    """
+    if k <= 0:
+        return []
+    heap = []
+    position = 0
+    for cursource in resultasdict[SOURCES_KEY]:
+        for curresult in cursource[RESULTS_KEY]:
+            # negated position makes earlier results win ties and
+            # since it is unique the results are never compared
+            entry = (get_result_score(curresult, rankby=rankby),
+                     -position, curresult)
+            position += 1
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+    heap.sort(reverse=True)
+    return [entry[2] for entry in heap]
+
+
+def _is_result_valid(resultasdict):
     """
+    Checks **resultasdict** has results, writing reason
+    to standard error if not
 
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :return: True if there are results
+    :rtype: bool
+    """
     if resultasdict is None:
         sys.stderr.write('Results are None\n')
-        return None
+        return False
 
     if SOURCES_KEY not in resultasdict:
         sys.stderr.write('No sources found in results\n')
-        return None
+        return False
 
     if resultasdict[SOURCES_KEY] is None:
         sys.stderr.write('Source is None\n')
-        return None
+        return False
 
     if len(resultasdict[SOURCES_KEY]) <= 0:
         sys.stderr.write('Source is empty\n')
-        return None
+        return False
 
     if RESULTS_KEY not in resultasdict[SOURCES_KEY][0]:
         sys.stderr.write('Results not in source\n')
-        return None
+        return False
 
     if resultasdict[SOURCES_KEY][0][RESULTS_KEY] is None:
         sys.stderr.write('First result is None')
-        return None
+        return False
 
     if len(resultasdict[SOURCES_KEY][0][RESULTS_KEY]) <= 0:
         sys.stderr.write('No result found\n')
+        return False
+    return True
+
+
+def get_mapped_term(result):
+    """
+    Converts a single **result** from iQuery into a term
+
+    :param result: a single result from iQuery
+    :type result: dict
+    :return: term with ``name``, ``source``, ``p_value``,
+             ``description``, ``term_size``, and ``intersections``
+    :rtype: dict
+    """
+    return MappedTerm.from_result(result).to_dict()
+
+
+def get_result_in_mapped_term_json(resultasdict, metrics=None):
+    """
+
+    :param resultasdict:
+    :param metrics: if set, time spent is added to the ``map`` span
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :return:
+    """
+    return to_jsonable(_get_best_term(resultasdict, metrics=metrics))
+
+
+def _get_best_term(resultasdict, metrics=None):
+    """
+    Gets best result in **resultasdict** by similarity as a term.
+    See :py:func:`get_result_in_mapped_term_json`
+
+    :rtype: :py:class:`~cdiquerygenestoterm.term.MappedTerm`
+    """
+    with _get_metrics(metrics).span(SPAN_MAP):
+        if not _is_result_valid(resultasdict):
+            return None
+
+        bestresult = get_best_result_by_similarity(resultasdict)
+        return MappedTerm.from_result(bestresult)
+
+
+def get_results_in_mapped_term_json(resultasdict, k=1,
+                                    rankby=RANK_BY_SIMILARITY):
+    """
+    Gets the **k** best results in **resultasdict** as terms.
+    See :py:func:`get_top_results`
+
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :param k: maximum number of terms
+    :type k: int
+    :param rankby: one of :py:const:`RANK_BY_CHOICES`
+    :type rankby: str
+    :return: terms best first or None if there were no results
+    :rtype: list
+    """
+    return to_jsonable(_get_top_terms(resultasdict, k=k, rankby=rankby))
+
+
+def _get_top_terms(resultasdict, k=1, rankby=RANK_BY_SIMILARITY):
+    """
+    Gets the **k** best results in **resultasdict** as terms.
+    See :py:func:`get_results_in_mapped_term_json`
+
+    :return: :py:class:`~cdiquerygenestoterm.term.MappedTerm` objects
+             best first or None if there were no results
+    :rtype: list
+    """
+    if not _is_result_valid(resultasdict):
         return None
+    return [MappedTerm.from_result(r)
+            for r in get_top_results(resultasdict, k=k, rankby=rankby)]
 
-    bestresult = get_best_result_by_similarity(resultasdict)
 
-    colon_loc = bestresult['description'].find(':')
-    if colon_loc == -1:
-        source = 'NA'
-    else:
-        source = bestresult['description'][0:colon_loc]
+def is_vectorized(theargs):
+    """
+    Checks if results should be ranked and filtered with
+    :py:mod:`cdiquerygenestoterm.vectorized`, which is only the case
+    when filtering or adjustment of p-values is requested since
+    ranking alone is faster with :py:func:`get_top_results` and
+    pruning, see ``benchmarks/bench_selection.py``
 
-    theres = {'name': bestresult['description'][colon_loc + 1:].lstrip(),
-              'source': source,
-              'p_value': bestresult['details']['PValue'],
-              'description': bestresult['url'],
-              'term_size': bestresult['nodes'],
-              'intersections': bestresult['hitGenes']}
+    :param theargs: parsed command line arguments
+    :rtype: bool
+    """
+    return theargs.max_pvalue is not None or\
+        theargs.min_hits is not None or\
+        theargs.pvalue_adjust != 'none'
 
-    return theres
 
+def is_hybrid(theargs):
+    """
+    Checks if gene sets are mapped locally, falling back to iQuery,
+    and terms are labeled with where they came from. See
+    :py:func:`get_local_result` and :py:func:`set_resolution`
 
-def run_iquery(inputfile, theargs):
+    :param theargs: parsed command line arguments
+    :rtype: bool
+    """
+    return theargs.resolution == RESOLUTION_HYBRID
+
+
+def set_resolution(theres, resolution, theargs):
+    """
+    Gets **theres** with ``resolution`` set to **resolution** in
+    each term if :py:func:`is_hybrid` is True. Terms are copied so
+    terms held in caches are not changed. Terms as dicts have it
+    under :py:const:`~cdiquerygenestoterm.term.RESOLUTION_KEY`
+
+    :param theres: None, term or list of terms
+    :param resolution: where result came from, one of the
+                       ``RESOLVED_*`` values such as
+                       :py:const:`RESOLVED_REMOTE`
+    :type resolution: str
+    :param theargs: parsed command line arguments
+    :return: **theres** with resolution set
+    """
+    if theres is None or not is_hybrid(theargs):
+        return theres
+    if isinstance(theres, list):
+        return [set_resolution(term, resolution, theargs)
+                for term in theres]
+    term = copy.copy(theres)
+    term.resolution = resolution
+    return term
+
+
+def is_prunable(theargs):
+    """
+    Checks if the output requested by **theargs** only needs the
+    result with best similarity so the completed result can be
+    pruned while parsing. See :py:func:`get_completed_result`
+
+    :param theargs: parsed command line arguments
+    :rtype: bool
+    """
+    return theargs.topk is None and\
+        theargs.rankby == RANK_BY_SIMILARITY and\
+        not is_vectorized(theargs)
+
+
+def _get_vectorized_output_for_result(resultasdict, theargs):
+    """
+    Gets output for **resultasdict** using
+    :py:func:`cdiquerygenestoterm.vectorized.get_top_results`.
+    See :py:func:`get_output_for_result`
+    """
+    from cdiquerygenestoterm import vectorized
+
+    if not _is_result_valid(resultasdict):
+        return None
+    k = 1
+    if theargs.topk is not None:
+        k = theargs.topk
+    terms = []
+    for result, pvalue in vectorized.\
+            get_top_results(resultasdict, k=k, rankby=theargs.rankby,
+                            max_pvalue=theargs.max_pvalue,
+                            min_hits=theargs.min_hits,
+                            pvalue_adjust=theargs.pvalue_adjust):
+        term = MappedTerm.from_result(result)
+        term.p_value = pvalue
+        terms.append(term)
+
+    if theargs.topk is not None:
+        return terms
+    if len(terms) == 0:
+        sys.stderr.write('No result passed filters\n')
+        return None
+    return terms[0]
+
+
+def get_output_for_result(resultasdict, theargs, metrics=None):
+    """
+    Gets output for **resultasdict**. If ``theargs.topk`` is None
+    this is the best term as a dict, otherwise a list of the
+    ``theargs.topk`` best terms. Terms are ranked by
+    ``theargs.rankby``
+
+    If :py:func:`is_vectorized` is True, results are first filtered
+    by ``theargs.max_pvalue`` and ``theargs.min_hits``.
+
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :param theargs: parsed command line arguments
+    :param metrics: if set, time spent is added to the ``map`` span
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :return: term as dict, list of terms, or None if no results
+    """
+    return to_jsonable(_get_output_for_result(resultasdict, theargs,
+                                              metrics=metrics))
+
+
+def _get_output_for_result(resultasdict, theargs, metrics=None):
+    """
+    Gets output for **resultasdict** with terms as
+    :py:class:`~cdiquerygenestoterm.term.MappedTerm` objects, as kept
+    in memory while gene sets are run. See
+    :py:func:`get_output_for_result`
+    """
+    if is_prunable(theargs):
+        return _get_best_term(resultasdict, metrics=metrics)
+    with _get_metrics(metrics).span(SPAN_MAP):
+        return _get_ranked_output_for_result(resultasdict, theargs)
+
+
+def _get_ranked_output_for_result(resultasdict, theargs):
+    """
+    Gets output for **resultasdict** when :py:func:`is_prunable`
+    is False. See :py:func:`get_output_for_result`
+    """
+    if is_vectorized(theargs):
+        return _get_vectorized_output_for_result(resultasdict, theargs)
+    if theargs.topk is None:
+        theres = _get_top_terms(resultasdict, k=1, rankby=theargs.rankby)
+        if theres is None:
+            return None
+        return theres[0]
+    return _get_top_terms(resultasdict, k=theargs.topk,
+                          rankby=theargs.rankby)
+
+
+def get_cache_key_for_genes(genes, theargs):
+    """
+    Gets key for **genes** in caches via
+    :py:func:`~cdiquerygenestoterm.cache.get_cache_key` taking
+    into account options in **theargs** that change the output
+
+    :param genes: genes
+    :type genes: list
+    :param theargs: parsed command line arguments
+    :return: key
+    :rtype: str
+    """
+    options = None
+    if not is_prunable(theargs):
+        options = {'topk': theargs.topk, 'rankby': theargs.rankby,
+                   'max_pvalue': theargs.max_pvalue,
+                   'min_hits': theargs.min_hits,
+                   'pvalue_adjust': theargs.pvalue_adjust}
+    from cdiquerygenestoterm.cache import get_cache_key
+    return get_cache_key(genes, SOURCE_LIST, theargs.url,
+                         options=options)
+
+
+def run_iquery(inputfile, theargs, session=None, cache=None, memo=None,
+               metrics=None, canonicalizer=None, engine=None):
     """
     todo
 
     :param inputfile:
     :param theargs:
-    :param gprofwrapper:
+    :param session: session to use for requests
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param metrics: metrics of run, the query is recorded as a task
+                    named ``input``
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, gene sets not in **memo** or **cache** are
+                   mapped by it, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
     :return:
     """
-    genes = read_inputfile(inputfile)
-    genes = genes.strip(',').strip('\n').split(',')
-    if genes is None or (len(genes) == 1 and len(genes[0].strip()) == 0):
+    genes = get_genes_from_string(read_inputfile(inputfile))
+    if genes is None:
         sys.stderr.write('No genes found in input')
         return None
-    user_agent = 'cdiquerygenestoterm/' + cdiquerygenestoterm.__version__
+    return run_iquery_for_genes(genes, theargs, session=session,
+                                cache=cache, memo=memo,
+                                metrics=_create_task_metrics(metrics,
+                                                             'input'),
+                                canonicalizer=canonicalizer,
+                                engine=engine)
+
+
+def run_iquery_for_genes(genes, theargs, session=None, cache=None,
+                         memo=None, metrics=None, canonicalizer=None,
+                         engine=None):
+    """
+    Submits canonical form of **genes** to iQuery, waits for
+    the task to complete and returns the best result mapped
+    to a term
+
+    If **memo** is set, it is checked first and identical
+    gene sets queried at the same time from other threads
+    share a single iQuery task. If **cache** is set, it
+    is checked next and a found term is written to it.
+    If **engine** is set, the genes are then mapped locally
+    instead of on iQuery unless ``theargs.resolution`` is hybrid and
+    no good enough term is found locally, see
+    :py:func:`get_local_result`. With hybrid, the term says where it
+    came from, see :py:func:`set_resolution`
+
+    :param genes: genes to query
+    :type genes: list
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param metrics: if set, spans and counters of the query are
+                    recorded in it with the whole query in the
+                    ``total`` span after which it is finished
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, used before iQuery, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :return: mapped term as a dict or None if no term was found
+    :rtype: dict
+    """
+    theres = None
+    try:
+        with _get_metrics(metrics).span(SPAN_TOTAL):
+            genes = _get_canonicalizer(canonicalizer).canonicalize(genes)
+            if genes is None:
+                sys.stderr.write('No genes found in query\n')
+                return None
+            theres, resolution = _run_iquery_for_genes(genes, theargs,
+                                                       session=session,
+                                                       cache=cache,
+                                                       memo=memo,
+                                                       metrics=metrics,
+                                                       engine=engine)
+    finally:
+        _get_metrics(metrics).finish(theres is not None)
+    return to_jsonable(set_resolution(theres, resolution, theargs))
+
+
+def _run_iquery_for_genes(genes, theargs, session=None, cache=None,
+                          memo=None, metrics=None, engine=None):
+    """
+    Runs query for :py:func:`run_iquery_for_genes` checking
+    **memo** then **cache**
+
+    :return: (:py:class:`~cdiquerygenestoterm.term.MappedTerm` or
+             None if no term was found, where term came from) tuple
+    :rtype: tuple
+    """
+    if cache is None and memo is None:
+        return _query_genes(genes, theargs, session=session,
+                            metrics=metrics, engine=engine)
+
+    cachekey = get_cache_key_for_genes(genes, theargs)
+    if memo is None:
+        return _query_genes(genes, theargs, session=session,
+                            cache=cache, cachekey=cachekey,
+                            metrics=metrics, engine=engine)
+
+    computed = []
+
+    def _compute():
+        theres, resolution = _query_genes(genes, theargs,
+                                          session=session, cache=cache,
+                                          cachekey=cachekey,
+                                          metrics=metrics, engine=engine)
+        computed.append(resolution)
+        return theres
+
+    theres = memo.get_or_compute(cachekey, _compute)
+    if len(computed) == 0:
+        _get_metrics(metrics).incr(COUNTER_MEMO_HITS)
+        return theres, RESOLVED_MEMO
+    return theres, computed[0]
+
+
+def _query_genes(genes, theargs, session=None, cache=None,
+                 cachekey=None, metrics=None, engine=None):
+    """
+    Checks **cache** for **genes** and if not found
+    maps them with **engine**, if set, or runs a task on
+    iQuery. See :py:func:`run_iquery_for_genes`
+
+    :param cachekey: key of **genes** in **cache**
+    :type cachekey: str
+    :return: (:py:class:`~cdiquerygenestoterm.term.MappedTerm` or
+             None if no term was found, where term came from) tuple
+    :rtype: tuple
+    """
     resturl = theargs.url
+    if cache is not None:
+        theres = _get_cached_result(cache, cachekey, theargs)
+        if theres is not None:
+            _get_metrics(metrics).incr(COUNTER_CACHE_HITS)
+            return theres, RESOLVED_CACHE
 
-    query = {'geneList': genes,
-             'sourceList': ['enrichment']}
-    res = requests.post(resturl + '/integratedsearch/v1/',
-                       json=query, headers={'Content-Type': 'application/json',
-                                            'User-Agent': user_agent},
-                        timeout=theargs.timeout)
-    if res.status_code != 202:
-        sys.stderr.write('Got error status from service: ' + str(res.status_code) + ' : ' + res.text + '\n')
-        return None
+    if engine is not None:
+        theres = _get_local_result(genes, theargs, engine,
+                                   metrics=metrics)
+        if theres is not None or not is_hybrid(theargs):
+            return theres, RESOLVED_LOCAL
 
-    taskid = res.json()['id']
+    user_agent = get_user_agent()
+
+    taskid = submit_query(resturl, genes, user_agent,
+                          timeout=theargs.timeout, session=session,
+                          metrics=metrics)
+    if taskid is None:
+        return None, RESOLVED_REMOTE
 
     if wait_for_result(resturl, taskid, user_agent,
                        timeout=theargs.timeout,
                        retrycount=theargs.retrycount,
-                       polling_interval=theargs.polling_interval) is False:
-        return None
+                       polling_interval=theargs.polling_interval,
+                       session=session,
+                       polling_strategy=get_polling_strategy(theargs),
+                       max_wait=get_max_wait(theargs),
+                       metrics=metrics) is False:
+        return None, RESOLVED_REMOTE
 
     resjson = get_completed_result(resturl, taskid, user_agent,
-                                   timeout=theargs.timeout)
-    return get_result_in_mapped_term_json(resjson)
+                                   timeout=theargs.timeout,
+                                   session=session,
+                                   prune=is_prunable(theargs),
+                                   metrics=metrics)
+    theres = _get_output_for_result(resjson, theargs, metrics=metrics)
+    if cache is not None and theres is not None:
+        cache.put(cachekey, to_jsonable(theres))
+    return theres, RESOLVED_REMOTE
+
+
+def get_local_result(genes, theargs, engine, metrics=None):
+    """
+    Maps **genes** with **engine** giving output in same format as
+    a query of iQuery
+
+    If :py:func:`is_hybrid` is True and no result of **engine** has
+    a similarity of at least ``theargs.min_local_similarity``, None
+    is returned so the caller can query iQuery instead and the
+    ``local_fallbacks`` counter of **metrics** is incremented.
+    Otherwise the ``local_answers`` counter is incremented
+
+    Only the candidates needed for the output get p-values and
+    metadata computed, see :py:func:`get_local_candidate_count`
+
+    :param genes: canonical genes
+    :type genes: list
+    :param theargs: parsed command line arguments
+    :param engine: engine to map genes with
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :param metrics: if set, time spent is added to the ``local`` span
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :return: see :py:func:`get_output_for_result`
+    """
+    return to_jsonable(_get_local_result(genes, theargs, engine,
+                                         metrics=metrics))
+
+
+def _get_local_result(genes, theargs, engine, metrics=None):
+    """
+    Maps **genes** with **engine** with terms as
+    :py:class:`~cdiquerygenestoterm.term.MappedTerm` objects. See
+    :py:func:`get_local_result`
+    """
+    metrics = _get_metrics(metrics)
+    hybrid = is_hybrid(theargs)
+    with metrics.span(SPAN_LOCAL):
+        resultasdict = engine.query(genes,
+                                    k=get_local_candidate_count(theargs))
+        theres = None
+        if hybrid is False or\
+                _get_best_similarity(resultasdict) >= \
+                theargs.min_local_similarity:
+            theres = _get_output_for_result(resultasdict, theargs)
+    if hybrid is True and theres is None:
+        metrics.incr(COUNTER_LOCAL_FALLBACKS)
+    else:
+        metrics.incr(COUNTER_LOCAL_ANSWERS)
+    return theres
+
+
+def get_local_candidate_count(theargs):
+    """
+    Gets number of results of highest similarity the output
+    requested by **theargs** is picked from, so
+    :py:meth:`~cdiquerygenestoterm.local.LocalEnrichmentEngine.query`
+    only computes p-values of those. Ranking by p-value or filtering,
+    see :py:func:`is_vectorized`, needs every result
+
+    :param theargs: parsed command line arguments
+    :return: number of results or None if every result is needed
+    :rtype: int
+    """
+    if theargs.rankby != RANK_BY_SIMILARITY or is_vectorized(theargs):
+        return None
+    if theargs.topk is not None:
+        return theargs.topk
+    return 1
+
+
+def _get_best_similarity(resultasdict):
+    """
+    Gets highest similarity in **resultasdict**
+
+    :return: similarity or -1.0 if there are no results
+    :rtype: float
+    """
+    best = get_best_result_by_similarity(resultasdict)
+    if best is None:
+        return -1.0
+    return best[DETAILS_KEY][SIMILARITY_KEY]
+
+
+def iter_iquery_results(genesets, theargs, session=None, cache=None,
+                        memo=None, journal=None, metrics=None,
+                        canonicalizer=None, engine=None, canonical=False):
+    """
+    Runs iQuery on all **genesets** keeping up to
+    ``theargs.max_inflight`` tasks running on the service
+    at once. New gene sets are submitted as soon as a slot
+    frees up and every outstanding task is polled on the
+    schedule of :py:func:`get_polling_strategy` with the result
+    of a task fetched as soon as it is complete. A task is
+    abandoned once :py:func:`get_max_wait` seconds have passed or,
+    if that is None, after it has been polled
+    ``theargs.retrycount`` times.
+
+    The canonical form of each gene set, see **canonicalizer**, is
+    submitted. Gene sets found in **memo**, **cache** or, if done,
+    **journal**, looked up in that order, are returned without being
+    submitted and a gene set identical to one with a task still
+    running shares the result of that task. If **engine** is set,
+    other gene sets are mapped by it and only submitted if
+    ``theargs.resolution`` is hybrid and no good enough term is
+    found locally, see :py:func:`get_local_result`. With hybrid,
+    each term says where it came from, see :py:func:`set_resolution`
+
+    If **journal** is set, every submission and outcome is recorded
+    in it. Gene sets done in the **journal** are returned without
+    being submitted and gene sets submitted, but not done, are
+    polled using the task id in the **journal**. If the service
+    returns an error for the status of such a task, it no longer
+    knows of the task, so the gene set is submitted again right away.
+
+    Failure of a single gene set, be it in looking up, submitting,
+    polling or storing its result, is written to standard error
+    and its result is set to None
+
+    :param genesets: iterable of (id, list of genes) tuples
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests, ideally with
+                    a pool size of at least ``theargs.max_inflight``
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param journal: journal of tasks
+    :type journal: :py:class:`~cdiquerygenestoterm.journal.TaskJournal`
+    :param metrics: metrics of run, each gene set is recorded as a
+                    task named by its id. Time from submission until
+                    completion is seen is added to the ``wait`` span
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, gene sets not in **memo** or **cache** are
+                   mapped by it, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :param canonical: if True, genes in **genesets** are already in
+                      canonical form, or None, and are used as is so
+                      aliases are not applied twice
+    :type canonical: bool
+    :return: generator of (id, mapped term or None) tuples in
+             order of completion
+    """
+    canonicalizer = _get_canonicalizer(canonicalizer)
+    user_agent = get_user_agent()
+    resturl = theargs.url
+    max_inflight = max(1, theargs.max_inflight)
+    strategy = get_polling_strategy(theargs)
+    max_wait = get_max_wait(theargs)
+    max_polls = None
+    if max_wait is None:
+        max_polls = theargs.retrycount
+    pending = iter(genesets)
+    exhausted = False
+
+    # id of gene set => (task id, poll timer, cache key, task metrics,
+    #                    time gene set was taken, time task was submitted,
+    #                    genes, True if task id came from journal)
+    inflight = {}
+
+    # cache key => (id, task metrics, time gene set was taken) of
+    #              gene sets waiting on the same task
+    waiters = {}
+    while True:
+        while exhausted is False and len(inflight) < max_inflight:
+            try:
+                setid, genes = next(pending)
+            except StopIteration:
+                exhausted = True
+                break
+            start = time.perf_counter()
+            taskmetrics = _get_metrics(_create_task_metrics(metrics,
+                                                            setid))
+            if canonical is False:
+                genes = canonicalizer.canonicalize(genes)
+            if genes is None:
+                sys.stderr.write('No genes found for ' + setid + '\n')
+                _finish_task_metrics(taskmetrics, start, None)
+                yield setid, None
+                continue
+            cachekey = get_cache_key_for_genes(genes, theargs)
+            if cachekey in waiters:
+                waiters[cachekey].append((setid, taskmetrics, start))
+                continue
+            theres = None
+            resolution = None
+            record = None
+            try:
+                if memo is not None:
+                    theres = memo.get(cachekey)
+                    if theres is not None:
+                        taskmetrics.incr(COUNTER_MEMO_HITS)
+                        resolution = RESOLVED_MEMO
+                if theres is None and cache is not None:
+                    theres = _get_cached_result(cache, cachekey, theargs)
+                    if theres is not None:
+                        taskmetrics.incr(COUNTER_CACHE_HITS)
+                        resolution = RESOLVED_CACHE
+                        if memo is not None:
+                            memo.put(cachekey, theres)
+                if resolution is None and journal is not None:
+                    record = journal.get(cachekey)
+                    if record is not None and\
+                            record[TaskJournal.STATE] ==\
+                            TaskJournal.STATE_DONE:
+                        taskmetrics.incr(COUNTER_JOURNAL_HITS)
+                        theres = from_jsonable(record[TaskJournal.RESULT])
+                        resolution = RESOLVED_JOURNAL
+                if resolution is None and engine is not None:
+                    theres = _get_local_result(genes, theargs, engine,
+                                               metrics=taskmetrics)
+                    resolution = RESOLVED_LOCAL
+                    if theres is None and is_hybrid(theargs):
+                        resolution = None
+            except Exception as e:
+                sys.stderr.write('Caught exception looking up ' +
+                                 setid + ': ' + str(e) + '\n')
+                _finish_task_metrics(taskmetrics, start, None)
+                yield setid, None
+                continue
+            if theres is not None or resolution is not None:
+                _finish_task_metrics(taskmetrics, start, theres)
+                yield setid, set_resolution(theres, resolution, theargs)
+                continue
+            taskid = None
+            if record is not None and\
+                    record[TaskJournal.STATE] == TaskJournal.STATE_SUBMITTED:
+                taskid = record[TaskJournal.TASKID]
+                taskmetrics.record_resumed(taskid)
+            resumed = taskid is not None
+            if taskid is None:
+                taskid = _submit_task(setid, genes, theargs, user_agent,
+                                      session, journal, cachekey,
+                                      taskmetrics)
+                if taskid is None:
+                    _finish_task_metrics(taskmetrics, start, None)
+                    yield setid, None
+                    continue
+            inflight[setid] = (taskid, PollTimer(strategy,
+                                                 max_wait=max_wait,
+                                                 max_polls=max_polls),
+                               cachekey, taskmetrics, start,
+                               time.perf_counter(), genes, resumed)
+            waiters[cachekey] = []
+
+        if len(inflight) == 0:
+            return
+
+        for setid, (taskid, timer, cachekey, taskmetrics, start,
+                    submitted, genes, resumed) in list(inflight.items()):
+            if timer.is_due() is False:
+                continue
+            try:
+                rejected = False
+                resubmit_failed = False
+                try:
+                    status = get_task_status(resturl, taskid, user_agent,
+                                             timeout=theargs.timeout,
+                                             session=session,
+                                             metrics=taskmetrics)
+                    rejected = status is None
+                except _get_request_exception() as e:
+                    sys.stderr.write('Received exception waiting for task'
+                                     'completion: ' + str(e))
+                    status = None
+                if rejected is True and resumed is True:
+                    sys.stderr.write('Task ' + taskid + ' of ' + setid +
+                                     ' from journal is unknown to service,'
+                                     ' submitting again\n')
+                    if journal is not None:
+                        journal.record_failed(cachekey, taskid)
+                    newtaskid = _submit_task(setid, genes, theargs,
+                                             user_agent, session, journal,
+                                             cachekey, taskmetrics)
+                    if newtaskid is not None:
+                        inflight[setid] = (newtaskid,
+                                           PollTimer(strategy,
+                                                     max_wait=max_wait,
+                                                     max_polls=max_polls),
+                                           cachekey, taskmetrics, start,
+                                           time.perf_counter(), genes, False)
+                        continue
+                    resubmit_failed = True
+                progress = None
+                if status is not None:
+                    progress = status.get('progress')
+                timer.record_poll(progress=progress)
+
+                theres = None
+                if is_task_done(status) or timer.is_expired() or\
+                        resubmit_failed is True:
+                    taskmetrics.add_time(SPAN_WAIT,
+                                         time.perf_counter() - submitted)
+                if is_task_done(status):
+                    succeeded = False
+                    if status['status'] != 'complete':
+                        sys.stderr.write('Got error: ' + str(status) + '\n')
+                    else:
+                        try:
+                            resjson = get_completed_result(
+                                resturl, taskid, user_agent,
+                                timeout=theargs.timeout, session=session,
+                                prune=is_prunable(theargs),
+                                metrics=taskmetrics)
+                            if resjson is not None:
+                                succeeded = True
+                            theres = _get_output_for_result(
+                                resjson, theargs, metrics=taskmetrics)
+                        except Exception as e:
+                            sys.stderr.write('Caught exception processing ' +
+                                             setid + ': ' + str(e) + '\n')
+                            succeeded = False
+                    if journal is not None:
+                        if succeeded is True:
+                            journal.record_done(cachekey, taskid,
+                                                to_jsonable(theres))
+                        else:
+                            journal.record_failed(cachekey, taskid)
+                    if theres is not None:
+                        if cache is not None:
+                            cache.put(cachekey, to_jsonable(theres))
+                        if memo is not None:
+                            memo.put(cachekey, theres)
+                elif timer.is_expired():
+                    sys.stderr.write('Gave up waiting on task ' + taskid +
+                                     ' for ' + setid + '\n')
+                    if journal is not None:
+                        journal.record_failed(cachekey, taskid)
+                elif resubmit_failed is False:
+                    continue
+            except Exception as e:
+                sys.stderr.write('Caught exception processing ' +
+                                 setid + ': ' + str(e) + '\n')
+                theres = None
+
+            del inflight[setid]
+            _finish_task_metrics(taskmetrics, start, theres)
+            theres = set_resolution(theres, RESOLVED_REMOTE, theargs)
+            yield setid, theres
+            for waitingid, waitingmetrics, waitingstart in\
+                    waiters.pop(cachekey):
+                _finish_task_metrics(waitingmetrics, waitingstart, theres)
+                yield waitingid, theres
+
+        if len(inflight) > 0 and (exhausted is True or
+                                  len(inflight) >= max_inflight):
+            time.sleep(min([task[1].get_time_until_next_poll()
+                            for task in inflight.values()]))
+
+
+def _submit_task(setid, genes, theargs, user_agent, session, journal,
+                 cachekey, metrics):
+    """
+    Submits **genes** of gene set **setid** for
+    :py:func:`iter_iquery_results` recording the task in **journal**,
+    if set. Failure is written to standard error
+
+    :return: id of task or None if submission failed
+    :rtype: str
+    """
+    try:
+        taskid = submit_query(theargs.url, genes, user_agent,
+                              timeout=theargs.timeout, session=session,
+                              metrics=metrics)
+        if taskid is not None and journal is not None:
+            journal.record_submitted(cachekey, taskid)
+    except Exception as e:
+        sys.stderr.write('Caught exception submitting ' +
+                         setid + ': ' + str(e) + '\n')
+        return None
+    return taskid
+
+
+def _finish_task_metrics(metrics, start, theres):
+    """
+    Adds time since **start** to ``total`` span of **metrics**
+    and finishes it
+
+    :param metrics: metrics of task
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+    :param start: value of :py:func:`time.perf_counter` when
+                  task started
+    :type start: float
+    :param theres: result of task
+    """
+    metrics.add_time(SPAN_TOTAL, time.perf_counter() - start)
+    metrics.finish(theres is not None)
+
+
+def _iter_results(genesets, theargs, processes, session=None,
+                  cache=None, memo=None, journal=None, metrics=None,
+                  canonicalizer=None, engine=None, canonical=False):
+    """
+    Gets results of **genesets** via :py:func:`iter_iquery_results`
+    or, if **processes** is more than 1, via
+    :py:func:`~cdiquerygenestoterm.parallel.iter_iquery_results_parallel`
+    in which case workers create their own session, cache, memo,
+    canonicalizer and engine from **theargs**
+
+    :raises ValueError: if **journal** is set and **processes** is
+                        more than 1
+    :return: generator of (id, mapped term or None) tuples
+    """
+    if processes is None or processes <= 1:
+        return iter_iquery_results(genesets, theargs, session=session,
+                                   cache=cache, memo=memo,
+                                   journal=journal, metrics=metrics,
+                                   canonicalizer=canonicalizer,
+                                   engine=engine, canonical=canonical)
+    if journal is not None:
+        raise ValueError('--journal cannot be used with --processes')
+    from cdiquerygenestoterm.parallel import iter_iquery_results_parallel
+    return iter_iquery_results_parallel(genesets, theargs, processes,
+                                        metrics=metrics,
+                                        shard_size=theargs.shard_size,
+                                        canonical=canonical)
+
+
+def run_iquery_genesets(genesets, theargs, session=None, cache=None,
+                        memo=None, journal=None, metrics=None,
+                        canonicalizer=None, engine=None, processes=1):
+    """
+    Runs iQuery on **genesets** within this process via
+    :py:func:`iter_iquery_results` or, if **processes** is more than
+    1, on worker processes. Gene sets with identical canonical genes,
+    found by :py:func:`get_cache_key_for_genes`, are queried once,
+    under the first id, and share the result. Only the key and ids
+    of each gene set are kept until all are done so memory use does
+    not grow with size of gene sets.
+
+    :param genesets: iterable of (id, list of genes) tuples
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param journal: journal of tasks
+    :type journal: :py:class:`~cdiquerygenestoterm.journal.TaskJournal`
+    :param metrics: metrics of run
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, gene sets not in **memo** or **cache** are
+                   mapped by it, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :param processes: number of worker processes to run gene sets
+        on, see
+        :py:func:`~cdiquerygenestoterm.parallel.iter_iquery_results_parallel`
+    :type processes: int
+    :return: mapped term (or None) keyed by gene set id in
+             same order as **genesets**
+    :rtype: dict
+    """
+    canonicalizer = _get_canonicalizer(canonicalizer)
+    allsetids = []
+
+    # cache key of canonical genes, or None if there are no genes,
+    # => ids of gene sets with them, the first id is queried
+    groups = {}
+
+    def _iter_unique_genesets():
+        for setid, genes in genesets:
+            allsetids.append(setid)
+            genes = canonicalizer.canonicalize(genes)
+            key = None
+            if genes is not None:
+                key = get_cache_key_for_genes(genes, theargs)
+            if key in groups:
+                groups[key].append(setid)
+                continue
+            groups[key] = [setid]
+            yield setid, genes
+
+    results = dict(_iter_results(_iter_unique_genesets(), theargs,
+                                 processes, session=session,
+                                 cache=cache, memo=memo, journal=journal,
+                                 metrics=metrics,
+                                 canonicalizer=canonicalizer,
+                                 engine=engine, canonical=True))
+    bysetid = {}
+    for setids in groups.values():
+        theres = to_jsonable(results[setids[0]])
+        for setid in setids:
+            bysetid[setid] = theres
+    return {setid: bysetid[setid] for setid in allsetids}
+
+
+def run_iquery_batch(inputfile, theargs, session=None, cache=None,
+                     memo=None, journal=None, metrics=None,
+                     canonicalizer=None, engine=None, processes=1):
+    """
+    Runs iQuery on every gene set in **inputfile**, read one at
+    a time in ``theargs.input_format``, via
+    :py:func:`run_iquery_genesets`. See
+    :py:func:`~cdiquerygenestoterm.reader.iter_genesets` for
+    formats of **inputfile**.
+
+    :param inputfile: path to file with gene sets
+    :type inputfile: str
+    :param theargs: parsed command line arguments
+    :param session: session to use for requests
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param journal: journal of tasks
+    :type journal: :py:class:`~cdiquerygenestoterm.journal.TaskJournal`
+    :param metrics: metrics of run
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, gene sets not in **memo** or **cache** are
+                   mapped by it, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :param processes: number of worker processes to run gene sets
+        on, see
+        :py:func:`~cdiquerygenestoterm.parallel.iter_iquery_results_parallel`
+    :type processes: int
+    :return: mapped term (or None) keyed by gene set id in
+             same order as **inputfile**
+    :rtype: dict
+    """
+    return run_iquery_genesets(iter_genesets(inputfile,
+                                             input_format=theargs.
+                                             input_format),
+                               theargs, session=session, cache=cache,
+                               memo=memo, journal=journal,
+                               metrics=metrics,
+                               canonicalizer=canonicalizer,
+                               engine=engine, processes=processes)
+
+
+def run_iquery_stream(inputfile, theargs, writer, session=None,
+                      cache=None, memo=None, journal=None, metrics=None,
+                      canonicalizer=None, engine=None, processes=1):
+    """
+    Runs iQuery on every gene set in **inputfile**, read one at
+    a time in ``theargs.input_format``, passing each result to
+    **writer** as soon as it is done. Unlike
+    :py:func:`run_iquery_batch`, nothing is kept for every gene set
+    so identical gene sets are only queried once if they are in
+    **memo** or running at the same time. Results are written in
+    order of completion or, if **processes** is more than 1, in
+    order of **inputfile**
+
+    :param inputfile: path to file with gene sets
+    :type inputfile: str
+    :param theargs: parsed command line arguments
+    :param writer: writer of results
+    :type writer: :py:class:`~cdiquerygenestoterm.term.JsonLinesWriter`
+    :param session: session to use for requests
+    :type session: :py:class:`requests.Session`
+    :param cache: cache of results
+    :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+    :param memo: in memory cache of results
+    :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    :param journal: journal of tasks
+    :type journal: :py:class:`~cdiquerygenestoterm.journal.TaskJournal`
+    :param metrics: metrics of run
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param canonicalizer: turns genes into form sent to iQuery
+    :type canonicalizer:
+        :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+    :param engine: if set, gene sets not in **memo** or **cache** are
+                   mapped by it, see :py:func:`get_local_result`
+    :type engine: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    :param processes: number of worker processes to run gene sets
+        on, see
+        :py:func:`~cdiquerygenestoterm.parallel.iter_iquery_results_parallel`
+    :type processes: int
+    :return: number of gene sets written
+    :rtype: int
+    """
+    count = 0
+    for setid, theres in _iter_results(iter_genesets(
+            inputfile, input_format=theargs.input_format), theargs,
+            processes, session=session, cache=cache, memo=memo,
+            journal=journal, metrics=metrics,
+            canonicalizer=canonicalizer, engine=engine):
+        writer.write(setid, theres)
+        count += 1
+    return count
+
+
+def write_metrics(metrics, path):
+    """
+    Writes summary of **metrics** as JSON to **path**
+
+    :param metrics: metrics of run, if None nothing is written
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param path: path to write to, if None nothing is written
+    :type path: str
+    """
+    if metrics is None or path is None:
+        return
+    with open(path, 'w') as f:
+        json.dump(metrics.get_summary(), f, indent=2)
+
+
+def _write_run_metrics(theargs, metrics, exporter, server):
+    """
+    Writes **metrics** to ``theargs.metrics``, **exporter** to
+    ``theargs.prometheus_textfile`` and stops **server**
+    """
+    write_metrics(metrics, theargs.metrics)
+    if exporter is not None and theargs.prometheus_textfile is not None:
+        exporter.write_textfile(theargs.prometheus_textfile)
+    if server is not None:
+        server.shutdown()
+        server.server_close()
 
 
 def main(args):
@@ -244,14 +2202,14 @@ def main(args):
         Running gene enrichment against Integrated Query
 
         Takes file with comma delimited list of genes as input and
-        uses Integrated Query (iQuery) enrichment service to 
+        uses Integrated Query (iQuery) enrichment service to
         to find best network that best matches query genes. The
         best network is the one with highest similarity score.
         This tool then uses the network name as the term name.
-        
-        The result is sent to standard out in JSON format 
+
+        The result is sent to standard out in JSON format
         as follows:
-        
+
         {
          "name":"<TERM NAME WHICH IS NAME OF NETWORK>",
          "source":"<SOURCE OF NETWORK>",
@@ -260,16 +2218,90 @@ def main(args):
          "term_size":<NUMBER OF NODES IN NETWORK>,
          "intersections":["<LIST OF FOUND IN NETWORK>"]
         }
-        
+
         NOTE: term_size is set to number of nodes in network
               and NOT number of genes
+
+        If --topk is set, the output is instead a JSON list of up
+        to that many results in the above format ranked by
+        --rankby with the best result first
+
+        If --snapshot is set, gene sets are mapped locally. With
+        --resolution hybrid, gene sets without a good enough local
+        term are sent to iQuery and every term above also has
+        "resolution" set to memo, cache, journal, local or remote
+        depending on where it came from
+
+        If --batch is set, input is expected to contain many
+        gene sets and the output is a JSON object where
+        each key is the id of the gene set and the value is the
+        result above or null if no term was found. With
+        --output_format jsonl, each gene set is instead written
+        as {"id": <id>, "result": <result>} on its own line
+        as soon as it is done
+
+        If --daemon is set, this tool keeps running and takes
+        jobs via http or from a spool directory, see --listen
+        and --spooldir, returning results in the formats above
     """
 
     theargs = _parse_arguments(desc, args[1:])
 
     try:
+        if theargs.daemon is True:
+            from cdiquerygenestoterm.daemon import run_daemon
+            return run_daemon(theargs)
+        if theargs.write_snapshot is not None:
+            return write_snapshot_from_args(theargs)
         inputfile = os.path.abspath(theargs.input)
-        theres = run_iquery(inputfile, theargs)
+        session = LazySession(lambda: create_session_from_args(theargs))
+        cache = create_cache_from_args(theargs)
+        canonicalizer = create_canonicalizer_from_args(theargs)
+        engine = create_engine_from_args(theargs)
+        exporter = create_exporter_from_args(theargs)
+        metrics = create_metrics_from_args(theargs, exporter=exporter)
+        server = start_exporter_server(exporter,
+                                       theargs.prometheus_listen)
+        if theargs.batch is True:
+            memo = MappedTermMemo(maxsize=theargs.memo_size)
+            journal = None
+            if theargs.journal is not None:
+                journal = TaskJournal(os.path.abspath(theargs.journal))
+            try:
+                if theargs.output_format == 'jsonl':
+                    from cdiquerygenestoterm.term import JsonLinesWriter
+                    run_iquery_stream(inputfile, theargs,
+                                      JsonLinesWriter(sys.stdout),
+                                      session=session, cache=cache,
+                                      memo=memo, journal=journal,
+                                      metrics=metrics,
+                                      canonicalizer=canonicalizer,
+                                      engine=engine,
+                                      processes=theargs.processes)
+                else:
+                    json.dump(run_iquery_batch(inputfile, theargs,
+                                               session=session,
+                                               cache=cache, memo=memo,
+                                               journal=journal,
+                                               metrics=metrics,
+                                               canonicalizer=canonicalizer,
+                                               engine=engine,
+                                               processes=theargs.
+                                               processes),
+                              sys.stdout)
+            finally:
+                if journal is not None:
+                    journal.close()
+                _write_run_metrics(theargs, metrics, exporter, server)
+            sys.stdout.flush()
+            return 0
+        try:
+            theres = run_iquery(inputfile, theargs, session=session,
+                                cache=cache, metrics=metrics,
+                                canonicalizer=canonicalizer,
+                                engine=engine)
+        finally:
+            _write_run_metrics(theargs, metrics, exporter, server)
         if theres is None:
             sys.stderr.write('No terms found\n')
         else:
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import signal
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from cdiquerygenestoterm.cdiquerygenestotermcmd import read_inputfile
+from cdiquerygenestoterm.cdiquerygenestotermcmd import run_iquery_for_genes
+from cdiquerygenestoterm.cdiquerygenestotermcmd import run_iquery_genesets
+from cdiquerygenestoterm.cdiquerygenestotermcmd import\
+    create_session_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import create_cache_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import\
+    create_canonicalizer_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import create_engine_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import start_exporter_server
+from cdiquerygenestoterm.memo import MappedTermMemo
+from cdiquerygenestoterm.reader import get_genes_from_string
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.exporter import CONTENT_TYPE
+from cdiquerygenestoterm.exporter import PrometheusExporter
+
+GENES_KEY = 'genes'
+GENESETS_KEY = 'genesets'
+ERROR_KEY = 'error'
+
+# suffixes of files in spool directory
+JOB_SUFFIX = '.json'
+GENES_SUFFIX = '.txt'
+WORKING_SUFFIX = '.working'
+RESULT_SUFFIX = '.result'
+ERROR_SUFFIX = '.error'
+
+
+class InvalidJobError(Exception):
+    """
+    Raised when a job is not in a format :py:class:`IQueryDaemon`
+    understands
+    """
+    pass
+
+
+def parse_job(job):
+    """
+    Parses **job** which is a JSON object with either ``genes``, a
+    list or comma delimited string of genes, or ``genesets``, an
+    object of id => genes like the ``--batch`` input
+
+    :param job: job as decoded from JSON
+    :type job: dict
+    :raises InvalidJobError: if **job** is not valid
+    :return: (genes, None) for single gene set jobs or
+             (None, genesets) for batch jobs where genesets is a
+             list of (id, genes) tuples
+    :rtype: tuple
+    """
+    if not isinstance(job, dict):
+        raise InvalidJobError('Job must be a JSON object')
+    if GENES_KEY in job:
+        genes = job[GENES_KEY]
+        if isinstance(genes, str):
+            genes = get_genes_from_string(genes)
+        if not isinstance(genes, list) or len(genes) == 0:
+            raise InvalidJobError('No genes found in job')
+        return genes, None
+    if GENESETS_KEY in job and isinstance(job[GENESETS_KEY], dict):
+        genesets = []
+        for setid, genes in job[GENESETS_KEY].items():
+            if isinstance(genes, str):
+                genes = get_genes_from_string(genes)
+            genesets.append((str(setid), genes))
+        return None, genesets
+    raise InvalidJobError('Job must have ' + GENES_KEY + ' or ' +
+                          GENESETS_KEY)
+
+
+class IQueryDaemon(object):
+    """
+    Runs jobs against iQuery from a long running process so the
+    http connection pool, :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+    and :py:class:`~cdiquerygenestoterm.cache.ResultCache` stay warm
+    across jobs. Jobs, see :py:func:`parse_job`, are run on a pool of
+    **workers** threads and can be given via http, see
+    :py:meth:`create_http_server`, or by dropping files in a spool
+    directory, see :py:meth:`process_spooldir`.
+
+    Results are in the same JSON format that
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.main`
+    writes to standard out.
+
+    Every query is recorded in a
+    :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    served at ``/metrics`` and, if ``theargs.prometheus_textfile``
+    is set, written to that file after every job.
+    """
+
+    def __init__(self, theargs, session=None, cache=None, memo=None,
+                 workers=None, exporter=None):
+        """
+        Constructor
+
+        :param theargs: parsed command line arguments
+        :param session: session to use for requests, if None one
+                        is created from **theargs**
+        :type session: :py:class:`requests.Session`
+        :param cache: cache of results, if None one is created from
+                      **theargs**
+        :type cache: :py:class:`~cdiquerygenestoterm.cache.ResultCache`
+        :param memo: in memory cache of results, if None one is
+                     created with ``theargs.memo_size`` entries
+        :type memo: :py:class:`~cdiquerygenestoterm.memo.MappedTermMemo`
+        :param workers: number of jobs to run at once, if None
+                        ``theargs.workers`` is used
+        :type workers: int
+        :param exporter: records every query, if None one is created
+        :type exporter:
+            :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+        """
+        self._theargs = theargs
+        if session is None:
+            session = create_session_from_args(theargs)
+        if cache is None:
+            cache = create_cache_from_args(theargs)
+        if memo is None:
+            memo = MappedTermMemo(maxsize=theargs.memo_size)
+        if workers is None:
+            workers = theargs.workers
+        if exporter is None:
+            exporter = PrometheusExporter()
+        self._session = session
+        self._cache = cache
+        self._memo = memo
+        self._canonicalizer = create_canonicalizer_from_args(theargs)
+        self._engine = create_engine_from_args(theargs)
+        self._exporter = exporter
+        self._metrics = RunMetrics(listener=exporter, keep_tasks=False)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._lock = threading.Lock()
+        self._jobs_done = 0
+        self._jobs_failed = 0
+        self._shutdown = threading.Event()
+
+    def get_stats(self):
+        """
+        Gets counters for this daemon
+
+        :return: dict with ``jobs_done``, ``jobs_failed`` and
+                 ``memo`` stats
+        :rtype: dict
+        """
+        with self._lock:
+            return {'jobs_done': self._jobs_done,
+                    'jobs_failed': self._jobs_failed,
+                    'memo': self._memo.get_stats()}
+
+    def get_exporter(self):
+        """
+        Gets exporter every query run by this daemon is recorded in
+
+        :rtype: :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+        """
+        return self._exporter
+
+    def _run_job(self, job):
+        """
+        Runs **job** on calling thread
+
+        :raises InvalidJobError: if **job** is not valid
+        :return: result
+        """
+        try:
+            genes, genesets = parse_job(job)
+            if genes is not None:
+                res = run_iquery_for_genes(genes, self._theargs,
+                                           session=self._session,
+                                           cache=self._cache,
+                                           memo=self._memo,
+                                           metrics=self._metrics.
+                                           create_task(),
+                                           canonicalizer=self.
+                                           _canonicalizer,
+                                           engine=self._engine)
+            else:
+                res = run_iquery_genesets(genesets, self._theargs,
+                                          session=self._session,
+                                          cache=self._cache,
+                                          memo=self._memo,
+                                          metrics=self._metrics,
+                                          canonicalizer=self._canonicalizer,
+                                          engine=self._engine)
+        except Exception:
+            with self._lock:
+                self._jobs_failed += 1
+            raise
+        finally:
+            self._write_textfile()
+        with self._lock:
+            self._jobs_done += 1
+        return res
+
+    def _write_textfile(self):
+        """
+        Writes exporter to ``theargs.prometheus_textfile`` if set
+        """
+        path = self._theargs.prometheus_textfile
+        if path is None:
+            return
+        try:
+            self._exporter.write_textfile(path)
+        except OSError as e:
+            sys.stderr.write('Unable to write ' + path + ': ' +
+                             str(e) + '\n')
+
+    def submit_job(self, job):
+        """
+        Queues **job** to run on worker pool
+
+        :param job: job, see :py:func:`parse_job`
+        :type job: dict
+        :return: future whose result is the mapped term, or None,
+                 for single gene set jobs and a dict of
+                 id => mapped term for batch jobs
+        :rtype: :py:class:`concurrent.futures.Future`
+        """
+        return self._executor.submit(self._run_job, job)
+
+    def run_job(self, job):
+        """
+        Runs **job** on worker pool waiting for it to finish
+
+        :param job: job, see :py:func:`parse_job`
+        :type job: dict
+        :raises InvalidJobError: if **job** is not valid
+        :return: result, see :py:meth:`submit_job`
+        """
+        return self.submit_job(job).result()
+
+    def create_http_server(self, host='127.0.0.1', port=8089):
+        """
+        Creates http server that runs the JSON job POSTed to ``/``
+        and responds with the result as JSON. ``GET /status`` returns
+        :py:meth:`get_stats` and ``GET /metrics`` returns metrics of
+        :py:meth:`get_exporter` in Prometheus text format. Invalid
+        jobs get a 400 response with the reason under ``error``
+
+        :param host: address to listen on
+        :type host: str
+        :param port: port to listen on, 0 picks a free port
+        :type port: int
+        :return: server, call ``serve_forever()`` to start it
+        :rtype: :py:class:`http.server.ThreadingHTTPServer`
+        """
+        daemon = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _send_json(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/status':
+                    self._send_json(200, daemon.get_stats())
+                    return
+                if self.path.rstrip('/') == '/metrics':
+                    body = daemon.get_exporter().get_exposition()\
+                        .encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self._send_json(404, {ERROR_KEY: 'Not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    job = json.loads(self.rfile.read(length)
+                                     .decode('utf-8'))
+                    self._send_json(200, daemon.run_job(job))
+                except (ValueError, InvalidJobError) as e:
+                    self._send_json(400, {ERROR_KEY: str(e)})
+                except Exception as e:
+                    self._send_json(500, {ERROR_KEY: str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        return server
+
+    def _run_spool_job(self, workingpath, basepath, job):
+        """
+        Runs **job** claimed from spool directory writing result
+        to **basepath** + :py:const:`RESULT_SUFFIX` or the error to
+        **basepath** + :py:const:`ERROR_SUFFIX`
+        """
+        try:
+            res = self._run_job(job)
+            _write_atomic(basepath + RESULT_SUFFIX, json.dumps(res))
+        except Exception as e:
+            sys.stderr.write('Job ' + basepath + ' failed: ' +
+                             str(e) + '\n')
+            _write_atomic(basepath + ERROR_SUFFIX, str(e) + '\n')
+        finally:
+            os.remove(workingpath)
+
+    def process_spooldir(self, spooldir):
+        """
+        Claims every job in **spooldir** and queues it on the worker
+        pool. A job is either a JSON job, see :py:func:`parse_job`,
+        in a file ending with :py:const:`JOB_SUFFIX` or a file of
+        comma delimited genes, like the command line input, ending
+        with :py:const:`GENES_SUFFIX`.
+
+        A job is claimed by renaming it so multiple daemons can share
+        a spool directory. Once done the result is written next to the
+        job as ``<NAME>.result`` or the error as ``<NAME>.error``
+        and the job file is removed.
+
+        :param spooldir: directory to look for jobs in
+        :type spooldir: str
+        :return: futures of jobs queued
+        :rtype: list
+        """
+        futures = []
+        for entry in sorted(os.listdir(spooldir)):
+            if entry.startswith('.') or\
+                    not entry.endswith((JOB_SUFFIX, GENES_SUFFIX)):
+                continue
+            jobpath = os.path.join(spooldir, entry)
+            basepath = os.path.splitext(jobpath)[0]
+            workingpath = basepath + WORKING_SUFFIX
+            try:
+                os.rename(jobpath, workingpath)
+            except OSError:
+                # claimed by someone else
+                continue
+            try:
+                data = read_inputfile(workingpath)
+                if entry.endswith(JOB_SUFFIX):
+                    job = json.loads(data)
+                else:
+                    job = {GENES_KEY: get_genes_from_string(data)}
+            except Exception as e:
+                _write_atomic(basepath + ERROR_SUFFIX, str(e) + '\n')
+                os.remove(workingpath)
+                continue
+            futures.append(self._executor.submit(self._run_spool_job,
+                                                 workingpath, basepath,
+                                                 job))
+        return futures
+
+    def watch_spooldir(self, spooldir, interval=1.0):
+        """
+        Calls :py:meth:`process_spooldir` every **interval** seconds
+        until :py:meth:`shutdown` is called
+
+        :param spooldir: directory to look for jobs in
+        :type spooldir: str
+        :param interval: seconds between checks for new jobs
+        :type interval: float
+        """
+        os.makedirs(spooldir, exist_ok=True)
+        while not self._shutdown.is_set():
+            try:
+                self.process_spooldir(spooldir)
+            except Exception as e:
+                sys.stderr.write('Caught exception checking spool '
+                                 'directory: ' + str(e) + '\n')
+            self._shutdown.wait(interval)
+
+    def shutdown(self, wait=True):
+        """
+        Stops watching spool directory and shuts down the worker pool
+
+        :param wait: if True, wait for running jobs to finish
+        :type wait: bool
+        """
+        self._shutdown.set()
+        self._executor.shutdown(wait=wait)
+
+
+def _write_atomic(path, data):
+    """
+    Writes **data** to **path** so readers never see a partial file
+    """
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmppath, path)
+    except Exception:
+        if os.path.isfile(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def run_daemon(theargs):
+    """
+    Runs :py:class:`IQueryDaemon` until interrupted. Listens for
+    jobs on ``theargs.listen`` unless it is empty and watches
+    ``theargs.spooldir`` if set
+
+    :param theargs: parsed command line arguments
+    :return: 0 upon exit
+    :rtype: int
+    """
+    daemon = IQueryDaemon(theargs)
+    server = None
+    threads = []
+    if theargs.spooldir is not None:
+        spooldir = os.path.abspath(theargs.spooldir)
+        threads.append(threading.Thread(target=daemon.watch_spooldir,
+                                        args=(spooldir,),
+                                        kwargs={'interval':
+                                                theargs.spool_interval},
+                                        daemon=True))
+        sys.stderr.write('Watching spool directory ' + spooldir + '\n')
+    if theargs.listen:
+        host, port = theargs.listen.rsplit(':', 1)
+        server = daemon.create_http_server(host=host, port=int(port))
+        threads.append(threading.Thread(target=server.serve_forever,
+                                        daemon=True))
+        sys.stderr.write('Listening on http://' + host + ':' +
+                         str(server.server_address[1]) + '\n')
+    for t in threads:
+        t.start()
+    metricsserver = start_exporter_server(daemon.get_exporter(),
+                                          theargs.prometheus_listen)
+
+    def _handle_sigterm(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for theserver in (server, metricsserver):
+            if theserver is not None:
+                theserver.shutdown()
+                theserver.server_close()
+        daemon.shutdown()
+    return 0
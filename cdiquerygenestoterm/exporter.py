@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from cdiquerygenestoterm.metrics import COUNTER_POLLS
+from cdiquerygenestoterm.metrics import COUNTER_CACHE_HITS
+from cdiquerygenestoterm.metrics import COUNTER_MEMO_HITS
+from cdiquerygenestoterm.metrics import COUNTER_JOURNAL_HITS
+from cdiquerygenestoterm.metrics import COUNTER_LOCAL_ANSWERS
+from cdiquerygenestoterm.metrics import COUNTER_LOCAL_FALLBACKS
+from cdiquerygenestoterm.metrics import SPAN_SUBMIT
+from cdiquerygenestoterm.metrics import SPAN_TOTAL
+
+PREFIX = 'cdiquerygenestoterm_'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds of buckets of end to end latency histogram in seconds
+LATENCY_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+                   300.0, 600.0, 1800.0)
+
+# upper bounds of buckets of polls per task histogram
+POLLS_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# counters of TaskMetrics reported as kind of cache hit
+CACHE_HIT_KINDS = ((COUNTER_CACHE_HITS, 'cache'),
+                   (COUNTER_MEMO_HITS, 'memo'),
+                   (COUNTER_JOURNAL_HITS, 'journal'))
+
+
+def _format_value(value):
+    """
+    Formats **value** for Prometheus text format
+
+    :rtype: str
+    """
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram(object):
+    """
+    Cumulative histogram in the style of a Prometheus histogram.
+    Not thread safe, :py:class:`PrometheusExporter` guards it
+    """
+
+    def __init__(self, buckets):
+        """
+        Constructor
+
+        :param buckets: upper bounds of buckets in increasing order,
+                        a ``+Inf`` bucket is always added
+        :type buckets: tuple
+        """
+        self._bounds = list(buckets) + [float('inf')]
+        self._counts = [0] * len(self._bounds)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        """
+        Adds **value** to histogram
+
+        :param value: value to add
+        :type value: float
+        """
+        self._sum += value
+        self._count += 1
+        for index, bound in enumerate(self._bounds):
+            if value <= bound:
+                self._counts[index] += 1
+
+    def get_count(self):
+        """
+        :return: number of values observed
+        :rtype: int
+        """
+        return self._count
+
+    def get_lines(self, name):
+        """
+        Gets samples of histogram in Prometheus text format
+
+        :param name: name of metric
+        :type name: str
+        :return: lines for buckets, sum and count
+        :rtype: list
+        """
+        lines = []
+        for bound, count in zip(self._bounds, self._counts):
+            lines.append(name + '_bucket{le="' + _format_value(bound) +
+                         '"} ' + str(count))
+        lines.append(name + '_sum ' + _format_value(self._sum))
+        lines.append(name + '_count ' + str(self._count))
+        return lines
+
+
+class PrometheusExporter(object):
+    """
+    Keeps live totals of iQuery tasks in Prometheus text format for
+    long running processes. Pass it as ``listener`` to
+    :py:class:`~cdiquerygenestoterm.metrics.RunMetrics` and it is
+    told as each task is submitted, resumed and finished.
+
+    Metrics, all prefixed with :py:const:`PREFIX`, are:
+
+    * ``tasks_submitted_total`` tasks accepted by iQuery
+    * ``tasks_completed_total`` iQuery tasks that found a term
+    * ``tasks_failed_total`` iQuery tasks, or submissions, that
+      failed or found no term
+    * ``tasks_inflight`` tasks submitted, or resumed from the
+      journal of an earlier run, but not finished
+    * ``cache_hits_total`` gene sets answered without iQuery by
+      ``kind`` of cache
+    * ``local_answers_total`` gene sets answered by the local
+      enrichment engine
+    * ``local_fallbacks_total`` gene sets the local enrichment engine
+      could not answer well enough so they were sent to iQuery
+    * ``task_polls`` histogram of status checks per iQuery task
+    * ``task_latency_seconds`` histogram of end to end time of gene
+      sets run on iQuery, from start of query until result is mapped
+    """
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS,
+                 polls_buckets=POLLS_BUCKETS):
+        """
+        Constructor
+
+        :param latency_buckets: upper bounds of buckets of
+                                ``task_latency_seconds``
+        :type latency_buckets: tuple
+        :param polls_buckets: upper bounds of buckets of ``task_polls``
+        :type polls_buckets: tuple
+        """
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._inflight = 0
+        self._cache_hits = dict([(kind, 0)
+                                 for _, kind in CACHE_HIT_KINDS])
+        self._local_answers = 0
+        self._local_fallbacks = 0
+        self._latency = Histogram(latency_buckets)
+        self._polls = Histogram(polls_buckets)
+
+    def task_submitted(self, task):
+        """
+        Called when **task** is accepted by iQuery
+
+        :param task: metrics of task
+        :type task: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+        """
+        with self._lock:
+            self._submitted += 1
+            # a resumed task submitted again is already in flight
+            if task.resumed is False:
+                self._inflight += 1
+
+    def task_resumed(self, task):
+        """
+        Called when **task**, submitted to iQuery by an earlier run,
+        is being waited on again. It is counted in flight and, once
+        finished, as completed or failed, but not as submitted
+
+        :param task: metrics of task
+        :type task: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+        """
+        with self._lock:
+            self._inflight += 1
+
+    def task_finished(self, task):
+        """
+        Called when **task** is done
+
+        :param task: metrics of task
+        :type task: :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics`
+        """
+        counters = task.get_counters()
+        spans = task.get_spans()
+        with self._lock:
+            for counter, kind in CACHE_HIT_KINDS:
+                self._cache_hits[kind] += counters.get(counter, 0)
+            self._local_answers += counters.get(COUNTER_LOCAL_ANSWERS, 0)
+            self._local_fallbacks += counters.get(COUNTER_LOCAL_FALLBACKS,
+                                                  0)
+            if task.submitted is True:
+                self._inflight -= 1
+                if task.found is True:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._polls.observe(counters.get(COUNTER_POLLS, 0))
+                if SPAN_TOTAL in spans:
+                    self._latency.observe(spans[SPAN_TOTAL].total)
+            elif SPAN_SUBMIT in spans:
+                # submission was attempted but not accepted
+                self._failed += 1
+
+    def get_exposition(self):
+        """
+        Gets metrics in Prometheus text exposition format
+
+        :return: metrics, see :py:const:`CONTENT_TYPE`
+        :rtype: str
+        """
+        lines = []
+
+        def _add(name, thetype, helptext, samples):
+            lines.append('# HELP ' + PREFIX + name + ' ' + helptext)
+            lines.append('# TYPE ' + PREFIX + name + ' ' + thetype)
+            lines.extend(samples)
+
+        with self._lock:
+            _add('tasks_submitted_total', 'counter',
+                 'Tasks accepted by iQuery',
+                 [PREFIX + 'tasks_submitted_total ' +
+                  str(self._submitted)])
+            _add('tasks_completed_total', 'counter',
+                 'iQuery tasks that found a term',
+                 [PREFIX + 'tasks_completed_total ' +
+                  str(self._completed)])
+            _add('tasks_failed_total', 'counter',
+                 'iQuery tasks or submissions that failed or '
+                 'found no term',
+                 [PREFIX + 'tasks_failed_total ' + str(self._failed)])
+            _add('tasks_inflight', 'gauge',
+                 'Tasks submitted to iQuery and not yet finished',
+                 [PREFIX + 'tasks_inflight ' + str(self._inflight)])
+            _add('cache_hits_total', 'counter',
+                 'Gene sets answered without querying iQuery',
+                 [PREFIX + 'cache_hits_total{kind="' + kind + '"} ' +
+                  str(self._cache_hits[kind])
+                  for _, kind in CACHE_HIT_KINDS])
+            _add('local_answers_total', 'counter',
+                 'Gene sets answered by local enrichment engine',
+                 [PREFIX + 'local_answers_total ' +
+                  str(self._local_answers)])
+            _add('local_fallbacks_total', 'counter',
+                 'Gene sets sent to iQuery because local enrichment '
+                 'engine found no term or similarity was too low',
+                 [PREFIX + 'local_fallbacks_total ' +
+                  str(self._local_fallbacks)])
+            _add('task_polls', 'histogram',
+                 'Status checks per iQuery task',
+                 self._polls.get_lines(PREFIX + 'task_polls'))
+            _add('task_latency_seconds', 'histogram',
+                 'End to end time of gene sets run on iQuery',
+                 self._latency.get_lines(PREFIX +
+                                         'task_latency_seconds'))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Writes :py:meth:`get_exposition` to **path** for the
+        node exporter textfile collector. The file is replaced
+        atomically so a partial file is never read
+
+        :param path: path to write to, should end with ``.prom``
+        :type path: str
+        """
+        data = self.get_exposition()
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(
+            os.path.abspath(path)), prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.chmod(tmppath, 0o644)
+            os.replace(tmppath, path)
+        except Exception:
+            if os.path.isfile(tmppath):
+                os.remove(tmppath)
+            raise
+
+
+def create_http_server(exporter, host='127.0.0.1', port=9464):
+    """
+    Creates http server that responds to ``GET /metrics`` with
+    :py:meth:`PrometheusExporter.get_exposition`
+
+    :param exporter: exporter to serve
+    :type exporter: :py:class:`PrometheusExporter`
+    :param host: address to listen on
+    :type host: str
+    :param port: port to listen on, 0 picks a free port
+    :type port: int
+    :return: server, call ``serve_forever()`` to start it
+    :rtype: :py:class:`http.server.ThreadingHTTPServer`
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = exporter.get_exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    return server
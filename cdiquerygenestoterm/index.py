@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import array
+import bisect
+import struct
+import tempfile
+
+INDEX_MAGIC = b'CDIGIDX1'
+
+# number of sections written by GeneIndex.to_sections()
+INDEX_SECTIONS = 5
+
+# sections start on multiples of this many bytes
+ALIGNMENT = 8
+
+# magic and number of sections followed by offset and length
+# in bytes of each section
+_HEADER = struct.Struct('<8sI4x')
+_SECTION = struct.Struct('<QQ')
+
+# typecode of unsigned 32 bit integers, stored little endian
+UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _align(offset):
+    """
+    Rounds **offset** up to next multiple of :py:const:`ALIGNMENT`
+    """
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def to_uint32_bytes(values):
+    """
+    Packs **values** as little endian unsigned 32 bit integers
+
+    :param values: non negative integers less than 2^32
+    :type values: iterable
+    :rtype: bytes
+    """
+    thearray = array.array(UINT32, values)
+    if not _LITTLE_ENDIAN:
+        thearray.byteswap()
+    return thearray.tobytes()
+
+
+def as_uint32(view):
+    """
+    Gets **view** of little endian unsigned 32 bit integers as a
+    sequence of ints without copying it, except on big endian
+    machines where it has to be byte swapped
+
+    :param view: bytes
+    :type view: memoryview
+    :return: sequence of ints
+    """
+    if _LITTLE_ENDIAN:
+        return view.cast(UINT32)
+    thearray = array.array(UINT32)
+    thearray.frombytes(view)
+    thearray.byteswap()
+    return thearray
+
+
+def write_sections(path, magic, sections):
+    """
+    Writes **sections** to **path** each starting on a multiple of
+    :py:const:`ALIGNMENT` bytes after a header with **magic** and
+    the offset and length of each section. The file is replaced
+    atomically so a partial file is never read
+
+    :param path: path to write to
+    :type path: str
+    :param magic: 8 bytes identifying type of file
+    :type magic: bytes
+    :param sections: bytes of each section
+    :type sections: list
+    """
+    offset = _align(_HEADER.size + _SECTION.size * len(sections))
+    table = []
+    for section in sections:
+        table.append((offset, len(section)))
+        offset = _align(offset + len(section))
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(path)), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(magic, len(sections)))
+            for entry in table:
+                f.write(_SECTION.pack(*entry))
+            for (start, length), section in zip(table, sections):
+                f.write(b'\0' * (start - f.tell()))
+                f.write(section)
+        os.chmod(tmppath, 0o644)
+        os.replace(tmppath, path)
+    except Exception:
+        if os.path.isfile(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def map_sections(path, magic):
+    """
+    Memory maps **path**, written by :py:func:`write_sections`,
+    read only so the pages are shared by every process mapping
+    the same file
+
+    :param path: path to file
+    :type path: str
+    :param magic: expected magic of file
+    :type magic: bytes
+    :raises ValueError: if file does not start with **magic** or
+                        is truncated
+    :return: views of each section
+    :rtype: list
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise ValueError(path + ' is not a valid file')
+        themap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(themap)
+    filemagic, numsections = _HEADER.unpack_from(view)
+    if filemagic != magic:
+        raise ValueError(path + ' is not a valid file, expected ' +
+                         repr(magic) + ' at start but found ' +
+                         repr(filemagic))
+    if _HEADER.size + _SECTION.size * numsections > len(view):
+        raise ValueError(path + ' is truncated')
+    sections = []
+    for i in range(numsections):
+        start, length = _SECTION.unpack_from(view, _HEADER.size +
+                                             _SECTION.size * i)
+        if start + length > len(view):
+            raise ValueError(path + ' is truncated')
+        sections.append(view[start:start + length])
+    return sections
+
+
+class StringTable(object):
+    """
+    Read only sequence of strings stored as UTF-8 in **data** where
+    string i spans bytes ``offsets[i]`` to ``offsets[i + 1]`` so
+    nothing has to be decoded or copied when the table is loaded
+    """
+
+    def __init__(self, data, offsets):
+        """
+        Constructor
+
+        :param data: UTF-8 strings, one after the other
+        :type data: bytes
+        :param offsets: sequence of ints with one more entry than
+                        there are strings
+        """
+        self._data = data
+        self._offsets = offsets
+
+    @staticmethod
+    def _encode(encoded):
+        """
+        Gets data and offsets of **encoded** UTF-8 strings
+        """
+        offsets = array.array(UINT32, [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        return b''.join(encoded), offsets
+
+    @staticmethod
+    def from_strings(strings):
+        """
+        Creates table from **strings** keeping their order
+
+        :param strings: strings
+        :type strings: iterable
+        :rtype: :py:class:`StringTable`
+        """
+        return StringTable(*StringTable._encode([s.encode('utf-8')
+                                                 for s in strings]))
+
+    @staticmethod
+    def from_sections(sections):
+        """
+        Creates table from views of the two sections made by
+        :py:meth:`to_sections`
+
+        :param sections: views of sections
+        :type sections: list
+        """
+        return StringTable(sections[0], as_uint32(sections[1]))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_bytes(self, stringid):
+        """
+        :return: UTF-8 bytes of string **stringid**
+        :rtype: bytes
+        """
+        return bytes(self._data[self._offsets[stringid]:
+                                self._offsets[stringid + 1]])
+
+    def __getitem__(self, stringid):
+        return self.get_bytes(stringid).decode('utf-8')
+
+    def to_sections(self):
+        """
+        :return: string bytes and offsets as bytes for
+                 :py:func:`write_sections`
+        :rtype: list
+        """
+        return [bytes(self._data), to_uint32_bytes(self._offsets)]
+
+
+class SymbolTable(StringTable):
+    """
+    :py:class:`StringTable` of unique gene symbols sorted by their
+    UTF-8 bytes so :py:meth:`get_id` is a binary search
+    """
+
+    @staticmethod
+    def from_symbols(symbols):
+        """
+        Creates table from **symbols**
+
+        :param symbols: unique symbols
+        :type symbols: iterable
+        :rtype: :py:class:`SymbolTable`
+        """
+        return SymbolTable(*StringTable._encode(
+            sorted([s.encode('utf-8') for s in symbols])))
+
+    def get_id(self, symbol):
+        """
+        Gets id of **symbol**
+
+        :param symbol: symbol
+        :type symbol: str
+        :return: index of **symbol** or None if not in table
+        :rtype: int
+        """
+        encoded = symbol.encode('utf-8')
+        symbolid = bisect.bisect_left(_BytesView(self), encoded)
+        if symbolid < len(self) and self.get_bytes(symbolid) == encoded:
+            return symbolid
+        return None
+
+
+class _BytesView(object):
+    """
+    Sequence of UTF-8 bytes of symbols in a :py:class:`SymbolTable`
+    for :py:func:`bisect.bisect_left`
+    """
+
+    def __init__(self, table):
+        self._table = table
+
+    def __len__(self):
+        return len(self._table)
+
+    def __getitem__(self, symbolid):
+        return self._table.get_bytes(symbolid)
+
+
+class GeneIndex(object):
+    """
+    Inverted index of gene symbol to ids of networks with the gene,
+    stored as compact arrays instead of Python objects. Gene i has
+    networks ``postings[offsets[i]:offsets[i + 1]]``, sorted
+    ascending, and ``sizes`` has number of genes in each network.
+
+    :py:meth:`write` saves index to a file and :py:meth:`load`
+    memory maps it so it is ready to use without being parsed.
+    Ids of genes looked up by :py:meth:`get_gene_id` are kept in a
+    dict so each symbol is only searched for once
+    """
+
+    def __init__(self, symbols, offsets, postings, sizes):
+        """
+        Constructor, use :py:meth:`build` or :py:meth:`load`
+
+        :param symbols: gene symbols
+        :type symbols: :py:class:`SymbolTable`
+        :param offsets: start of each gene in **postings**
+        :param postings: network ids
+        :param sizes: number of genes in each network
+        """
+        self._symbols = symbols
+        self._offsets = offsets
+        self._postings = postings
+        self._sizes = sizes
+        self._geneids = {}
+
+    @staticmethod
+    def build(genesets):
+        """
+        Builds index
+
+        :param genesets: genes of each network where position in list
+            is network id. Genes should be canonical, see
+            :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+        :type genesets: list
+        :rtype: :py:class:`GeneIndex`
+        """
+        genesets = [genes if isinstance(genes, set) else set(genes)
+                    for genes in genesets]
+        allgenes = set()
+        for genes in genesets:
+            allgenes.update(genes)
+        symbols = SymbolTable.from_symbols(allgenes)
+        geneids = {symbols[i]: i for i in range(len(symbols))}
+        networks = [[] for _ in range(len(symbols))]
+        for netid, genes in enumerate(genesets):
+            for gene in genes:
+                networks[geneids[gene]].append(netid)
+        offsets = array.array(UINT32, [0])
+        postings = array.array(UINT32)
+        for netids in networks:
+            postings.extend(netids)
+            offsets.append(len(postings))
+        return GeneIndex(symbols, offsets, postings,
+                         array.array(UINT32,
+                                     [len(genes) for genes in genesets]))
+
+    def to_sections(self):
+        """
+        :return: index as bytes for :py:func:`write_sections`
+        :rtype: list
+        """
+        return self._symbols.to_sections() +\
+            [to_uint32_bytes(self._offsets),
+             to_uint32_bytes(self._postings),
+             to_uint32_bytes(self._sizes)]
+
+    @staticmethod
+    def from_sections(sections):
+        """
+        Creates index from views of sections made by
+        :py:meth:`to_sections` without copying them
+
+        :param sections: views of sections
+        :type sections: list
+        :raises ValueError: if there are too few sections
+        :rtype: :py:class:`GeneIndex`
+        """
+        if len(sections) < INDEX_SECTIONS:
+            raise ValueError('Expected ' + str(INDEX_SECTIONS) +
+                             ' index sections, found ' +
+                             str(len(sections)))
+        return GeneIndex(SymbolTable(sections[0], as_uint32(sections[1])),
+                         as_uint32(sections[2]), as_uint32(sections[3]),
+                         as_uint32(sections[4]))
+
+    def write(self, path):
+        """
+        Writes index to **path** for :py:meth:`load`
+
+        :param path: path to write to
+        :type path: str
+        """
+        write_sections(path, INDEX_MAGIC, self.to_sections())
+
+    @staticmethod
+    def load(path):
+        """
+        Memory maps index written by :py:meth:`write`
+
+        :param path: path to index
+        :type path: str
+        :raises ValueError: if **path** is not an index
+        :rtype: :py:class:`GeneIndex`
+        """
+        return GeneIndex.from_sections(map_sections(path, INDEX_MAGIC))
+
+    def get_symbols(self):
+        """
+        :return: gene symbols where position is id of gene
+        :rtype: :py:class:`SymbolTable`
+        """
+        return self._symbols
+
+    def get_gene_count(self):
+        """
+        :return: number of unique genes in index
+        :rtype: int
+        """
+        return len(self._symbols)
+
+    def get_network_count(self):
+        """
+        :return: number of networks in index
+        :rtype: int
+        """
+        return len(self._sizes)
+
+    def get_offsets(self):
+        """
+        :return: start of each gene in :py:meth:`get_postings`, with
+                 one more entry than there are genes, as a sequence of
+                 unsigned 32 bit ints supporting the buffer protocol
+        """
+        return self._offsets
+
+    def get_postings(self):
+        """
+        :return: network ids of every gene, one gene after the other,
+                 as a sequence of unsigned 32 bit ints supporting the
+                 buffer protocol
+        """
+        return self._postings
+
+    def get_sizes(self):
+        """
+        :return: number of genes in each network as a sequence of
+                 unsigned 32 bit ints supporting the buffer protocol
+        """
+        return self._sizes
+
+    def get_size(self, netid):
+        """
+        :return: number of genes in network **netid**
+        :rtype: int
+        """
+        return self._sizes[netid]
+
+    def get_networks(self, gene):
+        """
+        Gets networks with **gene**
+
+        :param gene: canonical gene symbol
+        :type gene: str
+        :return: sorted sequence of network ids, empty if gene is
+                 not in any network
+        """
+        geneid = self.get_gene_id(gene)
+        if geneid is None:
+            return ()
+        return self._postings[self._offsets[geneid]:
+                              self._offsets[geneid + 1]]
+
+    def get_gene_id(self, gene):
+        """
+        Gets id of **gene**, the position of its networks in
+        :py:meth:`get_offsets`
+
+        :param gene: canonical gene symbol
+        :type gene: str
+        :return: id or None if gene is not in any network
+        :rtype: int
+        """
+        geneid = self._geneids.get(gene, -1)
+        if geneid == -1:
+            geneid = self._symbols.get_id(gene)
+            # symbols not in index are only kept up to a bound so
+            # queries of made up genes do not grow memory use
+            if geneid is not None or\
+                    len(self._geneids) < 2 * len(self._symbols):
+                self._geneids[gene] = geneid
+        return geneid
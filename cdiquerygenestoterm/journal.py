@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+
+
+class TaskJournal(object):
+    """
+    Append only journal of iQuery tasks stored as one JSON
+    record per line. Every change in the state of a gene set is
+    written and flushed before the run moves on so a run that dies
+    can be restarted with the same journal: gene sets with state
+    :py:const:`STATE_DONE` are not queried again and gene sets with
+    state :py:const:`STATE_SUBMITTED` are polled using the task id
+    already on the server instead of being resubmitted.
+
+    Records have the following format:
+
+    .. code-block:: python
+
+        {"key": "<KEY OF GENE SET>",
+         "taskid": "<ID OF TASK ON IQUERY>",
+         "state": "<submitted|done|failed>",
+         "result": <RESULT, ONLY SET WHEN STATE IS done>}
+    """
+
+    STATE_SUBMITTED = 'submitted'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+
+    KEY = 'key'
+    TASKID = 'taskid'
+    STATE = 'state'
+    RESULT = 'result'
+
+    def __init__(self, path, fsync=False):
+        """
+        Constructor. Reads any existing records in **path**
+        and opens it for appending. A partially written last
+        record, from a run that died mid write, is ignored.
+
+        :param path: path to journal file
+        :type path: str
+        :param fsync: if True every record is also fsynced to disk
+                      to survive an operating system crash
+        :type fsync: bool
+        """
+        self._path = path
+        self._fsync = fsync
+        self._records = {}
+        needs_newline = False
+        if os.path.isfile(path):
+            needs_newline = self._load()
+        self._file = open(path, 'a')
+        if needs_newline is True:
+            # terminate partial record so next one starts on new line
+            self._file.write('\n')
+
+    def _load(self):
+        """
+        Loads records from journal, the last record for a
+        key wins
+
+        :return: True if journal does not end with a newline
+        :rtype: bool
+        """
+        line = ''
+        with open(self._path, 'r') as f:
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    sys.stderr.write('Skipping invalid journal record: ' +
+                                     line + '\n')
+                    continue
+                self._records[record[TaskJournal.KEY]] = record
+        return len(line) > 0 and not line.endswith('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes journal file
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get(self, key):
+        """
+        Gets latest record for **key**
+
+        :param key: key of gene set
+        :type key: str
+        :return: record or None if there is none
+        :rtype: dict
+        """
+        return self._records.get(key)
+
+    def get_records(self):
+        """
+        Gets latest record of every key
+
+        :return: records keyed by key of gene set
+        :rtype: dict
+        """
+        return dict(self._records)
+
+    def _write(self, record):
+        """
+        Appends **record** to journal
+        """
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if self._fsync is True:
+            os.fsync(self._file.fileno())
+        self._records[record[TaskJournal.KEY]] = record
+
+    def record_submitted(self, key, taskid):
+        """
+        Records that **key** was submitted as task **taskid**
+
+        :param key: key of gene set
+        :type key: str
+        :param taskid: id of task on iQuery
+        :type taskid: str
+        """
+        self._write({TaskJournal.KEY: key,
+                     TaskJournal.TASKID: taskid,
+                     TaskJournal.STATE: TaskJournal.STATE_SUBMITTED})
+
+    def record_done(self, key, taskid, result):
+        """
+        Records that task **taskid** for **key** completed
+        with **result**
+
+        :param key: key of gene set
+        :type key: str
+        :param taskid: id of task on iQuery
+        :type taskid: str
+        :param result: JSON serializable result, can be None if
+                       no term was found
+        """
+        self._write({TaskJournal.KEY: key,
+                     TaskJournal.TASKID: taskid,
+                     TaskJournal.STATE: TaskJournal.STATE_DONE,
+                     TaskJournal.RESULT: result})
+
+    def record_failed(self, key, taskid):
+        """
+        Records that task **taskid** for **key** failed and
+        should be submitted again on the next run
+
+        :param key: key of gene set
+        :type key: str
+        :param taskid: id of task on iQuery
+        :type taskid: str
+        """
+        self._write({TaskJournal.KEY: key,
+                     TaskJournal.TASKID: taskid,
+                     TaskJournal.STATE: TaskJournal.STATE_FAILED})
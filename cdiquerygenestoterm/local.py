@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import math
+import heapq
+import bisect
+from collections import Counter
+
+# keys of JSON snapshot, see load_snapshot()
+NETWORKS_KEY = 'networks'
+UNIVERSE_SIZE_KEY = 'universe_size'
+NAME_KEY = 'name'
+SOURCE_KEY = 'source'
+URL_KEY = 'url'
+NODES_KEY = 'nodes'
+GENES_KEY = 'genes'
+
+# terms of p value sum smaller than this fraction of the sum are dropped
+PVALUE_TOLERANCE = 1e-12
+
+
+def get_log_factorials(n):
+    """
+    Gets natural log of factorial of 0 to **n**
+
+    :param n: largest value
+    :type n: int
+    :return: list where index i is log(i!)
+    :rtype: list
+    """
+    logfact = [0.0] * (n + 1)
+    for i in range(2, n + 1):
+        logfact[i] = logfact[i - 1] + math.log(i)
+    return logfact
+
+
+def hypergeometric_sf(k, total, successes, draws, logfact):
+    """
+    Gets probability of drawing **k** or more successes in **draws**
+    draws, without replacement, from a population of **total** with
+    **successes** successes. This is the one sided p value of an
+    overlap of **k** genes between a query of **draws** genes and
+    a network of **successes** genes out of **total** genes
+
+    :param k: successes drawn
+    :type k: int
+    :param total: size of population
+    :type total: int
+    :param successes: successes in population
+    :type successes: int
+    :param draws: number of draws
+    :type draws: int
+    :param logfact: log factorials up to at least **total**, see
+                    :py:func:`get_log_factorials`
+    :type logfact: list
+    :return: p value
+    :rtype: float
+    """
+    if k <= 0:
+        return 1.0
+    upper = min(draws, successes)
+    if k > upper:
+        return 0.0
+    failures = total - successes
+    denom = logfact[total] - logfact[draws] - logfact[total - draws]
+    base = logfact[successes] + logfact[failures] - denom
+    pvalue = 0.0
+    for i in range(k, upper + 1):
+        if draws - i > failures:
+            continue
+        term = math.exp(base - logfact[i] - logfact[successes - i] -
+                        logfact[draws - i] -
+                        logfact[failures - draws + i])
+        pvalue += term
+        if term < pvalue * PVALUE_TOLERANCE:
+            break
+    return min(1.0, pvalue)
+
+
+def get_network_genes(network):
+    """
+    Gets canonical genes of **network** from snapshot
+
+    :param network: network from snapshot
+    :type network: dict
+    :return: unique, trimmed and upper cased genes
+    :rtype: set
+    """
+    genes = set()
+    for gene in network.get(GENES_KEY, []):
+        gene = gene.strip()
+        if len(gene) > 0:
+            genes.add(gene.upper())
+    return genes
+
+
+class LocalEnrichmentEngine(object):
+    """
+    Maps gene sets without calling iQuery by computing enrichment
+    against a local snapshot of the networks iQuery searches.
+
+    :py:meth:`query` returns results shaped like those of iQuery so
+    they go through the same selection and mapping, see
+    :py:func:`~.cdiquerygenestotermcmd.get_output_for_result`.
+    For each network sharing at least one gene with the query,
+    ``similarity`` is the cosine similarity of the query and network
+    as binary gene vectors and ``PValue`` is the hypergeometric
+    probability of an overlap at least as large given the number of
+    genes in the snapshot.
+
+    Genes are mapped to networks via an inverted index,
+    :py:class:`~cdiquerygenestoterm.index.GeneIndex`, so a query
+    only touches networks that share a gene with it.
+    """
+
+    def __init__(self, networks, universe_size=None, index=None):
+        """
+        Constructor
+
+        :param networks: sequence of dicts with ``name``, ``url``,
+                         ``genes`` and optionally ``source`` and
+                         ``nodes``, number of nodes in network, which
+                         defaults to number of genes. Only networks
+                         sharing a gene with a query are read
+        :type networks: list
+        :param universe_size: number of genes p values are computed
+                              against, if None number of unique
+                              genes in **networks** is used
+        :type universe_size: int
+        :param index: index of **networks**, in same order, in which
+                      case ``genes`` is not needed. If None, it is
+                      built from ``genes``
+        :type index: :py:class:`~cdiquerygenestoterm.index.GeneIndex`
+        """
+        from cdiquerygenestoterm.index import GeneIndex
+        if index is None:
+            index = GeneIndex.build([get_network_genes(network)
+                                     for network in networks])
+        elif index.get_network_count() != len(networks):
+            raise ValueError('Index has ' +
+                             str(index.get_network_count()) +
+                             ' networks, but there are ' +
+                             str(len(networks)))
+        self._networks = networks
+        self._index = index
+        if universe_size is None:
+            universe_size = index.get_gene_count()
+        self._universe_size = max(universe_size, index.get_gene_count())
+        self._logfact = get_log_factorials(self._universe_size)
+        self._arrays = None
+
+    def get_index(self):
+        """
+        :return: index of genes to networks
+        :rtype: :py:class:`~cdiquerygenestoterm.index.GeneIndex`
+        """
+        return self._index
+
+    def get_networks(self):
+        """
+        :return: networks passed to constructor
+        """
+        return self._networks
+
+    def get_network_count(self):
+        """
+        :return: number of networks in snapshot
+        :rtype: int
+        """
+        return len(self._networks)
+
+    def get_universe_size(self):
+        """
+        :return: number of genes p values are computed against
+        :rtype: int
+        """
+        return self._universe_size
+
+    def get_hits(self, genes):
+        """
+        Gets genes of **genes** in each network sharing a gene
+        with them
+
+        :param genes: canonical genes, see
+            :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+        :type genes: list
+        :return: network id => list of genes found in network
+        :rtype: dict
+        """
+        hits = {}
+        for gene in genes:
+            for netid in self._index.get_networks(gene.upper()):
+                found = hits.get(netid)
+                if found is None:
+                    hits[netid] = [gene]
+                else:
+                    found.append(gene)
+        return hits
+
+    def _get_arrays(self):
+        """
+        Gets NumPy and the offsets, postings and sizes of the index as
+        arrays that share memory with it, made on first call
+
+        :return: (numpy, offsets, postings, sizes as floats) tuple
+                 or None if NumPy is not installed
+        :rtype: tuple
+        """
+        if self._arrays is None:
+            try:
+                import numpy as np
+            except ImportError:  # pragma: no cover
+                self._arrays = ()
+            else:
+                index = self._index
+                self._arrays = (np,
+                                np.frombuffer(index.get_offsets(),
+                                              dtype=np.uint32),
+                                np.frombuffer(index.get_postings(),
+                                              dtype=np.uint32),
+                                np.frombuffer(index.get_sizes(),
+                                              dtype=np.uint32).
+                                astype(np.float64))
+        if len(self._arrays) == 0:
+            return None
+        return self._arrays
+
+    def _get_top_networks(self, genes, postings, k):
+        """
+        Gets the **k** networks of highest similarity to **genes**,
+        earlier hit networks winning ties, using NumPy if it is
+        installed. Hits are counted for every network with
+        :py:func:`numpy.bincount`, after which similarity and
+        selection are array operations
+
+        :param genes: canonical genes
+        :type genes: list
+        :param postings: list of (gene, sorted network ids) tuples
+        :type postings: list
+        :param k: number of networks
+        :type k: int
+        :return: ids of networks in the order they are first hit
+        :rtype: list
+        """
+        numgenes = len(genes)
+        arrays = self._get_arrays()
+        if arrays is None:
+            counts = Counter()
+            for _, netids in postings:
+                counts.update(netids)
+            sizes = self._index.get_size
+            ranked = heapq.nlargest(
+                k, enumerate(counts),
+                key=lambda item: counts[item[1]] /
+                math.sqrt(numgenes * sizes(item[1])))
+            return [netid for _, netid in sorted(ranked)]
+
+        np, offsets, allpostings, sizes = arrays
+        chunks = []
+        for gene in genes:
+            geneid = self._index.get_gene_id(gene.upper())
+            if geneid is not None:
+                chunks.append(allpostings[offsets[geneid]:
+                                          offsets[geneid + 1]])
+        if len(chunks) == 0:
+            return []
+        netids = np.concatenate(chunks)
+        counts = np.bincount(netids)
+        hit = np.flatnonzero(counts)
+        similarity = counts[hit] / np.sqrt(numgenes * sizes[hit])
+        if len(hit) > k:
+            threshold = np.partition(similarity,
+                                     len(hit) - k)[len(hit) - k]
+            keep = similarity >= threshold
+            hit = hit[keep]
+            similarity = similarity[keep]
+
+        # position each remaining network is first hit at, hit is
+        # sorted as is the unique of the network ids hitting it
+        _, first = np.unique(netids[np.isin(netids, hit)],
+                             return_index=True)
+        best = np.lexsort((first, -similarity))[:k]
+        return [int(netid) for netid in hit[best[np.argsort(first[best])]]]
+
+    @staticmethod
+    def _get_hit_genes(postings, netid):
+        """
+        Gets genes in network **netid**
+
+        :param postings: list of (gene, sorted network ids) tuples
+        :type postings: list
+        :return: genes found in network
+        :rtype: list
+        """
+        hitgenes = []
+        for gene, netids in postings:
+            pos = bisect.bisect_left(netids, netid)
+            if pos < len(netids) and netids[pos] == netid:
+                hitgenes.append(gene)
+        return hitgenes
+
+    def query(self, genes, k=None):
+        """
+        Computes enrichment of **genes** against every network in
+        snapshot
+
+        Similarity only needs the number of genes hit, so if **k** is
+        set, only the **k** networks of highest similarity, earlier
+        hit networks winning ties, get a ``PValue``, network metadata
+        and hit genes. That gives the same best **k** results by
+        similarity as computing every network, at a fraction of the
+        cost
+
+        :param genes: canonical genes, see
+            :py:class:`~cdiquerygenestoterm.canonical.GeneCanonicalizer`
+        :type genes: list
+        :param k: if set, only return the **k** results of highest
+                  similarity, otherwise return a result for every
+                  network, as is needed to rank by p-value or to
+                  filter results
+        :type k: int
+        :return: results in format of iQuery with a result for
+                 every network with at least one gene in **genes**,
+                 or the best **k** of them, in the order networks
+                 are first hit
+        :rtype: dict
+        """
+        numgenes = len(genes)
+        sizes = self._index.get_size
+        if k is None:
+            hits = self.get_hits(genes)
+            candidates = list(hits)
+        else:
+            hits = None
+            postings = [(gene, self._index.get_networks(gene.upper()))
+                        for gene in genes]
+            candidates = self._get_top_networks(genes, postings, k)
+        draws = min(numgenes, self._universe_size)
+        results = []
+        for netid in candidates:
+            network = self._networks[netid]
+            size = sizes(netid)
+            if hits is None:
+                hitgenes = self._get_hit_genes(postings, netid)
+            else:
+                hitgenes = hits[netid]
+            numhits = len(hitgenes)
+            results.append({'description':
+                            network.get(SOURCE_KEY, 'NA') + ': ' +
+                            network[NAME_KEY],
+                            'details': {
+                                'PValue': hypergeometric_sf(
+                                    numhits, self._universe_size, size,
+                                    draws, self._logfact),
+                                'similarity': numhits /
+                                math.sqrt(numgenes * size)},
+                            'url': network.get(URL_KEY),
+                            'nodes': network.get(NODES_KEY, size),
+                            'hitGenes': hitgenes})
+        return {'sources': [{'results': results}]}
+
+
+def read_json_snapshot(snapshotfile):
+    """
+    Reads JSON snapshot in **snapshotfile**, which can be gzipped,
+    of the form:
+
+    .. code-block::
+
+        {"universe_size": <optional number of genes>,
+         "networks": [{"name": "<NAME OF NETWORK>",
+                       "source": "<SOURCE OF NETWORK>",
+                       "url": "<URL OF NETWORK IN NDEx>",
+                       "nodes": <NUMBER OF NODES IN NETWORK>,
+                       "genes": ["<GENE>", ...]}, ...]}
+
+    :param snapshotfile: path to snapshot
+    :type snapshotfile: str
+    :raises ValueError: if snapshot is not valid
+    :return: (networks, universe size or None) tuple
+    :rtype: tuple
+    """
+    from cdiquerygenestoterm.reader import open_inputfile
+    with open_inputfile(snapshotfile) as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or\
+            not isinstance(snapshot.get(NETWORKS_KEY), list):
+        raise ValueError('Snapshot ' + snapshotfile + ' must be a JSON '
+                         'object with ' + NETWORKS_KEY + ' list')
+    networks = snapshot[NETWORKS_KEY]
+    for network in networks:
+        if NAME_KEY not in network:
+            raise ValueError('Network in snapshot ' + snapshotfile +
+                             ' is missing ' + NAME_KEY)
+    return networks, snapshot.get(UNIVERSE_SIZE_KEY)
+
+
+def load_snapshot(snapshotfile, indexfile=None):
+    """
+    Loads :py:class:`LocalEnrichmentEngine` from **snapshotfile**
+    which is either a binary snapshot, see
+    :py:func:`~cdiquerygenestoterm.snapshot.write_binary_snapshot`,
+    that is memory mapped or a JSON snapshot, see
+    :py:func:`read_json_snapshot`.
+
+    For a JSON snapshot, if **indexfile** is set and is newer than
+    **snapshotfile**, the index of genes to networks is memory mapped
+    from it, otherwise the index is built and written to **indexfile**
+
+    :param snapshotfile: path to snapshot
+    :type snapshotfile: str
+    :param indexfile: path to index of JSON snapshot, see
+                      :py:meth:`~cdiquerygenestoterm.index.GeneIndex.write`
+    :type indexfile: str
+    :raises ValueError: if snapshot is not valid
+    :return: engine
+    :rtype: :py:class:`LocalEnrichmentEngine`
+    """
+    from cdiquerygenestoterm import snapshot
+    if snapshot.is_binary_snapshot(snapshotfile):
+        return snapshot.load_binary_snapshot(snapshotfile)
+    from cdiquerygenestoterm.index import GeneIndex
+    networks, universe_size = read_json_snapshot(snapshotfile)
+    index = None
+    if indexfile is not None:
+        if os.path.isfile(indexfile) and\
+                os.path.getmtime(indexfile) >= \
+                os.path.getmtime(snapshotfile):
+            index = GeneIndex.load(indexfile)
+            if index.get_network_count() != len(networks):
+                index = None
+        if index is None:
+            index = GeneIndex.build([get_network_genes(network)
+                                     for network in networks])
+            index.write(indexfile)
+    return LocalEnrichmentEngine(networks, index=index,
+                                 universe_size=universe_size)
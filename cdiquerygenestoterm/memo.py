@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+
+class _InflightCall(object):
+    """
+    Result of a computation other threads are waiting on
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MappedTermMemo(object):
+    """
+    Thread safe in memory least recently used (LRU) cache of
+    mapped terms with hit and miss counters.
+
+    :py:meth:`get_or_compute` also collapses concurrent calls for the
+    same key so only the first caller runs the computation, a single
+    iQuery task, and all other callers wait for and share its result.
+    None results are shared with waiting callers, but not stored.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Constructor
+
+        :param maxsize: maximum number of terms to keep
+        :type maxsize: int
+        """
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+
+    def get_stats(self):
+        """
+        Gets counters for this memo
+
+        :return: dict with ``hits``, ``misses``, ``shared`` (calls
+                 that waited on an identical call already running)
+                 and ``size``
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'shared': self._shared,
+                    'size': len(self._entries)}
+
+    def get(self, key):
+        """
+        Gets term for **key** marking it as most recently used
+
+        :param key: key, usually from
+                    :py:func:`~cdiquerygenestoterm.cache.get_cache_key`
+        :type key: str
+        :return: term or None if not found
+        :rtype: :py:class:`~cdiquerygenestoterm.term.MappedTerm`
+        """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        """
+        Same as :py:meth:`get`, but caller must hold lock
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return self._entries[key]
+        self._misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Stores **value** under **key** evicting least recently
+        used term if full. None values are ignored
+
+        :param key: key
+        :type key: str
+        :param value: term
+        :type value: :py:class:`~cdiquerygenestoterm.term.MappedTerm`
+        """
+        if value is None or self._maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, func):
+        """
+        Gets term for **key** calling **func** to compute it if
+        not found. If another thread is already computing **key**
+        this waits for that result instead of calling **func**
+
+        :param key: key
+        :type key: str
+        :param func: function that takes no arguments and
+                     returns the term
+        :raises Exception: whatever **func** raised, including in
+                           the thread waited on
+        :return: term
+        :rtype: :py:class:`~cdiquerygenestoterm.term.MappedTerm`
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            call = self._inflight.get(key)
+            if call is not None:
+                self._shared += 1
+                leader = False
+            else:
+                call = _InflightCall()
+                self._inflight[key] = call
+                leader = True
+
+        if leader is False:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            self.put(key, call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
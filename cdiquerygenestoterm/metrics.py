@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from contextlib import contextmanager
+
+# names of spans recorded by cdiquerygenestotermcmd
+SPAN_TOTAL = 'total'
+SPAN_SUBMIT = 'submit'
+SPAN_WAIT = 'wait'
+SPAN_POLL = 'poll'
+SPAN_DOWNLOAD = 'download'
+SPAN_PARSE = 'parse'
+SPAN_MAP = 'map'
+SPAN_LOCAL = 'local'
+
+# names of counters recorded by cdiquerygenestotermcmd
+COUNTER_POLLS = 'polls'
+COUNTER_BYTES_RECEIVED = 'bytes_received'
+COUNTER_CACHE_HITS = 'cache_hits'
+COUNTER_MEMO_HITS = 'memo_hits'
+COUNTER_JOURNAL_HITS = 'journal_hits'
+COUNTER_LOCAL_ANSWERS = 'local_answers'
+COUNTER_LOCAL_FALLBACKS = 'local_fallbacks'
+
+
+class Timing(object):
+    """
+    Count, total, minimum and maximum of the durations of a span
+    """
+
+    __slots__ = ['count', 'total', 'min', 'max']
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        """
+        Adds a duration
+
+        :param seconds: duration
+        :type seconds: float
+        """
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        Adds all durations in **other** to this object
+
+        :param other: timing to merge
+        :type other: :py:class:`Timing`
+        """
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+    def to_dict(self):
+        """
+        Gets this timing as a JSON serializable dict
+
+        :return: dict with ``count``, ``total``, ``mean``, ``min``
+                 and ``max`` where times are in seconds
+        :rtype: dict
+        """
+        mean = None
+        if self.count > 0:
+            mean = self.total / self.count
+        return {'count': self.count, 'total': self.total, 'mean': mean,
+                'min': self.min, 'max': self.max}
+
+
+class TaskMetrics(object):
+    """
+    Timing spans, counters and http status codes of a single
+    gene set query. An instance should only be updated by one
+    thread at a time.
+
+    If a **listener** is set, its ``task_submitted`` method is
+    called with this object by :py:meth:`record_submitted`, its
+    ``task_resumed`` method by :py:meth:`record_resumed` and its
+    ``task_finished`` method by :py:meth:`finish`, letting it keep
+    live totals such as
+    :py:class:`~cdiquerygenestoterm.exporter.PrometheusExporter`
+    """
+
+    def __init__(self, name=None, clock=time.perf_counter, listener=None):
+        """
+        Constructor
+
+        :param name: name of task, usually id of gene set
+        :type name: str
+        :param clock: function returning current time in seconds
+        :param listener: notified when task is submitted and finished
+        """
+        self.name = name
+        self.taskid = None
+        self.submitted = False
+        self.resumed = False
+        self.found = None
+        self._clock = clock
+        self._listener = listener
+        self._spans = {}
+        self._counters = {}
+        self._status_codes = {}
+
+    def add_time(self, name, seconds):
+        """
+        Adds **seconds** to span **name**
+
+        :param name: name of span
+        :type name: str
+        :param seconds: duration
+        :type seconds: float
+        """
+        timing = self._spans.get(name)
+        if timing is None:
+            timing = Timing()
+            self._spans[name] = timing
+        timing.add(seconds)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Context manager that adds the time spent in it to span **name**
+
+        :param name: name of span
+        :type name: str
+        """
+        start = self._clock()
+        try:
+            yield self
+        finally:
+            self.add_time(name, self._clock() - start)
+
+    def incr(self, name, value=1):
+        """
+        Increments counter **name** by **value**
+
+        :param name: name of counter
+        :type name: str
+        :param value: amount to increment by
+        :type value: int
+        """
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def record_response(self, response):
+        """
+        Records http status code and bytes received in body of
+        **response**
+
+        :param response: response
+        :type response: :py:class:`requests.Response`
+        """
+        status = str(response.status_code)
+        self._status_codes[status] = self._status_codes.get(status, 0) + 1
+        content = response.content
+        if content is not None:
+            self.incr(COUNTER_BYTES_RECEIVED, len(content))
+
+    def record_submitted(self, taskid):
+        """
+        Records that query was submitted to iQuery as task **taskid**
+
+        :param taskid: id of task
+        :type taskid: str
+        """
+        self.taskid = taskid
+        self.submitted = True
+        if self._listener is not None:
+            self._listener.task_submitted(self)
+
+    def record_resumed(self, taskid):
+        """
+        Records that task **taskid**, submitted to iQuery by an
+        earlier run, is being waited on again
+
+        :param taskid: id of task
+        :type taskid: str
+        """
+        self.taskid = taskid
+        self.submitted = True
+        self.resumed = True
+        if self._listener is not None:
+            self._listener.task_resumed(self)
+
+    def finish(self, found):
+        """
+        Records that query is done. Should be called once, after
+        the ``total`` span is recorded
+
+        :param found: True if a term was found
+        :type found: bool
+        """
+        self.found = found
+        if self._listener is not None:
+            self._listener.task_finished(self)
+
+    def get_spans(self):
+        """
+        :return: span name => :py:class:`Timing`
+        :rtype: dict
+        """
+        return self._spans
+
+    def get_counters(self):
+        """
+        :return: counter name => value
+        :rtype: dict
+        """
+        return self._counters
+
+    def get_status_codes(self):
+        """
+        :return: http status code as str => number of responses
+        :rtype: dict
+        """
+        return self._status_codes
+
+    def to_dict(self):
+        """
+        Gets metrics as JSON serializable dict
+
+        :return: dict with ``taskid``, ``spans``, ``counters`` and
+                 ``status_codes``
+        :rtype: dict
+        """
+        return {'taskid': self.taskid,
+                'spans': dict([(k, v.to_dict())
+                               for k, v in self._spans.items()]),
+                'counters': dict(self._counters),
+                'status_codes': dict(self._status_codes)}
+
+
+class _NullTaskMetrics(TaskMetrics):
+    """
+    :py:class:`TaskMetrics` that records nothing, used when
+    metrics are not wanted so callers need not check for None
+    """
+
+    @property
+    def taskid(self):
+        return None
+
+    @taskid.setter
+    def taskid(self, value):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    @contextmanager
+    def span(self, name):
+        yield self
+
+    def incr(self, name, value=1):
+        pass
+
+    def record_response(self, response):
+        pass
+
+    def record_submitted(self, taskid):
+        pass
+
+    def record_resumed(self, taskid):
+        pass
+
+    def finish(self, found):
+        pass
+
+
+NULL_TASK_METRICS = _NullTaskMetrics()
+
+
+class RunMetrics(object):
+    """
+    Metrics of a run of one or more gene set queries, each with its
+    own :py:class:`TaskMetrics`. :py:meth:`get_summary` gives the
+    metrics of every task along with an aggregate over all of them.
+    """
+
+    def __init__(self, clock=time.perf_counter, listener=None,
+                 keep_tasks=True):
+        """
+        Constructor
+
+        :param clock: function returning current time in seconds
+        :param listener: passed to every :py:class:`TaskMetrics`
+                         created
+        :param keep_tasks: if False, tasks are not kept so memory
+                           does not grow in long running processes
+                           that only need the **listener**
+        :type keep_tasks: bool
+        """
+        self._clock = clock
+        self._listener = listener
+        self._keep_tasks = keep_tasks
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._workers = {}
+
+    def create_task(self, name=None):
+        """
+        Creates metrics for a new task
+
+        :param name: name of task, usually id of gene set
+        :type name: str
+        :return: metrics for task
+        :rtype: :py:class:`TaskMetrics`
+        """
+        task = TaskMetrics(name=name, clock=self._clock,
+                           listener=self._listener)
+        if self._keep_tasks is True:
+            with self._lock:
+                self._tasks.append(task)
+        return task
+
+    def add_task(self, task):
+        """
+        Adds **task** created elsewhere, such as in a worker process,
+        once it is finished. The **listener** is notified as if the
+        task had run here
+
+        :param task: metrics of finished task
+        :type task: :py:class:`TaskMetrics`
+        """
+        task._listener = self._listener
+        if self._listener is not None:
+            if task.resumed is True:
+                self._listener.task_resumed(task)
+            elif task.submitted is True:
+                self._listener.task_submitted(task)
+            self._listener.task_finished(task)
+        if self._keep_tasks is True:
+            with self._lock:
+                self._tasks.append(task)
+
+    def record_worker(self, worker, genesets, seconds):
+        """
+        Records that **worker** spent **seconds** running
+        **genesets** gene sets
+
+        :param worker: name of worker, such as its process id
+        :type worker: str
+        :param genesets: number of gene sets run
+        :type genesets: int
+        :param seconds: time spent running them
+        :type seconds: float
+        """
+        with self._lock:
+            stats = self._workers.setdefault(str(worker),
+                                             {'shards': 0, 'genesets': 0,
+                                              'busy': 0.0})
+            stats['shards'] += 1
+            stats['genesets'] += genesets
+            stats['busy'] += seconds
+
+    def get_workers(self):
+        """
+        Gets throughput of each worker passed to
+        :py:meth:`record_worker`
+
+        :return: worker => dict with ``shards``, ``genesets``,
+                 ``busy``, seconds spent running gene sets, and
+                 ``genesets_per_second`` while busy
+        :rtype: dict
+        """
+        workers = {}
+        with self._lock:
+            for worker, stats in self._workers.items():
+                rate = None
+                if stats['busy'] > 0:
+                    rate = stats['genesets'] / stats['busy']
+                workers[worker] = dict(stats, genesets_per_second=rate)
+        return workers
+
+    def get_tasks(self):
+        """
+        :return: metrics of every task in order created
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._tasks)
+
+    def get_aggregate(self):
+        """
+        Gets spans, counters and status codes summed over all tasks
+
+        :return: dict with ``tasks``, the number of tasks, ``spans``,
+                 ``counters`` and ``status_codes``
+        :rtype: dict
+        """
+        spans = {}
+        counters = {}
+        status_codes = {}
+        tasks = self.get_tasks()
+        for task in tasks:
+            for name, timing in task.get_spans().items():
+                spans.setdefault(name, Timing()).merge(timing)
+            for name, value in task.get_counters().items():
+                counters[name] = counters.get(name, 0) + value
+            for code, value in task.get_status_codes().items():
+                status_codes[code] = status_codes.get(code, 0) + value
+        return {'tasks': len(tasks),
+                'spans': dict([(k, v.to_dict()) for k, v in spans.items()]),
+                'counters': counters,
+                'status_codes': status_codes}
+
+    def get_summary(self):
+        """
+        Gets JSON serializable summary of run
+
+        :return: dict with ``elapsed``, seconds since this object was
+                 created, ``tasks``, a dict of task name =>
+                 :py:meth:`TaskMetrics.to_dict`, and ``aggregate``,
+                 see :py:meth:`get_aggregate`. If gene sets were run
+                 by worker processes, ``workers`` has
+                 :py:meth:`get_workers`
+        :rtype: dict
+        """
+        tasks = {}
+        for index, task in enumerate(self.get_tasks()):
+            name = task.name
+            if name is None or name in tasks:
+                name = str(index)
+            tasks[name] = task.to_dict()
+        summary = {'elapsed': self._clock() - self._start,
+                   'tasks': tasks,
+                   'aggregate': self.get_aggregate()}
+        workers = self.get_workers()
+        if len(workers) > 0:
+            summary['workers'] = workers
+        return summary
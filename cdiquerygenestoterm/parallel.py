@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from cdiquerygenestoterm.memo import MappedTermMemo
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.cdiquerygenestotermcmd import LazySession
+from cdiquerygenestoterm.cdiquerygenestotermcmd import iter_iquery_results
+from cdiquerygenestoterm.cdiquerygenestotermcmd import create_session_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import create_cache_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import\
+    create_canonicalizer_from_args
+from cdiquerygenestoterm.cdiquerygenestotermcmd import create_engine_from_args
+
+# default number of gene sets sent to a worker process at a time
+DEFAULT_SHARD_SIZE = 50
+
+# session, cache, memo, canonicalizer and engine of this worker
+# process, set by _init_worker()
+_worker = {}
+
+
+def _init_worker(theargs):
+    """
+    Creates state reused by every shard run in this worker process.
+    A binary ``--snapshot`` is memory mapped so its pages are
+    shared with every other worker
+    """
+    _worker['theargs'] = theargs
+    _worker['session'] = LazySession(lambda:
+                                     create_session_from_args(theargs))
+    _worker['cache'] = create_cache_from_args(theargs)
+    _worker['memo'] = MappedTermMemo(maxsize=theargs.memo_size)
+    _worker['canonicalizer'] = create_canonicalizer_from_args(theargs)
+    _worker['engine'] = create_engine_from_args(theargs)
+
+
+def _run_shard(genesets, keep_metrics, canonical):
+    """
+    Runs **genesets** in worker process, see
+    :py:func:`iter_iquery_results_parallel` for **canonical**
+
+    :return: (process id, results in order of **genesets**, list of
+             :py:class:`~cdiquerygenestoterm.metrics.TaskMetrics` or
+             None if **keep_metrics** is False, seconds taken) tuple
+    :rtype: tuple
+    """
+    start = time.perf_counter()
+    metrics = None
+    if keep_metrics is True:
+        metrics = RunMetrics()
+    results = dict(iter_iquery_results(genesets, _worker['theargs'],
+                                       session=_worker['session'],
+                                       cache=_worker['cache'],
+                                       memo=_worker['memo'],
+                                       metrics=metrics,
+                                       canonicalizer=_worker[
+                                           'canonicalizer'],
+                                       engine=_worker['engine'],
+                                       canonical=canonical))
+    tasks = None
+    if metrics is not None:
+        tasks = metrics.get_tasks()
+    return (os.getpid(), [results[setid] for setid, _ in genesets],
+            tasks, time.perf_counter() - start)
+
+
+def _iter_shards(genesets, shard_size):
+    """
+    Yields lists of up to **shard_size** gene sets from **genesets**
+    """
+    shard = []
+    for geneset in genesets:
+        shard.append(geneset)
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+    if len(shard) > 0:
+        yield shard
+
+
+def _iter_shard_results(shard, future, metrics):
+    """
+    Waits for **future** running **shard** and yields its results,
+    adding its task metrics and worker throughput to **metrics**
+    """
+    pid, results, tasks, seconds = future.result()
+    if metrics is not None:
+        for task in tasks:
+            metrics.add_task(task)
+        metrics.record_worker(pid, len(shard), seconds)
+    for (setid, _), theres in zip(shard, results):
+        yield setid, theres
+
+
+def iter_iquery_results_parallel(genesets, theargs, processes,
+                                 metrics=None,
+                                 shard_size=DEFAULT_SHARD_SIZE,
+                                 mp_context=None, canonical=False):
+    """
+    Runs **genesets** on **processes** worker processes so CPU bound
+    work, parsing results from iQuery and mapping gene sets with a
+    local ``--snapshot``, is not limited to one core. Gene sets are
+    sent to workers in shards of **shard_size** and each worker runs
+    its shards with
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.iter_iquery_results`
+    using a session, cache, memo, canonicalizer and engine created
+    once per worker from **theargs**, so up to ``theargs.max_inflight``
+    tasks per worker run on iQuery at once.
+
+    Only ``processes * 2`` shards are queued at a time so memory does
+    not grow with number of gene sets. Results are yielded in the
+    order of **genesets** no matter which worker finishes first.
+
+    :param genesets: iterable of (id, list of genes) tuples
+    :param theargs: parsed command line arguments, passed to workers
+    :param processes: number of worker processes
+    :type processes: int
+    :param metrics: metrics of run, gets metrics of each gene set
+        and throughput of each worker, see
+        :py:meth:`~cdiquerygenestoterm.metrics.RunMetrics.record_worker`
+    :type metrics: :py:class:`~cdiquerygenestoterm.metrics.RunMetrics`
+    :param shard_size: number of gene sets sent to a worker at once
+    :type shard_size: int
+    :param mp_context: multiprocessing context used to start workers,
+                       if None the default is used
+    :param canonical: if True, genes in **genesets** are already in
+                      canonical form and are used as is
+    :type canonical: bool
+    :return: generator of (id, mapped term or None) tuples in
+             order of **genesets**
+    """
+    shard_size = max(1, shard_size)
+    keep_metrics = metrics is not None
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=mp_context,
+                             initializer=_init_worker,
+                             initargs=(theargs,)) as executor:
+        for shard in _iter_shards(genesets, shard_size):
+            pending.append((shard, executor.submit(_run_shard, shard,
+                                                   keep_metrics,
+                                                   canonical)))
+            if len(pending) >= processes * 2:
+                shard, future = pending.popleft()
+                for res in _iter_shard_results(shard, future, metrics):
+                    yield res
+        while len(pending) > 0:
+            shard, future = pending.popleft()
+            for res in _iter_shard_results(shard, future, metrics):
+                yield res
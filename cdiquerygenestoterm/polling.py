@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+
+
+class PollingStrategy(object):
+    """
+    Base class for strategies that decide how long to wait
+    between checks on the status of an iQuery task
+    """
+
+    def get_delay(self, attempt, progress=None, elapsed=None):
+        """
+        Gets time in seconds to wait before next status check
+
+        :param attempt: number of status checks done so far
+                        (1 after the first check)
+        :type attempt: int
+        :param progress: progress (0-100) reported by the service on
+                         the last check or None if unknown
+        :type progress: int
+        :param elapsed: seconds since the task was submitted
+        :type elapsed: float
+        :return: seconds to wait
+        :rtype: float
+        """
+        raise NotImplementedError('subclasses should implement this')
+
+
+class FixedPollingStrategy(PollingStrategy):
+    """
+    Always waits the same **interval** between status checks
+    """
+
+    def __init__(self, interval=1):
+        """
+        Constructor
+
+        :param interval: seconds to wait between checks
+        :type interval: float
+        """
+        self._interval = interval
+
+    def get_delay(self, attempt, progress=None, elapsed=None):
+        """
+        Gets time in seconds to wait before next status check
+
+        :return: interval passed into constructor
+        :rtype: float
+        """
+        return self._interval
+
+
+class BackoffPollingStrategy(PollingStrategy):
+    """
+    Starts with a short wait that grows exponentially with each
+    status check up to **max_delay**. When the service reports
+    partial progress the remaining time is estimated from the
+    elapsed time and the wait is set to **progress_fraction** of
+    that estimate. Every wait has random jitter applied so many
+    tasks submitted together do not poll in lock step.
+    """
+
+    def __init__(self, initial_delay=0.25, max_delay=10.0,
+                 multiplier=2.0, jitter=0.1, progress_fraction=0.5,
+                 rng=None):
+        """
+        Constructor
+
+        :param initial_delay: seconds to wait after first check
+        :type initial_delay: float
+        :param max_delay: maximum seconds to wait between checks
+        :type max_delay: float
+        :param multiplier: factor to grow wait by after each check
+        :type multiplier: float
+        :param jitter: wait is randomly scaled by up to +/- this
+                       fraction
+        :type jitter: float
+        :param progress_fraction: fraction of estimated remaining
+                                  time to wait when progress is known
+        :type progress_fraction: float
+        :param rng: random number generator, if None
+                    :py:mod:`random` is used
+        :type rng: :py:class:`random.Random`
+        """
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._multiplier = multiplier
+        self._jitter = jitter
+        self._progress_fraction = progress_fraction
+        if rng is None:
+            self._rng = random
+        else:
+            self._rng = rng
+
+    def get_delay(self, attempt, progress=None, elapsed=None):
+        """
+        Gets time in seconds to wait before next status check
+
+        :param attempt: number of status checks done so far
+        :type attempt: int
+        :param progress: progress (0-100) reported by the service
+        :type progress: int
+        :param elapsed: seconds since the task was submitted
+        :type elapsed: float
+        :return: seconds to wait
+        :rtype: float
+        """
+        delay = self._initial_delay * (self._multiplier **
+                                       max(0, attempt - 1))
+        if progress is not None and 0 < progress < 100 and\
+                elapsed is not None and elapsed > 0:
+            remaining = elapsed * (100 - progress) / progress
+            delay = max(self._initial_delay,
+                        remaining * self._progress_fraction)
+        delay = min(self._max_delay, delay)
+        if self._jitter > 0:
+            delay *= 1.0 + self._rng.uniform(-self._jitter, self._jitter)
+        return max(0.0, delay)
+
+
+class PollTimer(object):
+    """
+    Tracks when a single task should next be polled and when
+    to give up on it. A task expires once **max_polls** checks
+    have been made or **max_wait** seconds have elapsed since
+    creation of this object, whichever is set.
+    """
+
+    def __init__(self, strategy, max_wait=None, max_polls=None,
+                 clock=time.monotonic):
+        """
+        Constructor
+
+        :param strategy: strategy to get wait between polls from
+        :type strategy: :py:class:`PollingStrategy`
+        :param max_wait: seconds after which task expires or None
+        :type max_wait: float
+        :param max_polls: number of polls after which task
+                          expires or None
+        :type max_polls: int
+        :param clock: function returning current time in seconds
+        """
+        self._strategy = strategy
+        self._max_polls = max_polls
+        self._clock = clock
+        self._start = clock()
+        self._deadline = None
+        if max_wait is not None:
+            self._deadline = self._start + max_wait
+        self._polls = 0
+        self._next_poll = self._start
+
+    def get_poll_count(self):
+        """
+        Gets number of polls recorded
+
+        :rtype: int
+        """
+        return self._polls
+
+    def record_poll(self, progress=None):
+        """
+        Records a status check and schedules the next one
+
+        :param progress: progress reported by service or None
+        :type progress: int
+        """
+        self._polls += 1
+        now = self._clock()
+        delay = self._strategy.get_delay(self._polls, progress=progress,
+                                         elapsed=now - self._start)
+        self._next_poll = now + delay
+        if self._deadline is not None:
+            self._next_poll = min(self._next_poll, self._deadline)
+
+    def is_expired(self):
+        """
+        Checks if task should no longer be polled
+
+        :return: True if maximum polls or wait has been reached
+        :rtype: bool
+        """
+        if self._max_polls is not None and self._polls >= self._max_polls:
+            return True
+        if self._deadline is not None and self._clock() >= self._deadline:
+            return True
+        return False
+
+    def is_due(self):
+        """
+        Checks if it is time to poll again
+
+        :rtype: bool
+        """
+        return self._clock() >= self._next_poll
+
+    def get_time_until_next_poll(self):
+        """
+        Gets seconds until task should be polled again
+
+        :rtype: float
+        """
+        return max(0.0, self._next_poll - self._clock())
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import threading
+import email.utils
+
+from requests.adapters import HTTPAdapter
+
+# status codes the service uses to ask clients to slow down
+THROTTLE_STATUS_CODES = (429, 503)
+
+RETRY_AFTER_HEADER = 'Retry-After'
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket that limits requests to **rate** per
+    second on average with bursts of up to **burst** requests.
+
+    The bucket can also be paused, via :py:meth:`pause`, when the
+    service responds with a ``Retry-After`` so every caller sharing
+    the bucket backs off and not just the one that was throttled.
+    """
+
+    def __init__(self, rate=None, burst=1, clock=time.monotonic,
+                 sleep=time.sleep):
+        """
+        Constructor
+
+        :param rate: requests per second, None means no limit
+        :type rate: float
+        :param burst: maximum number of tokens the bucket holds
+        :type burst: int
+        :param clock: function returning current time in seconds
+        :param sleep: function that sleeps for seconds passed in
+        """
+        self._rate = rate
+        self._burst = max(1, burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self._burst)
+        self._last = clock()
+        self._paused_until = None
+
+    def get_rate(self):
+        """
+        Gets requests per second allowed
+
+        :return: rate or None if there is no limit
+        :rtype: float
+        """
+        return self._rate
+
+    def pause(self, seconds):
+        """
+        Stops tokens from being handed out for **seconds**. If
+        already paused, the later of the two end times is kept
+
+        :param seconds: time to pause for
+        :type seconds: float
+        """
+        with self._lock:
+            until = self._clock() + seconds
+            if self._paused_until is None or until > self._paused_until:
+                self._paused_until = until
+
+    def reserve(self):
+        """
+        Takes a token, going into debt if none are available, and
+        returns how long the caller must wait before using it.
+        This lets callers that must not block, such as coroutines,
+        do the waiting themselves
+
+        :return: seconds to wait before making the request
+        :rtype: float
+        """
+        with self._lock:
+            now = self._clock()
+            wait = 0.0
+            if self._paused_until is not None:
+                if self._paused_until > now:
+                    wait = self._paused_until - now
+                else:
+                    self._paused_until = None
+            if self._rate is None:
+                return wait
+            self._tokens = min(float(self._burst),
+                               self._tokens +
+                               (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1.0
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self._rate)
+            return wait
+
+    def acquire(self):
+        """
+        Blocks until a request is allowed
+
+        :return: seconds waited
+        :rtype: float
+        """
+        wait = self.reserve()
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+def get_retry_after(response, clock=time.time):
+    """
+    Gets seconds to wait from the ``Retry-After`` header of
+    **response** which can be a number of seconds or a http date
+
+    :param response: response from service
+    :type response: :py:class:`requests.Response`
+    :param clock: function returning current time since epoch
+    :return: seconds to wait or None if header is missing or invalid
+    :rtype: float
+    """
+    value = response.headers.get(RETRY_AFTER_HEADER)
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        thedate = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if thedate is None:
+        return None
+    return max(0.0, thedate.timestamp() - clock())
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    :py:class:`requests.adapters.HTTPAdapter` that limits rate of
+    task submissions (POST) and status checks (GET of ``/status``)
+    with separate :py:class:`TokenBucket` objects.
+
+    When the service responds with one of
+    :py:const:`THROTTLE_STATUS_CODES` the request is retried, for
+    submissions too since the service did not accept the task, after
+    waiting the ``Retry-After`` time or, if not given, an exponential
+    backoff. The bucket for that kind of request is paused for the
+    wait so other requests sharing the session back off as well.
+    """
+
+    def __init__(self, submit_bucket=None, poll_bucket=None,
+                 throttle_retries=5, backoff_factor=0.5,
+                 max_backoff=60.0, **kwargs):
+        """
+        Constructor
+
+        :param submit_bucket: limits task submissions, None means
+                              no limit
+        :type submit_bucket: :py:class:`TokenBucket`
+        :param poll_bucket: limits status checks, None means no limit
+        :type poll_bucket: :py:class:`TokenBucket`
+        :param throttle_retries: number of times to retry a throttled
+                                 request
+        :type throttle_retries: int
+        :param backoff_factor: wait after n-th throttled response
+                               without ``Retry-After`` is this times
+                               2 ^ (n - 1) seconds
+        :type backoff_factor: float
+        :param max_backoff: maximum seconds to wait between retries
+        :type max_backoff: float
+        :param kwargs: passed to
+                       :py:class:`requests.adapters.HTTPAdapter`
+        """
+        super(RateLimitedAdapter, self).__init__(**kwargs)
+        if submit_bucket is None:
+            submit_bucket = TokenBucket()
+        if poll_bucket is None:
+            poll_bucket = TokenBucket()
+        self._submit_bucket = submit_bucket
+        self._poll_bucket = poll_bucket
+        self._throttle_retries = throttle_retries
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+
+    def _get_bucket(self, request):
+        """
+        Gets bucket that limits **request**
+
+        :return: bucket or None if request is not limited
+        :rtype: :py:class:`TokenBucket`
+        """
+        if request.method == 'POST':
+            return self._submit_bucket
+        if request.method == 'GET' and\
+                request.path_url.split('?')[0].endswith('/status'):
+            return self._poll_bucket
+        return None
+
+    def get_throttle_wait(self, response, attempt):
+        """
+        Gets seconds to wait before retrying throttled **response**
+
+        :param response: throttled response
+        :type response: :py:class:`requests.Response`
+        :param attempt: number of throttled responses so far
+        :type attempt: int
+        :rtype: float
+        """
+        wait = get_retry_after(response)
+        if wait is None:
+            wait = self._backoff_factor * (2 ** (attempt - 1))
+        return min(self._max_backoff, wait)
+
+    def send(self, request, **kwargs):
+        """
+        Sends **request** once a token is available, retrying
+        it if the service asks the client to slow down
+
+        :return: response
+        :rtype: :py:class:`requests.Response`
+        """
+        bucket = self._get_bucket(request)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            response = super(RateLimitedAdapter, self).send(request,
+                                                            **kwargs)
+            if response.status_code not in THROTTLE_STATUS_CODES or\
+                    attempt >= self._throttle_retries:
+                return response
+            attempt += 1
+            wait = self.get_throttle_wait(response, attempt)
+            sys.stderr.write('Service responded with ' +
+                             str(response.status_code) + ', retrying in ' +
+                             str(round(wait, 3)) + ' seconds\n')
+            response.close()
+            if bucket is not None:
+                bucket.pause(wait)
+            else:
+                time.sleep(wait)
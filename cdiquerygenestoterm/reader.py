@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+# formats of input files with many gene sets
+FORMAT_AUTO = 'auto'
+FORMAT_LINES = 'lines'
+FORMAT_JSONL = 'jsonl'
+FORMAT_NEWLINE = 'newline'
+FORMAT_JSON = 'json'
+FORMAT_CHOICES = [FORMAT_AUTO, FORMAT_LINES, FORMAT_JSONL,
+                  FORMAT_NEWLINE, FORMAT_JSON]
+
+ID_KEY = 'id'
+GENES_KEY = 'genes'
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_inputfile(inputfile):
+    """
+    Opens **inputfile** for reading as text, decompressing
+    it on the fly if it is gzipped
+
+    :param inputfile: path to file, gzip is detected from content
+                      and not the file name
+    :type inputfile: str
+    :return: file object, caller must close it
+    """
+    with open(inputfile, 'rb') as f:
+        magic = f.read(len(GZIP_MAGIC))
+    if magic == GZIP_MAGIC:
+        import gzip
+        return gzip.open(inputfile, 'rt')
+    return open(inputfile, 'r')
+
+
+def get_genes_from_string(genestr):
+    """
+    Splits comma delimited **genestr** into list of genes
+
+    :param genestr: comma delimited list of genes
+    :type genestr: str
+    :return: genes or None if no genes were found
+    :rtype: list
+    """
+    genes = genestr.strip(',').strip('\n').split(',')
+    if genes is None or (len(genes) == 1 and len(genes[0].strip()) == 0):
+        return None
+    return genes
+
+
+def _get_genes(genes):
+    """
+    Gets list of genes from **genes** which can be a list or
+    comma delimited string
+
+    :return: genes or None if no genes were found
+    :rtype: list
+    """
+    if isinstance(genes, str):
+        return get_genes_from_string(genes)
+    if isinstance(genes, list) and len(genes) > 0:
+        return genes
+    return None
+
+
+def detect_format(inputfile):
+    """
+    Guesses format of **inputfile** from its first non blank line.
+    A line that is a complete JSON object with ``genes`` means
+    :py:const:`FORMAT_JSONL`, any other line starting with ``{``
+    means :py:const:`FORMAT_JSON` otherwise it is
+    :py:const:`FORMAT_LINES`. :py:const:`FORMAT_NEWLINE` is never
+    guessed since it looks like :py:const:`FORMAT_LINES`
+
+    :param inputfile: path to file
+    :type inputfile: str
+    :return: format
+    :rtype: str
+    """
+    with open_inputfile(inputfile) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if not line.startswith('{'):
+                return FORMAT_LINES
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return FORMAT_JSON
+            if isinstance(record, dict) and GENES_KEY in record:
+                return FORMAT_JSONL
+            return FORMAT_JSON
+    return FORMAT_LINES
+
+
+def _iter_lines(f):
+    """
+    Yields gene sets of :py:const:`FORMAT_LINES` file **f**
+    """
+    for linenum, line in enumerate(f, start=1):
+        if len(line.strip()) == 0:
+            continue
+        if '\t' in line:
+            setid, genestr = line.split('\t', 1)
+            setid = setid.strip()
+        else:
+            setid = str(linenum)
+            genestr = line
+        yield setid, get_genes_from_string(genestr.strip())
+
+
+def _iter_jsonl(f):
+    """
+    Yields gene sets of :py:const:`FORMAT_JSONL` file **f**
+    """
+    for linenum, line in enumerate(f, start=1):
+        if len(line.strip()) == 0:
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError('Line ' + str(linenum) +
+                             ' is not a JSON object')
+        yield (str(record.get(ID_KEY, linenum)),
+               _get_genes(record.get(GENES_KEY)))
+
+
+def _iter_newline(f):
+    """
+    Yields gene sets of :py:const:`FORMAT_NEWLINE` file **f**
+    """
+    setnum = 1
+    genes = []
+    for line in f:
+        gene = line.strip()
+        if len(gene) > 0:
+            genes.append(gene)
+            continue
+        if len(genes) > 0:
+            yield str(setnum), genes
+            setnum += 1
+            genes = []
+    if len(genes) > 0:
+        yield str(setnum), genes
+
+
+def _iter_json(f):
+    """
+    Yields gene sets of :py:const:`FORMAT_JSON` file **f**
+    which, unlike the other formats, is read into memory
+    """
+    for setid, genes in json.load(f).items():
+        yield str(setid), _get_genes(genes)
+
+
+def iter_genesets(inputfile, input_format=FORMAT_AUTO):
+    """
+    Yields gene sets in **inputfile**, which can be gzipped, one
+    at a time so memory use does not grow with size of file,
+    except for :py:const:`FORMAT_JSON`. Formats are:
+
+    * :py:const:`FORMAT_LINES` one comma delimited list of genes per
+      line, optionally prefixed with an id and a tab. Otherwise the
+      line number, starting at 1, is the id. Blank lines are skipped
+    * :py:const:`FORMAT_JSONL` one JSON object per line with
+      ``genes``, a list or comma delimited string of genes, and
+      optionally ``id`` otherwise the line number is the id
+    * :py:const:`FORMAT_NEWLINE` one gene per line with gene sets
+      separated by blank lines and numbered from 1
+    * :py:const:`FORMAT_JSON` a JSON object of id => list or comma
+      delimited string of genes
+    * :py:const:`FORMAT_AUTO` one of the above, see
+      :py:func:`detect_format`
+
+    :param inputfile: path to file
+    :type inputfile: str
+    :param input_format: format of file
+    :type input_format: str
+    :raises ValueError: if **input_format** is unknown or the
+                        file is not valid
+    :return: generator of (id, list of genes or None) tuples
+    """
+    if input_format == FORMAT_AUTO:
+        input_format = detect_format(inputfile)
+    iterators = {FORMAT_LINES: _iter_lines,
+                 FORMAT_JSONL: _iter_jsonl,
+                 FORMAT_NEWLINE: _iter_newline,
+                 FORMAT_JSON: _iter_json}
+    if input_format not in iterators:
+        raise ValueError('Unknown input format: ' + str(input_format))
+    with open_inputfile(inputfile) as f:
+        for geneset in iterators[input_format](f):
+            yield geneset
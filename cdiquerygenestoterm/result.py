@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+# keys of result of a task from iQuery
+SOURCES_KEY = 'sources'
+RESULTS_KEY = 'results'
+DETAILS_KEY = 'details'
+SIMILARITY_KEY = 'similarity'
+PVALUE_KEY = 'PValue'
+
+# how results are ranked, see --rankby
+RANK_BY_SIMILARITY = 'similarity'
+RANK_BY_PVALUE = 'pvalue'
+RANK_BY_COMBINED = 'combined'
+RANK_BY_CHOICES = [RANK_BY_SIMILARITY, RANK_BY_PVALUE, RANK_BY_COMBINED]
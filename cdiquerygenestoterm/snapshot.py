@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from cdiquerygenestoterm.index import INDEX_SECTIONS
+from cdiquerygenestoterm.index import GeneIndex
+from cdiquerygenestoterm.index import StringTable
+from cdiquerygenestoterm.index import as_uint32
+from cdiquerygenestoterm.index import map_sections
+from cdiquerygenestoterm.index import to_uint32_bytes
+from cdiquerygenestoterm.index import write_sections
+from cdiquerygenestoterm.local import NAME_KEY
+from cdiquerygenestoterm.local import SOURCE_KEY
+from cdiquerygenestoterm.local import URL_KEY
+from cdiquerygenestoterm.local import NODES_KEY
+from cdiquerygenestoterm.local import LocalEnrichmentEngine
+from cdiquerygenestoterm.local import get_network_genes
+from cdiquerygenestoterm.local import read_json_snapshot
+
+SNAPSHOT_MAGIC = b'CDISNAP1'
+
+# sections of binary snapshot after those of the gene index
+_MEMBER_OFFSETS = INDEX_SECTIONS
+_MEMBERS = INDEX_SECTIONS + 1
+_NODES = INDEX_SECTIONS + 2
+_NAMES = INDEX_SECTIONS + 3
+_SOURCES = INDEX_SECTIONS + 5
+_URLS = INDEX_SECTIONS + 7
+_UNIVERSE_SIZE = INDEX_SECTIONS + 9
+SNAPSHOT_SECTIONS = INDEX_SECTIONS + 10
+
+
+class SnapshotNetworks(object):
+    """
+    Read only sequence of networks in a binary snapshot where each
+    network is a dict with ``name``, ``source``, ``url`` and ``nodes``
+    made when it is asked for so nothing is decoded when the
+    snapshot is loaded. Genes of a network are found via
+    :py:meth:`get_genes`
+    """
+
+    def __init__(self, names, sources, urls, nodes, member_offsets,
+                 members, symbols):
+        """
+        Constructor, use :py:func:`load_binary_snapshot`
+
+        :param names: name of each network
+        :type names: :py:class:`~cdiquerygenestoterm.index.StringTable`
+        :param sources: source of each network
+        :type sources: :py:class:`~cdiquerygenestoterm.index.StringTable`
+        :param urls: url of each network, empty if it had none
+        :type urls: :py:class:`~cdiquerygenestoterm.index.StringTable`
+        :param nodes: number of nodes in each network
+        :param member_offsets: start of each network in **members**
+        :param members: sorted ids of genes in each network
+        :param symbols: gene symbols
+        :type symbols: :py:class:`~cdiquerygenestoterm.index.SymbolTable`
+        """
+        self._names = names
+        self._sources = sources
+        self._urls = urls
+        self._nodes = nodes
+        self._member_offsets = member_offsets
+        self._members = members
+        self._symbols = symbols
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __getitem__(self, netid):
+        url = self._urls[netid]
+        return {NAME_KEY: self._names[netid],
+                SOURCE_KEY: self._sources[netid],
+                URL_KEY: url if len(url) > 0 else None,
+                NODES_KEY: self._nodes[netid]}
+
+    def get_genes(self, netid):
+        """
+        Gets genes of network **netid**
+
+        :return: gene symbols
+        :rtype: list
+        """
+        return [self._symbols[geneid] for geneid in
+                self._members[self._member_offsets[netid]:
+                              self._member_offsets[netid + 1]]]
+
+
+def is_binary_snapshot(snapshotfile):
+    """
+    Checks if **snapshotfile** is a binary snapshot
+
+    :param snapshotfile: path to file
+    :type snapshotfile: str
+    :rtype: bool
+    """
+    with open(snapshotfile, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def write_binary_snapshot(snapshotfile, networks, universe_size=None):
+    """
+    Writes **networks** to **snapshotfile** as a binary snapshot,
+    a file of sections, see
+    :py:func:`~cdiquerygenestoterm.index.write_sections`, with the
+    gene index, see :py:class:`~cdiquerygenestoterm.index.GeneIndex`,
+    followed by:
+
+    * offsets and sorted gene ids of each network, the genes of
+      network i are ``members[offsets[i]:offsets[i + 1]]``
+    * number of nodes in each network
+    * names, sources and urls of networks as string tables, see
+      :py:class:`~cdiquerygenestoterm.index.StringTable`
+    * number of genes p values are computed against, 0 if not set
+
+    All integers are little endian unsigned 32 bit integers so the
+    file can be memory mapped and used as is by
+    :py:func:`load_binary_snapshot`
+
+    :param snapshotfile: path to write to
+    :type snapshotfile: str
+    :param networks: networks as in a JSON snapshot, see
+                     :py:func:`~cdiquerygenestoterm.local.read_json_snapshot`
+    :type networks: list
+    :param universe_size: number of genes p values are computed
+                          against
+    :type universe_size: int
+    """
+    genesets = [get_network_genes(network) for network in networks]
+    index = GeneIndex.build(genesets)
+    symbols = index.get_symbols()
+    geneids = {symbols[i]: i for i in range(len(symbols))}
+    member_offsets = [0]
+    members = []
+    for genes in genesets:
+        members.extend(sorted([geneids[gene] for gene in genes]))
+        member_offsets.append(len(members))
+    sections = index.to_sections()
+    sections.append(to_uint32_bytes(member_offsets))
+    sections.append(to_uint32_bytes(members))
+    sections.append(to_uint32_bytes([network.get(NODES_KEY,
+                                                 len(genesets[netid]))
+                                     for netid, network in
+                                     enumerate(networks)]))
+    sections.extend(StringTable.from_strings(
+        [network[NAME_KEY] for network in networks]).to_sections())
+    sections.extend(StringTable.from_strings(
+        [network.get(SOURCE_KEY, 'NA') for network in
+         networks]).to_sections())
+    sections.extend(StringTable.from_strings(
+        [network.get(URL_KEY) or '' for network in
+         networks]).to_sections())
+    sections.append(to_uint32_bytes([universe_size or 0]))
+    write_sections(snapshotfile, SNAPSHOT_MAGIC, sections)
+
+
+def convert_snapshot(jsonfile, snapshotfile):
+    """
+    Converts JSON snapshot in **jsonfile** to binary snapshot
+    written to **snapshotfile**
+
+    :param jsonfile: path to JSON snapshot, can be gzipped
+    :type jsonfile: str
+    :param snapshotfile: path to write binary snapshot to
+    :type snapshotfile: str
+    :raises ValueError: if JSON snapshot is not valid
+    :return: number of networks written
+    :rtype: int
+    """
+    networks, universe_size = read_json_snapshot(jsonfile)
+    write_binary_snapshot(snapshotfile, networks,
+                          universe_size=universe_size)
+    return len(networks)
+
+
+def load_binary_snapshot(snapshotfile):
+    """
+    Loads :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    from binary snapshot written by :py:func:`write_binary_snapshot`.
+    The file is memory mapped read only so loading takes about the
+    same time regardless of size and every process using the same
+    snapshot shares its pages via the page cache
+
+    :param snapshotfile: path to binary snapshot
+    :type snapshotfile: str
+    :raises ValueError: if **snapshotfile** is not a valid snapshot
+    :return: engine
+    :rtype: :py:class:`~cdiquerygenestoterm.local.LocalEnrichmentEngine`
+    """
+    sections = map_sections(snapshotfile, SNAPSHOT_MAGIC)
+    if len(sections) != SNAPSHOT_SECTIONS:
+        raise ValueError('Expected ' + str(SNAPSHOT_SECTIONS) +
+                         ' sections in snapshot ' + snapshotfile +
+                         ', found ' + str(len(sections)))
+    index = GeneIndex.from_sections(sections[:INDEX_SECTIONS])
+    networks = SnapshotNetworks(
+        StringTable.from_sections(sections[_NAMES:_NAMES + 2]),
+        StringTable.from_sections(sections[_SOURCES:_SOURCES + 2]),
+        StringTable.from_sections(sections[_URLS:_URLS + 2]),
+        as_uint32(sections[_NODES]),
+        as_uint32(sections[_MEMBER_OFFSETS]),
+        as_uint32(sections[_MEMBERS]), index.get_symbols())
+    universe_size = as_uint32(sections[_UNIVERSE_SIZE])[0]
+    return LocalEnrichmentEngine(networks, index=index,
+                                 universe_size=universe_size or None)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+NAME_KEY = 'name'
+SOURCE_KEY = 'source'
+PVALUE_KEY = 'p_value'
+DESCRIPTION_KEY = 'description'
+TERM_SIZE_KEY = 'term_size'
+INTERSECTIONS_KEY = 'intersections'
+
+# set with --resolution hybrid to where the term came from
+RESOLUTION_KEY = 'resolution'
+
+ID_KEY = 'id'
+RESULT_KEY = 'result'
+
+
+class MappedTerm(object):
+    """
+    Term a gene set was mapped to. Uses ``__slots__`` so many of
+    them take a fraction of the memory of the equivalent dicts.
+    Terms are kept in this form, in memory and while a batch is
+    running, and :py:func:`to_jsonable` gives the dicts written as
+    output or to a cache or journal
+    """
+
+    __slots__ = ['name', 'source', 'p_value', 'description',
+                 'term_size', 'intersections', 'resolution']
+
+    def __init__(self, name=None, source=None, p_value=None,
+                 description=None, term_size=None, intersections=None,
+                 resolution=None):
+        """
+        Constructor
+
+        :param name: name of term, which is name of network
+        :type name: str
+        :param source: source of network
+        :type source: str
+        :param p_value: p value of enrichment
+        :type p_value: float
+        :param description: url of network in NDEx
+        :type description: str
+        :param term_size: number of nodes in network
+        :type term_size: int
+        :param intersections: genes of gene set found in network
+        :type intersections: list
+        :param resolution: where term came from, only set with
+                           ``--resolution hybrid``
+        :type resolution: str
+        """
+        self.name = name
+        self.source = source
+        self.p_value = p_value
+        self.description = description
+        self.term_size = term_size
+        self.intersections = intersections
+        self.resolution = resolution
+
+    @staticmethod
+    def from_result(result):
+        """
+        Converts a single **result** from iQuery into a term
+
+        :param result: a single result from iQuery
+        :type result: dict
+        :rtype: :py:class:`MappedTerm`
+        """
+        description = result['description']
+        colon_loc = description.find(':')
+        if colon_loc == -1:
+            source = 'NA'
+        else:
+            source = description[0:colon_loc]
+        return MappedTerm(name=description[colon_loc + 1:].lstrip(),
+                          source=source,
+                          p_value=result['details']['PValue'],
+                          description=result['url'],
+                          term_size=result['nodes'],
+                          intersections=result['hitGenes'])
+
+    @staticmethod
+    def from_dict(term):
+        """
+        Creates term from dict made by :py:meth:`to_dict`
+
+        :param term: term as dict
+        :type term: dict
+        :rtype: :py:class:`MappedTerm`
+        """
+        return MappedTerm(name=term.get(NAME_KEY),
+                          source=term.get(SOURCE_KEY),
+                          p_value=term.get(PVALUE_KEY),
+                          description=term.get(DESCRIPTION_KEY),
+                          term_size=term.get(TERM_SIZE_KEY),
+                          intersections=term.get(INTERSECTIONS_KEY),
+                          resolution=term.get(RESOLUTION_KEY))
+
+    def to_dict(self):
+        """
+        Gets term as dict with ``name``, ``source``, ``p_value``,
+        ``description``, ``term_size``, and ``intersections`` along
+        with ``resolution`` if it is set
+
+        :rtype: dict
+        """
+        term = {NAME_KEY: self.name,
+                SOURCE_KEY: self.source,
+                PVALUE_KEY: self.p_value,
+                DESCRIPTION_KEY: self.description,
+                TERM_SIZE_KEY: self.term_size,
+                INTERSECTIONS_KEY: self.intersections}
+        if self.resolution is not None:
+            term[RESOLUTION_KEY] = self.resolution
+        return term
+
+    def __eq__(self, other):
+        if not isinstance(other, MappedTerm):
+            return NotImplemented
+        return all([getattr(self, slot) == getattr(other, slot)
+                    for slot in MappedTerm.__slots__])
+
+    def __repr__(self):
+        return 'MappedTerm(' + ', '.join([slot + '=' +
+                                          repr(getattr(self, slot))
+                                          for slot in
+                                          MappedTerm.__slots__]) + ')'
+
+
+def to_jsonable(result):
+    """
+    Converts **result** into what is passed to :py:func:`json.dumps`
+    replacing every :py:class:`MappedTerm` with
+    :py:meth:`MappedTerm.to_dict`
+
+    :param result: None, a term, a list of terms or a dict, such as
+                   gene set id => term, of any of these
+    :return: **result** with terms as dicts
+    """
+    if isinstance(result, MappedTerm):
+        return result.to_dict()
+    if isinstance(result, list):
+        return [to_jsonable(r) for r in result]
+    if isinstance(result, dict):
+        return {key: to_jsonable(value) for key, value in result.items()}
+    return result
+
+
+def from_jsonable(result):
+    """
+    Converts **result** made by :py:func:`to_jsonable` for a single
+    gene set, as read from a cache or journal, back into terms
+
+    :param result: None, a term as dict or a list of them
+    :return: None, :py:class:`MappedTerm` or list of them
+    """
+    if isinstance(result, list):
+        return [from_jsonable(r) for r in result]
+    if isinstance(result, dict):
+        return MappedTerm.from_dict(result)
+    return result
+
+
+class JsonLinesWriter(object):
+    """
+    Writes result of each gene set as its own line of JSON,
+    ``{"id": <id>, "result": <term or null>}``, as soon as it is
+    given so output can be read while a batch is running and
+    nothing is kept in memory
+    """
+
+    def __init__(self, out, flush=True):
+        """
+        Constructor
+
+        :param out: file object to write to
+        :param flush: if True, **out** is flushed after every line
+        :type flush: bool
+        """
+        self._out = out
+        self._flush = flush
+        self._encoder = json.JSONEncoder(separators=(',', ':'))
+        self._count = 0
+
+    def write(self, setid, result):
+        """
+        Writes **result** of gene set **setid**
+
+        :param setid: id of gene set
+        :type setid: str
+        :param result: None, term or, with ``--topk``, list of terms
+                       where a term is a :py:class:`MappedTerm` or dict
+        """
+        self._out.write(self._encoder.encode({ID_KEY: setid,
+                                              RESULT_KEY:
+                                                  to_jsonable(result)}))
+        self._out.write('\n')
+        if self._flush is True:
+            self._out.flush()
+        self._count += 1
+
+    def get_count(self):
+        """
+        :return: number of lines written
+        :rtype: int
+        """
+        return self._count
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from cdiquerygenestoterm.result import SOURCES_KEY
+from cdiquerygenestoterm.result import RESULTS_KEY
+from cdiquerygenestoterm.result import DETAILS_KEY
+from cdiquerygenestoterm.result import SIMILARITY_KEY
+from cdiquerygenestoterm.result import PVALUE_KEY
+from cdiquerygenestoterm.result import RANK_BY_SIMILARITY
+from cdiquerygenestoterm.result import RANK_BY_PVALUE
+from cdiquerygenestoterm.result import RANK_BY_COMBINED
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+PVALUE_ADJUST_NONE = 'none'
+PVALUE_ADJUST_BH = 'bh'
+PVALUE_ADJUST_CHOICES = [PVALUE_ADJUST_NONE, PVALUE_ADJUST_BH]
+
+
+def is_available():
+    """
+    Checks if NumPy is installed. The functions in this
+    module pull the fields needed for scoring out of the
+    nested result dicts into arrays in a single pass after
+    which ranking, filtering and multiple testing adjustment
+    are array operations
+
+    :return: True if functions in this module can be used
+    :rtype: bool
+    """
+    return np is not None
+
+
+def _check_available():
+    """
+    :raises ImportError: if NumPy is not installed
+    """
+    if np is None:
+        raise ImportError('numpy is required for vectorized scoring, '
+                          'install it with: pip install numpy')
+
+
+class ResultArrays(object):
+    """
+    Fields of every result in an iQuery result as arrays with
+    one element per result in the order results appear
+    """
+
+    def __init__(self, results, similarity, pvalue, nodes, hits):
+        """
+        Constructor
+
+        :param results: the result dicts
+        :type results: list
+        :param similarity: similarity of each result
+        :param pvalue: p-value of each result
+        :param nodes: number of nodes in network of each result
+        :param hits: number of hit genes in each result
+        """
+        self.results = results
+        self.similarity = similarity
+        self.pvalue = pvalue
+        self.nodes = nodes
+        self.hits = hits
+
+    def __len__(self):
+        return len(self.results)
+
+
+def extract_result_arrays(resultasdict):
+    """
+    Extracts similarity, p-value, nodes and number of hit genes of
+    all results across all sources in **resultasdict** into arrays
+    in one pass
+
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :raises ImportError: if NumPy is not installed
+    :return: arrays
+    :rtype: :py:class:`ResultArrays`
+    """
+    _check_available()
+    results = []
+    similarity = []
+    pvalue = []
+    nodes = []
+    hits = []
+    for cursource in resultasdict[SOURCES_KEY]:
+        for curresult in cursource[RESULTS_KEY]:
+            details = curresult[DETAILS_KEY]
+            results.append(curresult)
+            similarity.append(details[SIMILARITY_KEY])
+            pvalue.append(details[PVALUE_KEY])
+            nodes.append(curresult.get('nodes', 0))
+            hits.append(len(curresult.get('hitGenes') or []))
+    return ResultArrays(results,
+                        np.asarray(similarity, dtype=np.float64),
+                        np.asarray(pvalue, dtype=np.float64),
+                        np.asarray(nodes, dtype=np.int64),
+                        np.asarray(hits, dtype=np.int64))
+
+
+def adjust_pvalues_bh(pvalues):
+    """
+    Adjusts **pvalues** for multiple testing with the
+    Benjamini-Hochberg false discovery rate procedure
+
+    :param pvalues: p-values
+    :raises ImportError: if NumPy is not installed
+    :return: adjusted p-values in same order as **pvalues**
+    """
+    _check_available()
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    count = len(pvalues)
+    if count == 0:
+        return pvalues
+    order = np.argsort(pvalues, kind='mergesort')
+    scaled = pvalues[order] * count / np.arange(1, count + 1)
+    # enforce monotonicity from largest p-value down
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    adjusted = np.empty(count, dtype=np.float64)
+    adjusted[order] = np.minimum(scaled, 1.0)
+    return adjusted
+
+
+def get_scores(similarity, pvalue, rankby=RANK_BY_SIMILARITY):
+    """
+    Vectorized equivalent of
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.get_result_score`
+
+    :param similarity: similarity of each result
+    :param pvalue: p-value of each result
+    :param rankby: how to score results
+    :type rankby: str
+    :raises ValueError: if **rankby** is not a known value
+    :return: score of each result, higher is better
+    """
+    _check_available()
+    if rankby == RANK_BY_SIMILARITY:
+        return similarity
+    if rankby == RANK_BY_PVALUE:
+        return -pvalue
+    if rankby == RANK_BY_COMBINED:
+        return similarity * -np.log10(np.maximum(pvalue,
+                                                 sys.float_info.min))
+    raise ValueError('Unknown rank by value: ' + str(rankby))
+
+
+def get_top_results(resultasdict, k=1, rankby=RANK_BY_SIMILARITY,
+                    max_pvalue=None, min_hits=None,
+                    pvalue_adjust=PVALUE_ADJUST_NONE):
+    """
+    Gets the **k** best results across all sources in
+    **resultasdict** after filtering. Ranking and tie breaking
+    match
+    :py:func:`~cdiquerygenestoterm.cdiquerygenestotermcmd.get_top_results`
+
+    If **pvalue_adjust** is :py:const:`PVALUE_ADJUST_BH`, the
+    adjusted p-values are used for **max_pvalue**, ranking and are
+    returned in place of the p-value of each result.
+
+    :param resultasdict: result from iQuery
+    :type resultasdict: dict
+    :param k: maximum number of results to return
+    :type k: int
+    :param rankby: how to rank results
+    :type rankby: str
+    :param max_pvalue: drop results with p-value above this
+    :type max_pvalue: float
+    :param min_hits: drop results with fewer hit genes than this
+    :type min_hits: int
+    :param pvalue_adjust: one of :py:const:`PVALUE_ADJUST_CHOICES`
+    :type pvalue_adjust: str
+    :raises ImportError: if NumPy is not installed
+    :return: list of (result, p-value) tuples, best first
+    :rtype: list
+    """
+    arrays = extract_result_arrays(resultasdict)
+    if k <= 0 or len(arrays) == 0:
+        return []
+    pvalue = arrays.pvalue
+    if pvalue_adjust == PVALUE_ADJUST_BH:
+        pvalue = adjust_pvalues_bh(pvalue)
+    elif pvalue_adjust != PVALUE_ADJUST_NONE:
+        raise ValueError('Unknown p-value adjustment: ' +
+                         str(pvalue_adjust))
+
+    keep = np.ones(len(arrays), dtype=bool)
+    if max_pvalue is not None:
+        keep &= pvalue <= max_pvalue
+    if min_hits is not None:
+        keep &= arrays.hits >= min_hits
+    indexes = np.flatnonzero(keep)
+    if len(indexes) == 0:
+        return []
+
+    neg_scores = -get_scores(arrays.similarity[indexes],
+                             pvalue[indexes], rankby=rankby)
+    if k < len(indexes):
+        # keep everything tied with the kth score so ties are
+        # broken by position below and not by partition order
+        kth = np.partition(neg_scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(neg_scores <= kth)
+        indexes = indexes[candidates]
+        neg_scores = neg_scores[candidates]
+
+    order = np.lexsort((indexes, neg_scores))[0:k]
+    return [(arrays.results[i], float(pvalue[i])) for i in indexes[order]]
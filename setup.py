@@ -22,6 +22,11 @@ requirements = [
     'requests'
 ]
 
+extra_requirements = {
+    'vectorized': ['numpy'],
+    'async': ['aiohttp']
+}
+
 test_requirements = [
     'requests-mock'
     # TODO: put package test requirements here
@@ -42,6 +47,7 @@ setup(
                  'cdiquerygenestoterm'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="BSD license",
     zip_safe=False,
     keywords='cdiquerygenestoterm',
@@ -57,7 +63,7 @@ setup(
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
-    scripts=['cdiquerygenestoterm/cdiquerygenestotermcmd.py'],
+    scripts=['bin/cdiquerygenestotermcmd.py'],
     test_suite='tests',
     tests_require=test_requirements
 )
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+helpers
+----------------------------------
+
+Fixtures shared by the tests of several modules.
+"""
+
+# result of an iQuery task, the best term by similarity is z
+QRES = {'sources': [{'results': [{'description': 'x: y',
+                                  'details': {'PValue': 5,
+                                              'similarity': 0.002},
+                                  'url': 'someurl',
+                                  'nodes': 4,
+                                  'hitGenes': ['hi']},
+                                 {'description': 'x: z',
+                                  'details': {'PValue': 1,
+                                              'similarity': 0.5},
+                                  'url': 'someurl',
+                                  'nodes': 4,
+                                  'hitGenes': ['hi']}]}]}
+
+# networks of a snapshot, with a name that is not ASCII, a network
+# without source or url and one without genes
+NETWORKS = [{'name': 'one', 'source': 'src', 'url': 'url1',
+             'nodes': 10, 'genes': ['a', 'B', 'c']},
+            {'name': 'twö', 'source': 'src', 'url': 'url2',
+             'genes': ['c', 'd', 'e', 'f']},
+            {'name': 'three', 'genes': ['x']},
+            {'name': 'empty', 'source': 'other', 'url': 'url4',
+             'genes': []}]
+
+
+class FakeClock(object):
+    """
+    Clock starting at **now** seconds whose sleep advances time
+    """
+
+    def __init__(self, now=0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
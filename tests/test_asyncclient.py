@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_asyncclient
+----------------------------------
+
+Tests for `cdiquerygenestoterm.asyncclient` module.
+"""
+
+import os
+import json
+import shutil
+import asyncio
+import importlib.util
+import tempfile
+import unittest
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm import asyncclient
+from cdiquerygenestoterm.canonical import GeneCanonicalizer
+from tests.helpers import QRES
+
+
+class FakeResponse(object):
+    """
+    Stands in for response of :py:class:`aiohttp.ClientSession`
+    that takes **delay** seconds and times out like aiohttp if
+    that exceeds **timeout**
+    """
+
+    def __init__(self, status, body, delay=0, timeout=None):
+        self.status = status
+        self._body = body
+        self._delay = delay
+        self._timeout = getattr(timeout, 'total', timeout)
+
+    async def __aenter__(self):
+        if self._timeout is not None and self._delay > self._timeout:
+            await asyncio.sleep(self._timeout)
+            raise asyncio.TimeoutError()
+        if self._delay > 0:
+            await asyncio.sleep(self._delay)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    async def text(self):
+        return json.dumps(self._body)
+
+
+class FakeSession(object):
+    """
+    Stands in for :py:class:`aiohttp.ClientSession` returning
+    responses from **handler** which is passed method, url and
+    keyword arguments and returns (status, body, delay)
+    """
+
+    def __init__(self, handler):
+        self._handler = handler
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        status, body, delay = self._handler(method, url, kwargs)
+        return FakeResponse(status, body, delay=delay,
+                            timeout=kwargs.get('timeout'))
+
+
+def _get_args(extra=None):
+    myargs = ['x', '--url', 'http://foo', '--polling_interval', '0.001']
+    if extra is not None:
+        myargs.extend(extra)
+    return cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def test_is_available(self):
+        if importlib.util.find_spec('aiohttp') is not None:
+            self.assertTrue(asyncclient.is_available())
+        else:
+            self.assertFalse(asyncclient.is_available())
+            self.assertRaises(ImportError, asyncclient.create_session)
+
+    def test_submit_query_async(self):
+        def handler(method, url, kwargs):
+            if kwargs['json']['geneList'] == ['bad']:
+                return 500, {}, 0
+            return 202, {'id': 't1'}, 0
+
+        session = FakeSession(handler)
+        res = asyncio.run(asyncclient.
+                          submit_query_async('http://foo', ['a'], 'agent',
+                                             session))
+        self.assertEqual('t1', res)
+        self.assertEqual(('POST', 'http://foo/integratedsearch/v1/'),
+                         session.requests[0][0:2])
+        res = asyncio.run(asyncclient.
+                          submit_query_async('http://foo', ['bad'], 'agent',
+                                             session))
+        self.assertEqual(None, res)
+
+    def test_get_completed_result_async_prune(self):
+        session = FakeSession(lambda m, u, k: (200, QRES, 0))
+        res = asyncio.run(asyncclient.
+                          get_completed_result_async('http://foo', 't1',
+                                                     'agent', session,
+                                                     prune=True))
+        self.assertEqual({'details': {'similarity': 0.002}},
+                         res['sources'][0]['results'][0])
+        self.assertEqual(QRES['sources'][0]['results'][1],
+                         res['sources'][0]['results'][1])
+
+        session = FakeSession(lambda m, u, k: (500, {}, 0))
+        res = asyncio.run(asyncclient.
+                          get_completed_result_async('http://foo', 't1',
+                                                     'agent', session))
+        self.assertEqual(None, res)
+
+    def test_wait_for_result_async(self):
+        polls = {'count': 0}
+
+        def handler(method, url, kwargs):
+            polls['count'] += 1
+            if polls['count'] < 3:
+                return 200, {'progress': 50, 'status': ''}, 0
+            return 200, {'progress': 100, 'status': 'complete'}, 0
+
+        session = FakeSession(handler)
+        res = asyncio.run(asyncclient.
+                          wait_for_result_async('http://foo', 't1', 'agent',
+                                                session,
+                                                polling_interval=0.001))
+        self.assertTrue(res)
+        self.assertEqual(3, polls['count'])
+
+        # request timing out counts as a failed check
+        session = FakeSession(lambda m, u, k: (200, {}, 1))
+        res = asyncio.run(asyncclient.
+                          wait_for_result_async('http://foo', 't1', 'agent',
+                                                session, timeout=0.001,
+                                                polling_interval=0.001,
+                                                retrycount=2))
+        self.assertFalse(res)
+        self.assertEqual(2, len(session.requests))
+
+    def test_run_iquery_batch_async(self):
+        state = {'inflight': 0, 'maxinflight': 0, 'submitted': 0}
+
+        def handler(method, url, kwargs):
+            if method == 'POST':
+                genes = kwargs['json']['geneList']
+                if genes == ['BAD']:
+                    return 500, {}, 0
+                state['submitted'] += 1
+                state['inflight'] += 1
+                state['maxinflight'] = max(state['maxinflight'],
+                                           state['inflight'])
+                return 202, {'id': genes[0]}, 0
+            if url.endswith('/status'):
+                if '/SLOW/' in url:
+                    return 200, {'progress': 10, 'status': ''}, 0
+                return 200, {'progress': 100, 'status': 'complete'}, 0
+            state['inflight'] -= 1
+            return 200, QRES, 0
+
+        session = FakeSession(handler)
+        p = _get_args(['--max_inflight', '2'])
+        genesets = [('a', ['a']), ('b', None), ('c', ['BAD']),
+                    ('d', ['SLOW']), ('e', ['e']), ('f', ['f']),
+                    ('g', [' A', 'a'])]
+        res = asyncio.run(asyncclient.
+                          run_iquery_batch_async(genesets, p,
+                                                 session=session,
+                                                 task_timeout=0.2))
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+                         list(res.keys()))
+        self.assertEqual('z', res['a']['name'])
+        self.assertEqual(None, res['b'])
+        self.assertEqual(None, res['c'])
+        self.assertEqual(None, res['d'])
+        self.assertEqual('z', res['f']['name'])
+        self.assertEqual(res['a'], res['g'])
+        self.assertEqual(4, state['submitted'])
+        self.assertEqual(2, state['maxinflight'])
+
+    def test_run_iquery_batch_async_malformed_result(self):
+        badres = {'sources': [{'results': [{'description': 'x: y',
+                                            'details': {'PValue': 5},
+                                            'url': 'someurl',
+                                            'nodes': 4,
+                                            'hitGenes': ['hi']}]}]}
+
+        def handler(method, url, kwargs):
+            if method == 'POST':
+                return 202, {'id': kwargs['json']['geneList'][0]}, 0
+            if url.endswith('/status'):
+                return 200, {'progress': 100, 'status': 'complete'}, 0
+            if url.endswith('/BAD'):
+                return 200, badres, 0
+            return 200, QRES, 0
+
+        res = asyncio.run(asyncclient.
+                          run_iquery_batch_async([('a', ['a']),
+                                                  ('b', ['BAD'])],
+                                                 _get_args(),
+                                                 session=FakeSession(
+                                                     handler)))
+        self.assertEqual('z', res['a']['name'])
+        self.assertEqual(None, res['b'])
+
+    def test_run_iquery_batch_async_applies_chained_aliases_once(self):
+        session = FakeSession(lambda m, u, k:
+                              (202, {'id': k['json']['geneList'][0]}, 0)
+                              if m == 'POST' else
+                              (200, {'progress': 100,
+                                     'status': 'complete'}, 0)
+                              if u.endswith('/status') else
+                              (200, QRES, 0))
+        canonicalizer = GeneCanonicalizer(aliases={'A': 'B', 'B': 'C'})
+        res = asyncio.run(asyncclient.
+                          run_iquery_batch_async([('1', ['a'])],
+                                                 _get_args(),
+                                                 session=session,
+                                                 canonicalizer=canonicalizer))
+        self.assertEqual('z', res['1']['name'])
+        self.assertEqual(['B'], session.requests[0][2]['json']['geneList'])
+
+    def test_run_iquery_async_cancel(self):
+        session = FakeSession(lambda m, u, k: (202, {'id': 't1'}, 0)
+                              if m == 'POST' else
+                              (200, {'progress': 10, 'status': ''}, 0))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input')
+            with open(inputfile, 'w') as f:
+                f.write('a,b')
+
+            async def _run_and_cancel():
+                task = asyncio.ensure_future(
+                    asyncclient.run_iquery_async(inputfile, _get_args(),
+                                                 session=session))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    return True
+                return False
+
+            self.assertTrue(asyncio.run(_run_and_cancel()))
+            self.assertTrue(len(session.requests) > 1)
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `cdiquerygenestoterm.cache` module.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm import cache
+from cdiquerygenestoterm.cache import ResultCache
+from tests.helpers import FakeClock
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_normalize_genes(self):
+        self.assertEqual([], cache.normalize_genes([]))
+        self.assertEqual(['A', 'B'],
+                         cache.normalize_genes(['b', ' a', 'A ', '', 'B']))
+
+    def test_get_cache_key(self):
+        key = cache.get_cache_key(['a', 'b'], ['enrichment'], 'http://foo')
+        self.assertEqual(64, len(key))
+        self.assertEqual(key, cache.get_cache_key(['B', 'a', 'a'],
+                                                  ['enrichment'],
+                                                  'http://foo/'))
+        self.assertNotEqual(key, cache.get_cache_key(['a', 'b'],
+                                                     ['enrichment'],
+                                                     'http://bar'))
+        self.assertNotEqual(key, cache.get_cache_key(['a', 'b'],
+                                                     ['pathway'],
+                                                     'http://foo'))
+        self.assertNotEqual(key, cache.get_cache_key(['a', 'c'],
+                                                     ['enrichment'],
+                                                     'http://foo'))
+
+    def test_get_put(self):
+        cachedir = os.path.join(self._temp_dir, 'cache')
+        rcache = ResultCache(cachedir)
+        self.assertTrue(os.path.isdir(cachedir))
+        self.assertEqual(None, rcache.get('abcdef'))
+        rcache.put('abcdef', {'name': 'x'})
+        self.assertEqual({'name': 'x'}, rcache.get('abcdef'))
+        rcache.put('abcdef', {'name': 'y'})
+        self.assertEqual({'name': 'y'}, rcache.get('abcdef'))
+        self.assertEqual(1, rcache.get_entry_count())
+
+        # new instance sees existing entries
+        rcache = ResultCache(cachedir)
+        self.assertEqual(1, rcache.get_entry_count())
+        self.assertEqual({'name': 'y'}, rcache.get('abcdef'))
+
+    def test_get_corrupt_entry(self):
+        rcache = ResultCache(self._temp_dir)
+        rcache.put('abcdef', {'name': 'x'})
+        with open(os.path.join(self._temp_dir, 'ab',
+                               'abcdef.json'), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(None, rcache.get('abcdef'))
+
+    def test_ttl(self):
+        clock = FakeClock(now=1000.0)
+        rcache = ResultCache(self._temp_dir, ttl=10, clock=clock)
+        rcache.put('abcdef', {'name': 'x'})
+        clock.now += 10
+        self.assertEqual({'name': 'x'}, rcache.get('abcdef'))
+        clock.now += 1
+        self.assertEqual(None, rcache.get('abcdef'))
+
+    def test_max_entries(self):
+        rcache = ResultCache(self._temp_dir, max_entries=10)
+        for i in range(11):
+            key = 'key' + str(i)
+            rcache.put(key, {'name': key})
+            path = os.path.join(self._temp_dir, 'ke', key + '.json')
+            os.utime(path, (i, i))
+        self.assertEqual(9, rcache.get_entry_count())
+        self.assertEqual(None, rcache.get('key0'))
+        self.assertEqual(None, rcache.get('key1'))
+        self.assertEqual({'name': 'key2'}, rcache.get('key2'))
+        self.assertEqual({'name': 'key10'}, rcache.get('key10'))
+
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
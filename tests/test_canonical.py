@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_canonical
+----------------------------------
+
+Tests for `cdiquerygenestoterm.canonical` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm.canonical import GeneCanonicalizer
+from cdiquerygenestoterm.canonical import get_folded_key
+from cdiquerygenestoterm.canonical import load_aliases
+from cdiquerygenestoterm.canonical import group_genesets
+
+
+class TestCanonical(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_load_aliases(self):
+        aliasfile = os.path.join(self._temp_dir, 'aliases.tsv')
+        with open(aliasfile, 'w') as f:
+            f.write('# alias\tsymbol\n\np53\tTP53\n'
+                    'hdm2,mdm2\n ERBB1 \t egfr \n')
+        self.assertEqual({'P53': 'TP53', 'HDM2': 'MDM2', 'ERBB1': 'EGFR'},
+                         load_aliases(aliasfile))
+
+        with open(aliasfile, 'w') as f:
+            f.write('p53\tTP53\nbad\n')
+        try:
+            load_aliases(aliasfile)
+            self.fail('Expected ValueError')
+        except ValueError as e:
+            self.assertTrue('line 2' in str(e))
+
+    def test_canonicalize(self):
+        canonicalizer = GeneCanonicalizer()
+        self.assertEqual(None, canonicalizer.canonicalize(None))
+        self.assertEqual(None, canonicalizer.canonicalize(['', ' ', None]))
+        # case is kept, first spelling of a gene winning
+        self.assertEqual(['a', 'b'],
+                         canonicalizer.canonicalize(['b', ' a', 'A ', '',
+                                                     'B', '\n']))
+        self.assertEqual(['Mdm2', 'tp53'],
+                         canonicalizer.canonicalize(['tp53', 'Mdm2']))
+
+        canonicalizer = GeneCanonicalizer(aliases={'P53': 'TP53'})
+        self.assertEqual(['mdm2', 'TP53'],
+                         canonicalizer.canonicalize(['p53', 'mdm2',
+                                                     'tp53']))
+
+    def test_get_folded_key(self):
+        self.assertEqual(None, get_folded_key(None))
+        self.assertEqual(('MDM2', 'TP53'), get_folded_key(['mdm2', 'Tp53']))
+
+    def test_group_genesets(self):
+        canonicalizer = GeneCanonicalizer(aliases={'P53': 'TP53'})
+        groups = group_genesets([('1', ['tp53', 'mdm2']),
+                                 ('2', None),
+                                 ('3', ['MDM2', 'p53', 'mdm2']),
+                                 ('4', ['egfr']),
+                                 ('5', ['', ' '])],
+                                canonicalizer=canonicalizer)
+        self.assertEqual([(['mdm2', 'tp53'], ['1', '3']),
+                          (None, ['2', '5']),
+                          (['egfr'], ['4'])], groups)
+        self.assertEqual([(['a'], ['x', 'y'])],
+                         group_genesets([('x', ['a']), ('y', ['A'])]))
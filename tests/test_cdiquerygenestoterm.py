@@ -8,17 +8,32 @@ test_cdiquerygenestoterm
 Tests for `cdiquerygenestoterm` module.
 """
 
+import io
 import os
+import gzip
+import re
+import json
+import random
 import sys
 import unittest
 import tempfile
+import time
 import shutil
+import subprocess
 from unittest.mock import MagicMock
 import requests
 import requests_mock
 
 import cdiquerygenestoterm
 from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm.polling import BackoffPollingStrategy
+from cdiquerygenestoterm.polling import FixedPollingStrategy
+from cdiquerygenestoterm.cache import ResultCache
+from cdiquerygenestoterm.cache import get_cache_key
+from cdiquerygenestoterm.memo import MappedTermMemo
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.journal import TaskJournal
+from cdiquerygenestoterm.ratelimit import RateLimitedAdapter
 
 
 class TestCdiquerygenestoterm(unittest.TestCase):
@@ -40,6 +55,14 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_get_genes_from_string(self):
+        self.assertEqual(None,
+                         cdiquerygenestotermcmd.get_genes_from_string(''))
+        self.assertEqual(None,
+                         cdiquerygenestotermcmd.get_genes_from_string(',\n'))
+        self.assertEqual(['a', 'b'],
+                         cdiquerygenestotermcmd.get_genes_from_string('a,b\n'))
+
     def test_parse_args(self):
         myargs = ['inputarg']
         res = cdiquerygenestotermcmd._parse_arguments('desc',
@@ -49,6 +72,55 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         self.assertEqual(1, res.polling_interval)
         self.assertEqual(180, res.retrycount)
         self.assertEqual(30, res.timeout)
+        self.assertEqual(False, res.batch)
+        self.assertEqual(5, res.max_inflight)
+        self.assertEqual(10, res.pool_size)
+        self.assertEqual(3, res.http_retries)
+        self.assertEqual(False, res.disable_keepalive)
+        self.assertEqual('fixed', res.polling_strategy)
+        self.assertEqual(None, res.max_wait)
+        self.assertEqual(10, res.max_polling_interval)
+        self.assertEqual(None, res.cachedir)
+        self.assertEqual(False, res.refresh_cache)
+        self.assertEqual(False, res.no_cache)
+        self.assertEqual(10000, res.memo_size)
+        self.assertEqual(None, res.journal)
+        self.assertEqual(None, res.metrics)
+        self.assertEqual(None, res.aliases)
+        self.assertEqual('auto', res.input_format)
+        self.assertEqual('json', res.output_format)
+        self.assertEqual(None, res.snapshot)
+        self.assertEqual(None, res.snapshot_index)
+        self.assertEqual(None, res.write_snapshot)
+        self.assertEqual('local', res.resolution)
+        self.assertEqual(0.0, res.min_local_similarity)
+        self.assertEqual(None, res.prometheus_textfile)
+        self.assertEqual(None, res.prometheus_listen)
+        self.assertEqual(5, res.throttle_retries)
+        self.assertEqual(None, res.submit_rate)
+        self.assertEqual(None, res.poll_rate)
+        self.assertEqual(None, res.topk)
+        self.assertEqual('similarity', res.rankby)
+
+    def test_get_polling_strategy_and_max_wait(self):
+        p = cdiquerygenestotermcmd._parse_arguments('desc', ['x'])
+        self.assertTrue(isinstance(cdiquerygenestotermcmd.
+                                   get_polling_strategy(p),
+                                   FixedPollingStrategy))
+        self.assertEqual(None, cdiquerygenestotermcmd.get_max_wait(p))
+        p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                    ['x',
+                                                     '--polling_strategy',
+                                                     'backoff',
+                                                     '--retrycount', '5',
+                                                     '--polling_interval',
+                                                     '2'])
+        self.assertTrue(isinstance(cdiquerygenestotermcmd.
+                                   get_polling_strategy(p),
+                                   BackoffPollingStrategy))
+        self.assertEqual(10, cdiquerygenestotermcmd.get_max_wait(p))
+        p.max_wait = 3
+        self.assertEqual(3, cdiquerygenestotermcmd.get_max_wait(p))
 
     def test_run_iquery_no_file(self):
         temp_dir = tempfile.mkdtemp()
@@ -132,6 +204,146 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         self.assertEqual('somedescription', res['description'])
         self.assertEqual(0.41, res['details']['similarity'])
 
+    def test_create_session(self):
+        session = cdiquerygenestotermcmd.create_session(pool_size=7,
+                                                        max_retries=2)
+        try:
+            adapter = session.get_adapter('https://foo')
+            self.assertEqual(7, adapter._pool_maxsize)
+            self.assertEqual(2, adapter.max_retries.total)
+            self.assertTrue(502 in adapter.max_retries.status_forcelist)
+            # 503 is retried by adapter honoring Retry-After
+            self.assertFalse(503 in adapter.max_retries.status_forcelist)
+            self.assertTrue(isinstance(adapter, RateLimitedAdapter))
+            self.assertEqual(None, adapter._submit_bucket.get_rate())
+            self.assertEqual('keep-alive', session.headers['Connection'])
+        finally:
+            session.close()
+
+        session = cdiquerygenestotermcmd.create_session(keep_alive=False)
+        try:
+            self.assertEqual('close', session.headers['Connection'])
+        finally:
+            session.close()
+
+    def test_create_session_from_args(self):
+        p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                    ['x',
+                                                     '--pool_size', '3',
+                                                     '--http_retries', '0',
+                                                     '--submit_rate', '2',
+                                                     '--poll_rate', '20',
+                                                     '--disable_keepalive'])
+        session = cdiquerygenestotermcmd.create_session_from_args(p)
+        try:
+            adapter = session.get_adapter('http://foo')
+            self.assertEqual(3, adapter._pool_maxsize)
+            self.assertEqual(0, adapter.max_retries.total)
+            self.assertEqual(2, adapter._submit_bucket.get_rate())
+            self.assertEqual(20, adapter._poll_bucket.get_rate())
+            self.assertEqual('close', session.headers['Connection'])
+        finally:
+            session.close()
+
+    def test_get_result_score(self):
+        result = {'details': {'PValue': 0.01, 'similarity': 0.5}}
+        self.assertEqual(0.5, cdiquerygenestotermcmd.get_result_score(result))
+        self.assertEqual(-0.01, cdiquerygenestotermcmd.
+                         get_result_score(result, rankby='pvalue'))
+        self.assertAlmostEqual(1.0, cdiquerygenestotermcmd.
+                               get_result_score(result, rankby='combined'))
+        result = {'details': {'PValue': 0, 'similarity': 0.5}}
+        self.assertTrue(cdiquerygenestotermcmd.
+                        get_result_score(result, rankby='combined') > 100)
+        try:
+            cdiquerygenestotermcmd.get_result_score(result, rankby='foo')
+            self.fail('Expected ValueError')
+        except ValueError:
+            pass
+
+    def test_get_top_results(self):
+        qres = {'sources': [{'results': [{'description': 'a',
+                                          'details': {'PValue': 0.5,
+                                                      'similarity': 0.1}},
+                                         {'description': 'b',
+                                          'details': {'PValue': 0.001,
+                                                      'similarity': 0.4}},
+                                         {'description': 'c',
+                                          'details': {'PValue': 0.01,
+                                                      'similarity': 0.4}}]},
+                            {'results': [{'description': 'd',
+                                          'details': {'PValue': 0.0001,
+                                                      'similarity': 0.3}},
+                                         {'description': 'e',
+                                          'details': {'PValue': 0.001,
+                                                      'similarity': 0.05}}]}]}
+
+        def get_descs(k, rankby):
+            return [r['description'] for r in cdiquerygenestotermcmd.
+                    get_top_results(qres, k=k, rankby=rankby)]
+
+        self.assertEqual([], get_descs(0, 'similarity'))
+        self.assertEqual(['b'], get_descs(1, 'similarity'))
+        self.assertEqual(['b', 'c', 'd'], get_descs(3, 'similarity'))
+        self.assertEqual(['b', 'c', 'd', 'a', 'e'],
+                         get_descs(10, 'similarity'))
+        self.assertEqual(['d', 'b', 'e', 'c'], get_descs(4, 'pvalue'))
+        # b and d tie at 1.2 so b, listed first, wins
+        self.assertEqual(['b', 'd'], get_descs(2, 'combined'))
+        self.assertEqual(cdiquerygenestotermcmd.
+                         get_best_result_by_similarity(qres),
+                         cdiquerygenestotermcmd.get_top_results(qres)[0])
+
+    def test_get_output_for_result(self):
+        qres = {'sources': [{'results': [{'description': 'x: a',
+                                          'details': {'PValue': 0.5,
+                                                      'similarity': 0.3},
+                                          'url': 'u1',
+                                          'nodes': 1,
+                                          'hitGenes': ['1']},
+                                         {'description': 'x: b',
+                                          'details': {'PValue': 0.001,
+                                                      'similarity': 0.2},
+                                          'url': 'u2',
+                                          'nodes': 2,
+                                          'hitGenes': ['2']}]}]}
+        p = cdiquerygenestotermcmd._parse_arguments('desc', ['x'])
+        self.assertTrue(cdiquerygenestotermcmd.is_prunable(p))
+        self.assertEqual(1, cdiquerygenestotermcmd.
+                         get_local_candidate_count(p))
+        self.assertEqual('a', cdiquerygenestotermcmd.
+                         get_output_for_result(qres, p)['name'])
+        p.topk = 3
+        self.assertEqual(3, cdiquerygenestotermcmd.
+                         get_local_candidate_count(p))
+        p.topk = None
+        p.rankby = 'pvalue'
+        self.assertFalse(cdiquerygenestotermcmd.is_prunable(p))
+        self.assertEqual(None, cdiquerygenestotermcmd.
+                         get_local_candidate_count(p))
+        res = cdiquerygenestotermcmd.get_output_for_result(qres, p)
+        self.assertEqual('b', res['name'])
+        self.assertEqual('x', res['source'])
+        self.assertEqual(0.001, res['p_value'])
+        self.assertEqual('u2', res['description'])
+        self.assertEqual(2, res['term_size'])
+        self.assertEqual(['2'], res['intersections'])
+        p.topk = 5
+        self.assertEqual(['b', 'a'],
+                         [r['name'] for r in cdiquerygenestotermcmd.
+                          get_output_for_result(qres, p)])
+        self.assertEqual(None, cdiquerygenestotermcmd.
+                         get_output_for_result({'sources': []}, p))
+
+    def test_get_cache_key_for_genes(self):
+        p = cdiquerygenestotermcmd._parse_arguments('desc', ['x'])
+        key = cdiquerygenestotermcmd.get_cache_key_for_genes(['a'], p)
+        self.assertEqual(get_cache_key(['a'], ['enrichment'],
+                                       'http://public.ndexbio.org'), key)
+        p.topk = 3
+        self.assertNotEqual(key, cdiquerygenestotermcmd.
+                            get_cache_key_for_genes(['a'], p))
+
     def test_get_completed_result_error(self):
         with requests_mock.Mocker() as m:
             m.get('http://foo/integratedsearch/'
@@ -156,6 +368,69 @@ class TestCdiquerygenestoterm(unittest.TestCase):
 
         self.assertEqual({'hi': 'there'}, res)
 
+    def test_get_completed_result_prune(self):
+        qres = {'sources': [{'results': [{'description': 'a: first',
+                                          'details': {'PValue': 1,
+                                                      'similarity': 0.1},
+                                          'url': 'url1',
+                                          'nodes': 4,
+                                          'hitGenes': ['1']},
+                                         {'description': 'b: second',
+                                          'details': {'PValue': 2,
+                                                      'similarity': 0.5},
+                                          'url': 'url2',
+                                          'nodes': 5,
+                                          'hitGenes': ['1', '2']},
+                                         {'description': 'c: third',
+                                          'details': {'PValue': 3,
+                                                      'similarity': 0.5},
+                                          'url': 'url3',
+                                          'nodes': 6,
+                                          'hitGenes': ['1', '2', '3']}]},
+                            {'results': []}]}
+        with requests_mock.Mocker() as m:
+            m.get('http://foo/integratedsearch/v1/t', json=qres)
+            res = cdiquerygenestotermcmd.\
+                get_completed_result('http://foo', 't', 'hi', prune=True)
+        self.assertEqual({'details': {'similarity': 0.1}},
+                         res['sources'][0]['results'][0])
+        self.assertEqual(qres['sources'][0]['results'][1],
+                         res['sources'][0]['results'][1])
+        self.assertEqual({'details': {'similarity': 0.5}},
+                         res['sources'][0]['results'][2])
+        self.assertEqual([], res['sources'][1]['results'])
+        self.assertEqual(cdiquerygenestotermcmd.
+                         get_result_in_mapped_term_json(qres),
+                         cdiquerygenestotermcmd.
+                         get_result_in_mapped_term_json(res))
+
+    def test_best_result_object_hook_matches_full_parse(self):
+        rng = random.Random(5)
+        for trial in range(50):
+            sources = []
+            for sindex in range(rng.randint(1, 3)):
+                results = []
+                for rindex in range(rng.randint(0, 20)):
+                    pvalue = rng.random()
+                    similarity = rng.choice([0.0, 0.1, 0.2, 0.3,
+                                             rng.random()])
+                    results.append({'description': 's' + str(sindex) +
+                                                   ': r' + str(rindex),
+                                    'details': {'PValue': pvalue,
+                                                'similarity': similarity},
+                                    'url': 'url' + str(rindex),
+                                    'nodes': rindex,
+                                    'hitGenes': ['g'] * rindex})
+                sources.append({'sourceName': 'enrichment',
+                                'results': results})
+            doc = json.dumps({'sources': sources})
+            hook = cdiquerygenestotermcmd.create_best_result_object_hook()
+            self.assertEqual(cdiquerygenestotermcmd.
+                             get_result_in_mapped_term_json(json.loads(doc)),
+                             cdiquerygenestotermcmd.
+                             get_result_in_mapped_term_json(
+                                 json.loads(doc, object_hook=hook)))
+
     def test_wait_for_result_done_immediately(self):
         with requests_mock.Mocker() as m:
             m.get('http://foo/integratedsearch/v1/t/status',
@@ -166,6 +441,23 @@ class TestCdiquerygenestoterm(unittest.TestCase):
                                 't', user_agent='hi')
             self.assertEqual(True, res)
 
+    def test_wait_for_result_backoff_max_wait(self):
+        with requests_mock.Mocker() as m:
+            m.get('http://foo/integratedsearch/v1/t/status',
+                  json={'progress': 10, 'status': ''})
+            strategy = BackoffPollingStrategy(initial_delay=0.01,
+                                              max_delay=0.02)
+            start = time.monotonic()
+            res = cdiquerygenestotermcmd. \
+                wait_for_result('http://foo',
+                                't', user_agent='hi',
+                                retrycount=1,
+                                polling_strategy=strategy,
+                                max_wait=0.1)
+            self.assertEqual(False, res)
+            self.assertTrue(time.monotonic() - start >= 0.1)
+            self.assertTrue(m.call_count > 2)
+
     def test_wait_for_result_error(self):
         with requests_mock.Mocker() as m:
             m.get('http://foo/integratedsearch/v1/t/status',
@@ -261,11 +553,12 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         self.assertEqual(None, res)
 
     def test_get_result_in_mapped_term_json_with_colon_success(self):
-        result = {'sources': [{'results': [{'description': 'hi: somedescription',
-                                            'details': {'PValue': 5, 'similarity': 0.1},
-                                            'url': 'someurl',
-                                            'nodes': 3,
-                                            'hitGenes': ['1', '2']}]}]}
+        result = {'sources': [{'results': [{
+            'description': 'hi: somedescription',
+            'details': {'PValue': 5, 'similarity': 0.1},
+            'url': 'someurl',
+            'nodes': 3,
+            'hitGenes': ['1', '2']}]}]}
         res = cdiquerygenestotermcmd.get_result_in_mapped_term_json(result)
         self.assertEqual('somedescription', res['name'])
         self.assertEqual('hi', res['source'])
@@ -295,14 +588,15 @@ class TestCdiquerygenestoterm(unittest.TestCase):
             inputfile = os.path.join(temp_dir, 'input.txt')
             with open(inputfile, 'w') as f:
                 f.write('hi,there\n')
-            user_agent = 'cdiquerygenestoterm/' + cdiquerygenestoterm.__version__
+            user_agent = ('cdiquerygenestoterm/' +
+                          cdiquerygenestoterm.__version__)
             with requests_mock.Mocker() as m:
-                qres = {'sources': [{'results': [{'description': 'somedescription',
-                                                  'details': {'PValue': 5,
-                                                              'similarity': 0.002},
-                                                  'url': 'someurl',
-                                                  'nodes': 4,
-                                                  'hitGenes': ['1', '2']}]}]}
+                qres = {'sources': [{'results': [{
+                    'description': 'somedescription',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['1', '2']}]}]}
                 m.get('http://foo/integratedsearch/v1/t',
                       json=qres, complete_qs=True)
                 m.get('http://foo/integratedsearch/v1/t/status',
@@ -318,6 +612,12 @@ class TestCdiquerygenestoterm(unittest.TestCase):
                                                             myargs)
                 res = cdiquerygenestotermcmd.run_iquery(inputfile, p)
                 self.assertEqual('somedescription', res['name'])
+                session = MagicMock(wraps=requests.Session())
+                res = cdiquerygenestotermcmd.run_iquery(inputfile, p,
+                                                        session=session)
+                self.assertEqual('somedescription', res['name'])
+                self.assertEqual(1, session.post.call_count)
+                self.assertEqual(2, session.get.call_count)
                 self.assertEqual('NA', res['source'])
                 self.assertEqual(5, res['p_value'])
                 self.assertEqual('someurl', res['description'])
@@ -327,13 +627,82 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_create_cache_from_args(self):
+        p = cdiquerygenestotermcmd._parse_arguments('desc', ['x'])
+        self.assertEqual(None,
+                         cdiquerygenestotermcmd.create_cache_from_args(p))
+        temp_dir = tempfile.mkdtemp()
+        try:
+            p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                        ['x', '--cachedir',
+                                                         temp_dir])
+            self.assertTrue(isinstance(cdiquerygenestotermcmd.
+                                       create_cache_from_args(p),
+                                       ResultCache))
+            p.no_cache = True
+            self.assertEqual(None,
+                             cdiquerygenestotermcmd.create_cache_from_args(p))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_iquery_with_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('hi,there\n')
+            cache = ResultCache(os.path.join(temp_dir, 'cache'))
+            with requests_mock.Mocker() as m:
+                qres = {'sources': [{'results': [{
+                    'description': 'somedescription',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['1', '2']}]}]}
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100,
+                            'status': 'complete'})
+                m.post('http://foo/integratedsearch/v1/',
+                       status_code=202, json={'id': 't'})
+                myargs = [inputfile, '--url', 'http://foo']
+                p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                            myargs)
+                res = cdiquerygenestotermcmd.run_iquery(inputfile, p,
+                                                        cache=cache)
+                self.assertEqual('somedescription', res['name'])
+                self.assertEqual(3, m.call_count)
+
+                # same genes, different order and case is a cache hit
+                res = cdiquerygenestotermcmd.\
+                    run_iquery_for_genes(['THERE', 'hi'], p, cache=cache)
+                self.assertEqual('somedescription', res['name'])
+                self.assertEqual(3, m.call_count)
+
+                # batch mode also uses cache
+                res = list(cdiquerygenestotermcmd.
+                           iter_iquery_results([('a', ['hi', 'there'])], p,
+                                               cache=cache))
+                self.assertEqual('somedescription', res[0][1].name)
+                self.assertEqual(3, m.call_count)
+
+                # refresh skips the cache
+                p.refresh_cache = True
+                res = cdiquerygenestotermcmd.run_iquery(inputfile, p,
+                                                        cache=cache)
+                self.assertEqual('somedescription', res['name'])
+                self.assertEqual(6, m.call_count)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_request_failed(self):
         temp_dir = tempfile.mkdtemp()
         try:
             inputfile = os.path.join(temp_dir, 'input.txt')
             with open(inputfile, 'w') as f:
                 f.write('hi,there\n')
-            user_agent = 'cdiquerygenestoterm/' + cdiquerygenestoterm.__version__
+            user_agent = ('cdiquerygenestoterm/' +
+                          cdiquerygenestoterm.__version__)
             with requests_mock.Mocker() as m:
                 m.post('http://foo/integratedsearch/v1/',
                        request_headers={'Content-Type': 'application/json',
@@ -353,7 +722,8 @@ class TestCdiquerygenestoterm(unittest.TestCase):
             inputfile = os.path.join(temp_dir, 'input.txt')
             with open(inputfile, 'w') as f:
                 f.write('hi,there\n')
-            user_agent = 'cdiquerygenestoterm/' + cdiquerygenestoterm.__version__
+            user_agent = ('cdiquerygenestoterm/' +
+                          cdiquerygenestoterm.__version__)
             with requests_mock.Mocker() as m:
                 m.register_uri('GET', 'http://foo/'
                                       'integratedsearch/v1/t/status',
@@ -376,6 +746,949 @@ class TestCdiquerygenestoterm(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_run_iquery_batch(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('a\thi,there\nb\t,\nc\tbad\n')
+            with requests_mock.Mocker() as m:
+                qres = {'sources': [{'results': [{
+                    'description': 'x: y',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['hi']}]}]}
+                m.get('http://foo/integratedsearch/v1/t',
+                      json=qres)
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100,
+                            'status': 'complete'})
+
+                def post_cb(request, context):
+                    if request.json()['geneList'] == ['bad']:
+                        context.status_code = 500
+                        return {}
+                    context.status_code = 202
+                    return {'id': 't'}
+
+                m.post('http://foo/integratedsearch/v1/', json=post_cb)
+                myargs = [inputfile, '--url', 'http://foo', '--batch']
+                p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                            myargs)
+                res = cdiquerygenestotermcmd.run_iquery_batch(inputfile, p)
+                self.assertEqual(['a', 'b', 'c'], list(res.keys()))
+                self.assertEqual('y', res['a']['name'])
+                self.assertEqual('x', res['a']['source'])
+                self.assertEqual(None, res['b'])
+                self.assertEqual(None, res['c'])
+                self.assertEqual(1, len([r for r in m.request_history
+                                         if r.method == 'POST' and
+                                         r.json()['geneList'] ==
+                                         ['hi', 'there']]))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_iter_iquery_results_bounded_window(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+        state = {'submitted': 0, 'fetched': 0, 'maxinflight': 0,
+                 'polls': {}}
+
+        def post_cb(request, context):
+            state['submitted'] += 1
+            inflight = state['submitted'] - state['fetched']
+            state['maxinflight'] = max(state['maxinflight'], inflight)
+            context.status_code = 202
+            return {'id': 't' + str(state['submitted'])}
+
+        def status_cb(request, context):
+            taskid = request.path.split('/')[-2]
+            polls = state['polls'].get(taskid, 0) + 1
+            state['polls'][taskid] = polls
+            if taskid == 't2' and polls < 3:
+                return {'progress': 50, 'status': ''}
+            if taskid == 't4':
+                return {'progress': 100, 'status': 'failed'}
+            return {'progress': 100, 'status': 'complete'}
+
+        def result_cb(request, context):
+            state['fetched'] += 1
+            return qres
+
+        with requests_mock.Mocker() as m:
+            m.post('http://foo/integratedsearch/v1/', json=post_cb)
+            m.get(requests_mock.ANY, json=result_cb)
+            m.get(re.compile('.*/status$'), json=status_cb)
+            myargs = ['x', '--url', 'http://foo', '--batch',
+                      '--max_inflight', '2',
+                      '--polling_interval', '0.001']
+            p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+            genesets = [('a', ['a']), ('b', ['b']), ('c', None),
+                        ('d', ['d']), ('e', ['e'])]
+            res = list(cdiquerygenestotermcmd.
+                       iter_iquery_results(genesets, p))
+        self.assertEqual(2, state['maxinflight'])
+        self.assertEqual(4, state['submitted'])
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'],
+                         sorted([setid for setid, _ in res]))
+        resdict = dict(res)
+        self.assertEqual('y', resdict['a'].name)
+        self.assertEqual('y', resdict['b'].name)
+        self.assertEqual(None, resdict['c'])
+        self.assertEqual(None, resdict['e'])
+
+    def test_iter_iquery_results_duplicates_share_task(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+        memo = MappedTermMemo()
+        with requests_mock.Mocker() as m:
+            m.post('http://foo/integratedsearch/v1/', status_code=202,
+                   json={'id': 't'})
+            m.get('http://foo/integratedsearch/v1/t/status',
+                  json={'progress': 100, 'status': 'complete'})
+            m.get('http://foo/integratedsearch/v1/t', json=qres)
+            myargs = ['x', '--url', 'http://foo', '--max_inflight', '2',
+                      '--polling_interval', '0.001']
+            p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+            genesets = [('a', ['a', 'b']), ('b', ['B', 'a']),
+                        ('c', ['a', 'b'])]
+            res = list(cdiquerygenestotermcmd.
+                       iter_iquery_results(genesets, p, memo=memo))
+            self.assertEqual(1, len([r for r in m.request_history
+                                     if r.method == 'POST']))
+            self.assertEqual(['a', 'b', 'c'], [r[0] for r in res])
+            for r in res:
+                self.assertEqual('y', r[1].name)
+
+            # later run resolves from memo
+            res = list(cdiquerygenestotermcmd.
+                       iter_iquery_results([('d', ['b', 'a'])], p,
+                                           memo=memo))
+            self.assertEqual('y', res[0][1].name)
+            self.assertEqual(1, len([r for r in m.request_history
+                                     if r.method == 'POST']))
+
+            res = cdiquerygenestotermcmd.run_iquery_for_genes(['a', 'b'], p,
+                                                              memo=memo)
+            self.assertEqual('y', res['name'])
+            self.assertEqual(1, len([r for r in m.request_history
+                                     if r.method == 'POST']))
+            self.assertEqual(2, memo.get_stats()['hits'])
+            self.assertEqual(1, memo.get_stats()['misses'])
+
+            # duplicates waiting on task of a are finished with it
+            memo = MappedTermMemo()
+            metrics = RunMetrics()
+            res = list(cdiquerygenestotermcmd.
+                       iter_iquery_results(genesets, p, memo=memo,
+                                           metrics=metrics))
+            self.assertEqual(['a', 'b', 'c'], [r[0] for r in res])
+            tasks = metrics.get_tasks()
+            self.assertEqual(3, len(tasks))
+            for task in tasks:
+                self.assertTrue(task.found)
+                self.assertEqual(1, task.get_spans()['total'].count)
+
+    def test_iter_iquery_results_retry_exceeded(self):
+        with requests_mock.Mocker() as m:
+            m.post('http://foo/integratedsearch/v1/', status_code=202,
+                   json={'id': 't'})
+            m.get('http://foo/integratedsearch/v1/t/status',
+                  json={'progress': 50, 'status': ''})
+            myargs = ['x', '--url', 'http://foo', '--retrycount', '3',
+                      '--polling_interval', '0.001']
+            p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+            res = list(cdiquerygenestotermcmd.
+                       iter_iquery_results([('a', ['a'])], p))
+            self.assertEqual([('a', None)], res)
+            self.assertEqual(3, len([r for r in m.request_history
+                                     if r.path.endswith('/status')]))
+
+    def test_iter_iquery_results_isolates_failing_steps(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+
+        class FailingEngine(object):
+            def query(self, genes, k=None):
+                if genes == ['BAD']:
+                    raise ValueError('broken index')
+                return qres
+
+        class FailingCache(object):
+            def get(self, key):
+                return None
+
+            def put(self, key, value):
+                raise IOError('disk full')
+
+        myargs = ['x', '--url', 'http://foo', '--retrycount', '2',
+                  '--polling_interval', '0.001']
+        p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+        res = list(cdiquerygenestotermcmd.
+                   iter_iquery_results([('a', ['BAD']), ('b', ['b'])], p,
+                                       engine=FailingEngine()))
+        self.assertEqual([('a', None)], res[:1])
+        self.assertEqual('y', res[1][1].name)
+
+        def status_cb(request, context):
+            if request.path.startswith('/integratedsearch/v1/tb/'):
+                return {'status': 'complete'}
+            return {'progress': 100, 'status': 'complete'}
+
+        with requests_mock.Mocker() as m:
+            m.post('http://foo/integratedsearch/v1/', status_code=202,
+                   json=lambda request, context:
+                   {'id': 't' + request.json()['geneList'][0].lower()})
+            m.get(re.compile('.*/status$'), json=status_cb)
+            m.get('http://foo/integratedsearch/v1/ta', json=qres)
+            m.get('http://foo/integratedsearch/v1/tc', json=qres)
+            res = dict(cdiquerygenestotermcmd.
+                       iter_iquery_results([('a', ['a']), ('b', ['b'])],
+                                           p, cache=FailingCache()))
+            self.assertEqual({'a': None, 'b': None}, res)
+            res = dict(cdiquerygenestotermcmd.
+                       iter_iquery_results([('b', ['b']), ('c', ['c'])],
+                                           p))
+            self.assertEqual(None, res['b'])
+            self.assertEqual('y', res['c'].name)
+
+    def test_iter_iquery_results_resume_from_journal(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+        temp_dir = tempfile.mkdtemp()
+        try:
+            jfile = os.path.join(temp_dir, 'journal.jsonl')
+            myargs = ['x', '--url', 'http://foo', '--batch',
+                      '--polling_interval', '0.001']
+            p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+            keya = cdiquerygenestotermcmd.get_cache_key_for_genes(['a'], p)
+            keyb = cdiquerygenestotermcmd.get_cache_key_for_genes(['b'], p)
+            keyc = cdiquerygenestotermcmd.get_cache_key_for_genes(['c'], p)
+
+            # simulate run that died with a done and a
+            # submitted task and one that failed
+            with TaskJournal(jfile) as journal:
+                journal.record_submitted(keya, 'ta')
+                journal.record_done(keya, 'ta', {'name': 'fromjournal'})
+                journal.record_submitted(keyb, 'tb')
+                journal.record_submitted(keyc, 'tc')
+                journal.record_failed(keyc, 'tc')
+
+            with requests_mock.Mocker() as m:
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 'tnew'})
+                m.get(re.compile('.*/status$'),
+                      json={'progress': 100, 'status': 'complete'})
+                m.get('http://foo/integratedsearch/v1/tb', json=qres)
+                m.get('http://foo/integratedsearch/v1/tnew', json=qres)
+                genesets = [('a', ['a']), ('b', ['b']), ('c', ['c'])]
+                metrics = RunMetrics()
+                with TaskJournal(jfile) as journal:
+                    res = dict(cdiquerygenestotermcmd.
+                               iter_iquery_results(genesets, p,
+                                                   journal=journal,
+                                                   metrics=metrics))
+                posts = [r for r in m.request_history
+                         if r.method == 'POST']
+                self.assertEqual(1, len(posts))
+                self.assertEqual(['c'], posts[0].json()['geneList'])
+                self.assertFalse(any([r.path.endswith('/ta/status')
+                                      for r in m.request_history]))
+
+            self.assertEqual('fromjournal', res['a'].name)
+            self.assertEqual('y', res['b'].name)
+            self.assertEqual('y', res['c'].name)
+            tasks = dict([(task.name, task)
+                          for task in metrics.get_tasks()])
+            self.assertEqual((False, False), (tasks['a'].submitted,
+                                              tasks['a'].resumed))
+            self.assertEqual(('tb', True, True), (tasks['b'].taskid,
+                                                  tasks['b'].submitted,
+                                                  tasks['b'].resumed))
+            self.assertEqual(('tnew', True, False), (tasks['c'].taskid,
+                                                     tasks['c'].submitted,
+                                                     tasks['c'].resumed))
+            with TaskJournal(jfile) as journal:
+                for key in [keya, keyb, keyc]:
+                    self.assertEqual(TaskJournal.STATE_DONE,
+                                     journal.get(key)[TaskJournal.STATE])
+                self.assertEqual('tnew',
+                                 journal.get(keyc)[TaskJournal.TASKID])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_iter_iquery_results_resubmits_task_unknown_to_service(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+        temp_dir = tempfile.mkdtemp()
+        try:
+            jfile = os.path.join(temp_dir, 'journal.jsonl')
+            myargs = ['x', '--url', 'http://foo', '--batch',
+                      '--polling_interval', '0.001']
+            p = cdiquerygenestotermcmd._parse_arguments('desc', myargs)
+            keyb = cdiquerygenestotermcmd.get_cache_key_for_genes(['B'], p)
+            with TaskJournal(jfile) as journal:
+                journal.record_submitted(keyb, 'tb')
+
+            with requests_mock.Mocker() as m:
+                m.get('http://foo/integratedsearch/v1/tb/status',
+                      status_code=404)
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 'tnew'})
+                m.get('http://foo/integratedsearch/v1/tnew/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.get('http://foo/integratedsearch/v1/tnew', json=qres)
+                with TaskJournal(jfile) as journal:
+                    res = dict(cdiquerygenestotermcmd.
+                               iter_iquery_results([('b', ['b'])], p,
+                                                   journal=journal))
+                self.assertEqual(1, len([r for r in m.request_history
+                                         if r.path.endswith('/tb/status')]))
+                self.assertEqual(1, len([r for r in m.request_history
+                                         if r.method == 'POST']))
+
+            self.assertEqual('y', res['b'].name)
+            with TaskJournal(jfile) as journal:
+                self.assertEqual(TaskJournal.STATE_DONE,
+                                 journal.get(keyb)[TaskJournal.STATE])
+                self.assertEqual('tnew',
+                                 journal.get(keyb)[TaskJournal.TASKID])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_iter_iquery_results_journal_before_engine(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshotfile = os.path.join(temp_dir, 'snapshot.json')
+            with open(snapshotfile, 'w') as f:
+                json.dump({'networks': [{'name': 'one', 'source': 'src',
+                                         'url': 'url1',
+                                         'genes': ['a', 'b']}]}, f)
+            jfile = os.path.join(temp_dir, 'journal.jsonl')
+            p = cdiquerygenestotermcmd.\
+                _parse_arguments('desc', ['x', '--url', 'http://foo',
+                                          '--batch', '--snapshot',
+                                          snapshotfile, '--resolution',
+                                          'hybrid'])
+            engine = cdiquerygenestotermcmd.create_engine_from_args(p)
+            keya = cdiquerygenestotermcmd.get_cache_key_for_genes(['A'], p)
+            with TaskJournal(jfile) as journal:
+                journal.record_submitted(keya, 'ta')
+                journal.record_done(keya, 'ta', {'name': 'fromjournal'})
+
+            metrics = RunMetrics()
+            with requests_mock.Mocker() as m:
+                with TaskJournal(jfile) as journal:
+                    res = dict(cdiquerygenestotermcmd.
+                               iter_iquery_results([('a', ['a']),
+                                                    ('b', ['b'])], p,
+                                                   journal=journal,
+                                                   engine=engine,
+                                                   metrics=metrics))
+                self.assertEqual(0, len(m.request_history))
+            self.assertEqual(('fromjournal', 'journal'),
+                             (res['a'].name, res['a'].resolution))
+            self.assertEqual(('one', 'local'),
+                             (res['b'].name, res['b'].resolution))
+            counters = metrics.get_aggregate()['counters']
+            self.assertEqual(1, counters['journal_hits'])
+            self.assertEqual(1, counters['local_answers'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_import_and_cache_hit_do_not_import_requests(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input')
+            with open(inputfile, 'w') as f:
+                f.write('a,b')
+            cachedir = os.path.join(temp_dir, 'cache')
+            p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                        [inputfile,
+                                                         '--cachedir',
+                                                         cachedir])
+            cache = cdiquerygenestotermcmd.create_cache_from_args(p)
+            cached = {'name': 'cached', 'source': 'src', 'p_value': 0.1,
+                      'description': 'url', 'term_size': 2,
+                      'intersections': ['A', 'B']}
+            cache.put(cdiquerygenestotermcmd.
+                      get_cache_key_for_genes(['a', 'b'], p), cached)
+            code = ('import sys\n'
+                    'from cdiquerygenestoterm import '
+                    'cdiquerygenestotermcmd\n'
+                    'print(\'requests\' in sys.modules)\n'
+                    'cdiquerygenestotermcmd.main([\'prog\', ' +
+                    repr(inputfile) + ', \'--cachedir\', ' +
+                    repr(cachedir) + '])\n'
+                    'print()\n'
+                    'print(\'requests\' in sys.modules)\n')
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+                os.path.abspath(cdiquerygenestoterm.__file__)))
+            res = subprocess.run([sys.executable, '-c', code], env=env,
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True, check=True)
+            self.assertEqual(['False', json.dumps(cached), 'False'],
+                             res.stdout.splitlines())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_lazy_session(self):
+        calls = []
+        session = MagicMock()
+
+        def factory():
+            calls.append(1)
+            return session
+
+        lazy = cdiquerygenestotermcmd.LazySession(factory)
+        self.assertFalse(lazy.is_created())
+        lazy.close()
+        self.assertEqual([], calls)
+        lazy.get('http://foo')
+        lazy.post('http://foo')
+        self.assertTrue(lazy.is_created())
+        self.assertEqual([1], calls)
+        session.get.assert_called_with('http://foo')
+        lazy.close()
+        session.close.assert_called_with()
+
+    def test_main_with_metrics(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('hi,there\n')
+            metricsfile = os.path.join(temp_dir, 'metrics.json')
+            polls = {'count': 0}
+
+            def status_cb(request, context):
+                polls['count'] += 1
+                if polls['count'] < 3:
+                    return {'progress': 50, 'status': ''}
+                return {'progress': 100, 'status': 'complete'}
+
+            with requests_mock.Mocker() as m:
+                qres = {'sources': [{'results': [{
+                    'description': 'x: y',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['1', '2']}]}]}
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json=status_cb)
+                m.post('http://foo/integratedsearch/v1/',
+                       status_code=202, json={'id': 't'})
+                res = cdiquerygenestotermcmd.main(['prog', inputfile,
+                                                   '--url', 'http://foo',
+                                                   '--polling_interval',
+                                                   '0.001', '--metrics',
+                                                   metricsfile])
+                self.assertEqual(0, res)
+            with open(metricsfile, 'r') as f:
+                summary = json.load(f)
+            task = summary['tasks']['input']
+            self.assertEqual('t', task['taskid'])
+            self.assertEqual(3, task['counters']['polls'])
+            self.assertEqual(len(json.dumps(qres)) +
+                             2 * len(json.dumps({'progress': 50,
+                                                 'status': ''})) +
+                             len(json.dumps({'progress': 100,
+                                             'status': 'complete'})) +
+                             len(json.dumps({'id': 't'})),
+                             task['counters']['bytes_received'])
+            self.assertEqual({'200': 4, '202': 1}, task['status_codes'])
+            for span in ['total', 'submit', 'wait', 'poll', 'download',
+                         'parse', 'map']:
+                self.assertEqual(3 if span == 'poll' else 1,
+                                 task['spans'][span]['count'])
+            self.assertTrue(task['spans']['wait']['total'] >=
+                            task['spans']['poll']['total'])
+            self.assertEqual(1, summary['aggregate']['tasks'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_iquery_batch_groups_canonical_genesets(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('1\tp53,mdm2\n2\tMDM2, tp53 ,,\n3\thi\n')
+            aliasfile = os.path.join(temp_dir, 'aliases.tsv')
+            with open(aliasfile, 'w') as f:
+                f.write('p53\tTP53\n')
+
+            with requests_mock.Mocker() as m:
+                qres = {'sources': [{'results': [{
+                    'description': 'x: y',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['TP53']}]}]}
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 't'})
+                p = cdiquerygenestotermcmd.\
+                    _parse_arguments('desc', [inputfile, '--url',
+                                              'http://foo', '--batch',
+                                              '--memo_size', '0',
+                                              '--max_inflight', '1',
+                                              '--aliases', aliasfile])
+                canonicalizer = cdiquerygenestotermcmd.\
+                    create_canonicalizer_from_args(p)
+                res = cdiquerygenestotermcmd.\
+                    run_iquery_batch(inputfile, p,
+                                     canonicalizer=canonicalizer)
+                posts = [r.json()['geneList'] for r in m.request_history
+                         if r.method == 'POST']
+            self.assertEqual([['mdm2', 'TP53'], ['hi']], posts)
+            self.assertEqual(['1', '2', '3'], list(res.keys()))
+            self.assertEqual('y', res['1']['name'])
+            self.assertEqual(res['1'], res['2'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_iquery_batch_jsonl_keeps_input_order(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.jsonl.gz')
+            with gzip.open(inputfile, 'wt') as f:
+                f.write('{"id": "1", "genes": ["a"]}\n'
+                        '{"id": "2", "genes": "b"}\n'
+                        '{"id": "3", "genes": ["A "]}\n')
+            with requests_mock.Mocker() as m:
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 't'})
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.get('http://foo/integratedsearch/v1/t',
+                      json={'sources': []})
+                p = cdiquerygenestotermcmd.\
+                    _parse_arguments('desc', [inputfile, '--url',
+                                              'http://foo', '--batch'])
+                res = cdiquerygenestotermcmd.run_iquery_batch(inputfile, p)
+                self.assertEqual(2, len([r for r in m.request_history
+                                         if r.method == 'POST']))
+            self.assertEqual(['1', '2', '3'], list(res.keys()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_batch_jsonl_output(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('1\ta\n2\t,\n3\tb\n')
+            qres = {'sources': [{'results': [{'description': 'x: y',
+                                              'details': {'PValue': 5,
+                                                          'similarity': 0.002},
+                                              'url': 'someurl',
+                                              'nodes': 4,
+                                              'hitGenes': ['A']}]}]}
+            with requests_mock.Mocker() as m:
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 't'})
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                orig_stdout = sys.stdout
+                sys.stdout = io.StringIO()
+                try:
+                    res = cdiquerygenestotermcmd.main(['prog', inputfile,
+                                                       '--batch', '--url',
+                                                       'http://foo',
+                                                       '--output_format',
+                                                       'jsonl',
+                                                       '--polling_interval',
+                                                       '0.001'])
+                    out = sys.stdout.getvalue()
+                finally:
+                    sys.stdout = orig_stdout
+            self.assertEqual(0, res)
+            records = [json.loads(line) for line in out.splitlines()]
+            self.assertEqual(['1', '2', '3'],
+                             sorted([r['id'] for r in records]))
+            byid = dict([(r['id'], r['result']) for r in records])
+            self.assertEqual('y', byid['1']['name'])
+            self.assertEqual(None, byid['2'])
+            self.assertEqual(['A'], byid['3']['intersections'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_applies_chained_aliases_once(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            aliasfile = os.path.join(temp_dir, 'aliases.tsv')
+            with open(aliasfile, 'w') as f:
+                f.write('A\tB\nB\tC\n')
+            inputfile = os.path.join(temp_dir, 'input')
+            with open(inputfile, 'w') as f:
+                f.write('a')
+            batchfile = os.path.join(temp_dir, 'batch.txt')
+            with open(batchfile, 'w') as f:
+                f.write('1\ta\n')
+            qres = {'sources': [{'results': [{'description': 'x: y',
+                                              'details': {'PValue': 5,
+                                                          'similarity': 0.002},
+                                              'url': 'someurl',
+                                              'nodes': 4,
+                                              'hitGenes': ['B']}]}]}
+            for myargs in [[inputfile], [batchfile, '--batch'],
+                           [batchfile, '--batch', '--output_format',
+                            'jsonl']]:
+                with requests_mock.Mocker() as m:
+                    m.post('http://foo/integratedsearch/v1/',
+                           status_code=202, json={'id': 't'})
+                    m.get('http://foo/integratedsearch/v1/t/status',
+                          json={'progress': 100, 'status': 'complete'})
+                    m.get('http://foo/integratedsearch/v1/t', json=qres)
+                    orig_stdout = sys.stdout
+                    sys.stdout = io.StringIO()
+                    try:
+                        res = cdiquerygenestotermcmd.\
+                            main(['prog'] + myargs +
+                                 ['--url', 'http://foo', '--aliases',
+                                  aliasfile, '--polling_interval',
+                                  '0.001'])
+                    finally:
+                        sys.stdout = orig_stdout
+                    self.assertEqual(0, res)
+                    posts = [r for r in m.request_history
+                             if r.method == 'POST']
+                    self.assertEqual(1, len(posts))
+                    self.assertEqual(['B'], posts[0].json()['geneList'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_with_snapshot(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshotfile = os.path.join(temp_dir, 'snapshot.json')
+            with open(snapshotfile, 'w') as f:
+                json.dump({'networks': [{'name': 'one', 'source': 'src',
+                                         'url': 'url1', 'nodes': 10,
+                                         'genes': ['a', 'b', 'c']},
+                                        {'name': 'two', 'source': 'src',
+                                         'url': 'url2',
+                                         'genes': ['c', 'd']}]}, f)
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('1\ta,b\n2\td\n3\tz\n')
+            indexfile = os.path.join(temp_dir, 'snapshot.idx')
+            with requests_mock.Mocker() as m:
+                orig_stdout = sys.stdout
+                sys.stdout = io.StringIO()
+                try:
+                    res = cdiquerygenestotermcmd.main(['prog', inputfile,
+                                                       '--batch',
+                                                       '--snapshot',
+                                                       snapshotfile,
+                                                       '--snapshot_index',
+                                                       indexfile])
+                    out = sys.stdout.getvalue()
+                finally:
+                    sys.stdout = orig_stdout
+                self.assertEqual(0, len(m.request_history))
+            self.assertEqual(0, res)
+            res = json.loads(out)
+            self.assertEqual({'name': 'one', 'source': 'src',
+                              'p_value': res['1']['p_value'],
+                              'description': 'url1', 'term_size': 10,
+                              'intersections': ['a', 'b']}, res['1'])
+            self.assertEqual('two', res['2']['name'])
+            self.assertEqual(None, res['3'])
+            self.assertTrue(os.path.isfile(indexfile))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def _mock_iquery(self, m, hitgenes):
+        qres = {'sources': [{'results': [{'description': 'rsrc: rnet',
+                                          'details': {'PValue': 0.1,
+                                                      'similarity': 0.9},
+                                          'url': 'rurl',
+                                          'nodes': 4,
+                                          'hitGenes': hitgenes}]}]}
+        m.post('http://foo/integratedsearch/v1/', status_code=202,
+               json={'id': 't'})
+        m.get('http://foo/integratedsearch/v1/t/status',
+              json={'progress': 100, 'status': 'complete'})
+        m.get('http://foo/integratedsearch/v1/t', json=qres)
+
+    def test_run_iquery_for_genes_hybrid(self):
+        from cdiquerygenestoterm.local import LocalEnrichmentEngine
+        engine = LocalEnrichmentEngine([{'name': 'one', 'source': 'src',
+                                         'url': 'url1',
+                                         'genes': ['A', 'B', 'C', 'D']}])
+        temp_dir = tempfile.mkdtemp()
+        try:
+            p = cdiquerygenestotermcmd.\
+                _parse_arguments('desc', ['foo', '--url', 'http://foo',
+                                          '--polling_interval', '0',
+                                          '--resolution', 'hybrid',
+                                          '--min_local_similarity',
+                                          '0.5'])
+            cache = ResultCache(temp_dir)
+            memo = MappedTermMemo()
+            metrics = RunMetrics()
+            with requests_mock.Mocker() as m:
+                self._mock_iquery(m, ['Z'])
+
+                # similarity of 2 / sqrt(2 * 4) is above threshold
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['a', 'b'], p, cache=cache, memo=memo,
+                    metrics=metrics.create_task('1'), engine=engine)
+                self.assertEqual('one', res['name'])
+                self.assertEqual('local', res['resolution'])
+                self.assertEqual(0, len(m.request_history))
+
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['b', 'a'], p, cache=cache, memo=memo,
+                    metrics=metrics.create_task('2'), engine=engine)
+                self.assertEqual('memo', res['resolution'])
+
+                # similarity of 1 / sqrt(2 * 4) is below threshold
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['a', 'z'], p, cache=cache, memo=memo,
+                    metrics=metrics.create_task('3'), engine=engine)
+                self.assertEqual('rnet', res['name'])
+                self.assertEqual('remote', res['resolution'])
+                posts = [r for r in m.request_history
+                         if r.method == 'POST']
+                self.assertEqual(1, len(posts))
+                self.assertEqual(['a', 'z'], posts[0].json()['geneList'])
+
+                # no network has Q
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['q'], p, cache=cache, metrics=metrics.create_task('4'),
+                    engine=engine)
+                self.assertEqual('remote', res['resolution'])
+
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['z', 'a'], p, cache=cache,
+                    metrics=metrics.create_task('5'), engine=engine)
+                self.assertEqual('cache', res['resolution'])
+                self.assertEqual(2, len([r for r in m.request_history
+                                         if r.method == 'POST']))
+            self.assertTrue('resolution' not in
+                            cache.get(cdiquerygenestotermcmd.
+                                      get_cache_key_for_genes(['A', 'Z'],
+                                                              p)))
+            counters = metrics.get_aggregate()['counters']
+            self.assertEqual(1, counters['local_answers'])
+            self.assertEqual(2, counters['local_fallbacks'])
+
+            # local resolution never queries iQuery nor adds resolution
+            p.resolution = 'local'
+            with requests_mock.Mocker() as m:
+                res = cdiquerygenestotermcmd.run_iquery_for_genes(
+                    ['a', 'z'], p, engine=engine)
+                self.assertEqual('one', res['name'])
+                self.assertTrue('resolution' not in res)
+                self.assertEqual(None, cdiquerygenestotermcmd.
+                                 run_iquery_for_genes(['q'], p,
+                                                      engine=engine))
+                self.assertEqual(0, len(m.request_history))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_iquery_batch_hybrid(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshotfile = os.path.join(temp_dir, 'snapshot.json')
+            with open(snapshotfile, 'w') as f:
+                json.dump({'networks': [{'name': 'one', 'source': 'src',
+                                         'url': 'url1',
+                                         'genes': ['a', 'b']}]}, f)
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('1\ta,b\n2\tq\n3\tb,a\n4\tr,q\n5\t\n')
+            p = cdiquerygenestotermcmd.\
+                _parse_arguments('desc', [inputfile, '--url',
+                                          'http://foo', '--batch',
+                                          '--polling_interval', '0',
+                                          '--memo_size', '0',
+                                          '--snapshot', snapshotfile,
+                                          '--resolution', 'hybrid',
+                                          '--topk', '2'])
+            engine = cdiquerygenestotermcmd.create_engine_from_args(p)
+            metrics = RunMetrics()
+            with requests_mock.Mocker() as m:
+                self._mock_iquery(m, ['Q'])
+                res = cdiquerygenestotermcmd.run_iquery_batch(
+                    inputfile, p, engine=engine, metrics=metrics)
+                posts = [r.json()['geneList'] for r in m.request_history
+                         if r.method == 'POST']
+            self.assertEqual([['q'], ['q', 'r']], posts)
+            self.assertEqual(['1', '2', '3', '4', '5'], list(res.keys()))
+            self.assertEqual([('one', 'local')],
+                             [(t['name'], t['resolution'])
+                              for t in res['1']])
+            self.assertEqual(res['1'], res['3'])
+            self.assertEqual([('rnet', 'remote')],
+                             [(t['name'], t['resolution'])
+                              for t in res['2']])
+            self.assertEqual('remote', res['4'][0]['resolution'])
+            self.assertEqual(None, res['5'])
+            counters = metrics.get_aggregate()['counters']
+            self.assertEqual(1, counters['local_answers'])
+            self.assertEqual(2, counters['local_fallbacks'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_write_snapshot(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            jsonfile = os.path.join(temp_dir, 'snapshot.json')
+            with open(jsonfile, 'w') as f:
+                json.dump({'networks': [{'name': 'one', 'source': 'src',
+                                         'url': 'url1',
+                                         'genes': ['a', 'b', 'c']}]}, f)
+            snapshotfile = os.path.join(temp_dir, 'snapshot.bin')
+            orig_stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                self.assertEqual(2, cdiquerygenestotermcmd.main(
+                    ['prog', '--write_snapshot', snapshotfile]))
+                self.assertEqual(0, cdiquerygenestotermcmd.main(
+                    ['prog', '--snapshot', jsonfile,
+                     '--write_snapshot', snapshotfile]))
+                self.assertTrue('Wrote 1 networks' in
+                                sys.stderr.getvalue())
+            finally:
+                sys.stderr = orig_stderr
+
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('b,a')
+            orig_stdout = sys.stdout
+            sys.stdout = io.StringIO()
+            try:
+                res = cdiquerygenestotermcmd.main(['prog', inputfile,
+                                                   '--snapshot',
+                                                   snapshotfile])
+                out = sys.stdout.getvalue()
+            finally:
+                sys.stdout = orig_stdout
+            self.assertEqual(0, res)
+            res = json.loads(out)
+            self.assertEqual('one', res['name'])
+            self.assertEqual('url1', res['description'])
+            self.assertEqual(['a', 'b'], res['intersections'])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_batch_with_prometheus_textfile(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('1\thi,there\n2\tbad\n3\tthere,hi\n')
+            promfile = os.path.join(temp_dir, 'iquery.prom')
+
+            def post_cb(request, context):
+                if request.json()['geneList'] == ['bad']:
+                    context.status_code = 500
+                    return {}
+                context.status_code = 202
+                return {'id': 't'}
+
+            with requests_mock.Mocker() as m:
+                qres = {'sources': [{'results': [{
+                    'description': 'x: y',
+                    'details': {'PValue': 5, 'similarity': 0.002},
+                    'url': 'someurl',
+                    'nodes': 4,
+                    'hitGenes': ['1', '2']}]}]}
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.post('http://foo/integratedsearch/v1/', json=post_cb)
+                res = cdiquerygenestotermcmd.main(['prog', inputfile,
+                                                   '--batch',
+                                                   '--url', 'http://foo',
+                                                   '--polling_interval',
+                                                   '0.001',
+                                                   '--max_inflight', '1',
+                                                   '--prometheus_textfile',
+                                                   promfile])
+                self.assertEqual(0, res)
+            with open(promfile, 'r') as f:
+                lines = f.read().split('\n')
+            prefix = 'cdiquerygenestoterm_'
+            self.assertTrue(prefix + 'tasks_submitted_total 1' in lines)
+            self.assertTrue(prefix + 'tasks_completed_total 1' in lines)
+            self.assertTrue(prefix + 'tasks_failed_total 1' in lines)
+            self.assertTrue(prefix + 'tasks_inflight 0' in lines)
+            self.assertTrue(prefix + 'task_polls_count 1' in lines)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_run_iquery_batch_with_metrics(self):
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.002},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['hi']}]}]}
+        temp_dir = tempfile.mkdtemp()
+        try:
+            inputfile = os.path.join(temp_dir, 'input.txt')
+            with open(inputfile, 'w') as f:
+                f.write('a\thi\nb\thi\nc\tthere\n')
+            with requests_mock.Mocker() as m:
+                m.post('http://foo/integratedsearch/v1/', status_code=202,
+                       json={'id': 't'})
+                m.get('http://foo/integratedsearch/v1/t/status',
+                      json={'progress': 100, 'status': 'complete'})
+                m.get('http://foo/integratedsearch/v1/t', json=qres)
+                p = cdiquerygenestotermcmd.\
+                    _parse_arguments('desc', [inputfile, '--url',
+                                              'http://foo', '--batch',
+                                              '--max_inflight', '1'])
+                metrics = RunMetrics()
+                res = cdiquerygenestotermcmd.\
+                    run_iquery_batch(inputfile, p, memo=MappedTermMemo(),
+                                     metrics=metrics)
+            self.assertEqual('y', res['b']['name'])
+            self.assertEqual('y', res['c']['name'])
+            summary = metrics.get_summary()
+            # b has same genes as a so it is not a task of its own
+            self.assertEqual(['a', 'c'], sorted(summary['tasks'].keys()))
+            self.assertEqual(1, summary['tasks']['c']['counters']['polls'])
+            agg = summary['aggregate']
+            self.assertEqual(2, agg['tasks'])
+            self.assertEqual(2, agg['counters']['polls'])
+            self.assertEqual({'200': 4, '202': 2}, agg['status_codes'])
+            self.assertEqual(2, agg['spans']['total']['count'])
+            self.assertEqual(2, agg['spans']['wait']['count'])
+            self.assertEqual(2, agg['spans']['map']['count'])
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_main_invalid_file(self):
         temp_dir = tempfile.mkdtemp()
         try:
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_daemon
+----------------------------------
+
+Tests for `cdiquerygenestoterm.daemon` module.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+import requests_mock
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm.daemon import IQueryDaemon
+from cdiquerygenestoterm.daemon import InvalidJobError
+from cdiquerygenestoterm.daemon import parse_job
+from tests.helpers import QRES
+
+
+def _mock_iquery(m):
+    def post_cb(request, context):
+        if request.json()['geneList'] == ['BAD']:
+            context.status_code = 500
+            return {}
+        context.status_code = 202
+        return {'id': 't'}
+
+    m.post('http://foo/integratedsearch/v1/', json=post_cb)
+    m.get('http://foo/integratedsearch/v1/t/status',
+          json={'progress': 100, 'status': 'complete'})
+    m.get('http://foo/integratedsearch/v1/t', json=QRES)
+
+
+def _get_args():
+    return cdiquerygenestotermcmd._parse_arguments('desc',
+                                                   ['--daemon', '--url',
+                                                    'http://foo',
+                                                    '--workers', '2',
+                                                    '--polling_interval',
+                                                    '0.001'])
+
+
+class TestDaemon(unittest.TestCase):
+
+    def test_parse_job(self):
+        self.assertEqual((['a', 'b'], None), parse_job({'genes': 'a,b'}))
+        self.assertEqual((['a'], None), parse_job({'genes': ['a']}))
+        self.assertEqual((None, [('1', ['a']), ('x', None)]),
+                         parse_job({'genesets': {1: 'a', 'x': ','}}))
+        for job in [[], {}, {'genes': ''}, {'genes': 5},
+                    {'genesets': ['a']}]:
+            self.assertRaises(InvalidJobError, parse_job, job)
+
+    def test_parse_args_daemon(self):
+        p = _get_args()
+        self.assertEqual(None, p.input)
+        self.assertTrue(p.daemon)
+        self.assertEqual('127.0.0.1:8089', p.listen)
+        self.assertEqual(None, p.spooldir)
+        self.assertEqual(1.0, p.spool_interval)
+        self.assertEqual(2, p.workers)
+        self.assertRaises(SystemExit,
+                          cdiquerygenestotermcmd._parse_arguments,
+                          'desc', [])
+
+    def test_http_server(self):
+        daemon = IQueryDaemon(_get_args())
+        server = daemon.create_http_server(port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:' + str(server.server_address[1])
+
+        def post(job):
+            req = urllib.request.Request(url + '/',
+                                         data=json.dumps(job)
+                                         .encode('utf-8'),
+                                         method='POST')
+            try:
+                with urllib.request.urlopen(req) as res:
+                    return res.status, json.loads(res.read())
+            except urllib.error.HTTPError as e:
+                return e.code, json.loads(e.read())
+
+        try:
+            with requests_mock.Mocker(real_http=True) as m:
+                _mock_iquery(m)
+                status, res = post({'genes': 'a,b'})
+                self.assertEqual(200, status)
+                self.assertEqual('z', res['name'])
+
+                status, res = post({'genes': ['BAD']})
+                self.assertEqual(200, status)
+                self.assertEqual(None, res)
+
+                status, res = post({'genesets': {'b': ['b', 'a'],
+                                                 'a': ['c']}})
+                self.assertEqual(200, status)
+                self.assertEqual(['b', 'a'], list(res.keys()))
+                self.assertEqual('z', res['a']['name'])
+                self.assertEqual('z', res['b']['name'])
+
+                status, res = post({'nope': 1})
+                self.assertEqual(400, status)
+                self.assertTrue('genes' in res['error'])
+
+                # a,b was answered from memo
+                self.assertEqual(3, len([r for r in m.request_history
+                                         if r.method == 'POST']))
+
+            with urllib.request.urlopen(url + '/status') as res:
+                stats = json.loads(res.read())
+            self.assertEqual(3, stats['jobs_done'])
+            self.assertEqual(1, stats['jobs_failed'])
+
+            with urllib.request.urlopen(url + '/metrics') as res:
+                self.assertTrue(res.headers['Content-Type']
+                                .startswith('text/plain'))
+                lines = res.read().decode('utf-8').split('\n')
+            prefix = 'cdiquerygenestoterm_'
+            self.assertTrue(prefix + 'tasks_submitted_total 2' in lines)
+            self.assertTrue(prefix + 'tasks_completed_total 2' in lines)
+            self.assertTrue(prefix + 'tasks_failed_total 1' in lines)
+            self.assertTrue(prefix + 'tasks_inflight 0' in lines)
+            self.assertTrue(prefix + 'cache_hits_total{kind="memo"} 1'
+                            in lines)
+        finally:
+            server.shutdown()
+            server.server_close()
+            daemon.shutdown()
+
+    def test_process_spooldir(self):
+        temp_dir = tempfile.mkdtemp()
+        daemon = IQueryDaemon(_get_args())
+        try:
+            with open(os.path.join(temp_dir, 'one.txt'), 'w') as f:
+                f.write('a,b\n')
+            with open(os.path.join(temp_dir, 'two.json'), 'w') as f:
+                json.dump({'genesets': {'x': 'a,b'}}, f)
+            with open(os.path.join(temp_dir, 'three.json'), 'w') as f:
+                f.write('{bad')
+            with open(os.path.join(temp_dir, 'ignored.csv'), 'w') as f:
+                f.write('a')
+
+            with requests_mock.Mocker() as m:
+                _mock_iquery(m)
+                futures = daemon.process_spooldir(temp_dir)
+                for future in futures:
+                    future.result()
+            self.assertEqual(2, len(futures))
+            self.assertEqual(['ignored.csv', 'one.result',
+                              'three.error', 'two.result'],
+                             sorted(os.listdir(temp_dir)))
+            with open(os.path.join(temp_dir, 'one.result'), 'r') as f:
+                self.assertEqual('z', json.load(f)['name'])
+            with open(os.path.join(temp_dir, 'two.result'), 'r') as f:
+                self.assertEqual('z', json.load(f)['x']['name'])
+
+            # nothing left to do
+            self.assertEqual([], daemon.process_spooldir(temp_dir))
+        finally:
+            daemon.shutdown()
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_exporter
+----------------------------------
+
+Tests for `cdiquerygenestoterm.exporter` module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.exporter import Histogram
+from cdiquerygenestoterm.exporter import PrometheusExporter
+from cdiquerygenestoterm.exporter import create_http_server
+
+
+def _get_samples(text):
+    samples = {}
+    for line in text.split('\n'):
+        if line == '' or line.startswith('#'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        samples[name] = value
+    return samples
+
+
+class TestExporter(unittest.TestCase):
+
+    def test_histogram(self):
+        hist = Histogram((1, 2.5))
+        for value in [0.5, 1, 3]:
+            hist.observe(value)
+        self.assertEqual(3, hist.get_count())
+        self.assertEqual(['x_bucket{le="1"} 2',
+                          'x_bucket{le="2.5"} 2',
+                          'x_bucket{le="+Inf"} 3',
+                          'x_sum 4.5',
+                          'x_count 3'], hist.get_lines('x'))
+
+    def test_exporter(self):
+        exporter = PrometheusExporter(latency_buckets=(1.0, 10.0),
+                                      polls_buckets=(1, 5))
+        run = RunMetrics(listener=exporter, keep_tasks=False)
+
+        # completed after 3 polls and 2 seconds
+        task = run.create_task('a')
+        task.record_submitted('t1')
+        task.incr('polls', 3)
+        task.add_time('total', 2.0)
+
+        # still running
+        running = run.create_task('b')
+        running.record_submitted('t2')
+        samples = _get_samples(exporter.get_exposition())
+        self.assertEqual('2', samples['cdiquerygenestoterm_'
+                                      'tasks_submitted_total'])
+        self.assertEqual('2', samples['cdiquerygenestoterm_'
+                                      'tasks_inflight'])
+        task.finish(True)
+
+        # submission rejected by service
+        rejected = run.create_task('c')
+        rejected.add_time('submit', 0.1)
+        rejected.finish(False)
+
+        # answered from cache
+        cached = run.create_task('d')
+        cached.incr('cache_hits')
+        cached.finish(True)
+
+        # answered locally and sent to iQuery after local fallback
+        local = run.create_task('e')
+        local.incr('local_answers')
+        local.finish(True)
+        fallback = run.create_task('f')
+        fallback.incr('local_fallbacks')
+        fallback.finish(False)
+
+        self.assertEqual([], run.get_tasks())
+        text = exporter.get_exposition()
+        self.assertTrue('# TYPE cdiquerygenestoterm_task_latency_seconds '
+                        'histogram\n' in text)
+        samples = _get_samples(text)
+        prefix = 'cdiquerygenestoterm_'
+        self.assertEqual('2', samples[prefix + 'tasks_submitted_total'])
+        self.assertEqual('1', samples[prefix + 'tasks_completed_total'])
+        self.assertEqual('1', samples[prefix + 'tasks_failed_total'])
+        self.assertEqual('1', samples[prefix + 'tasks_inflight'])
+        self.assertEqual('1', samples[prefix +
+                                      'cache_hits_total{kind="cache"}'])
+        self.assertEqual('0', samples[prefix +
+                                      'cache_hits_total{kind="memo"}'])
+        self.assertEqual('1', samples[prefix + 'local_answers_total'])
+        self.assertEqual('1', samples[prefix + 'local_fallbacks_total'])
+        self.assertEqual('0', samples[prefix + 'task_polls_bucket{le="1"}'])
+        self.assertEqual('1', samples[prefix + 'task_polls_bucket{le="5"}'])
+        self.assertEqual('0', samples[prefix + 'task_latency_seconds_'
+                                               'bucket{le="1.0"}'])
+        self.assertEqual('1', samples[prefix + 'task_latency_seconds_'
+                                               'bucket{le="10.0"}'])
+        self.assertEqual('2.0', samples[prefix +
+                                        'task_latency_seconds_sum'])
+
+    def test_exporter_resumed_tasks(self):
+        exporter = PrometheusExporter(latency_buckets=(1.0, 10.0),
+                                      polls_buckets=(1, 5))
+        run = RunMetrics(listener=exporter, keep_tasks=False)
+
+        # resumed from journal, completed after 2 polls
+        resumed = run.create_task('a')
+        resumed.record_resumed('t1')
+        samples = _get_samples(exporter.get_exposition())
+        self.assertEqual('0', samples['cdiquerygenestoterm_'
+                                      'tasks_submitted_total'])
+        self.assertEqual('1', samples['cdiquerygenestoterm_'
+                                      'tasks_inflight'])
+        resumed.incr('polls', 2)
+        resumed.add_time('total', 0.5)
+        resumed.finish(True)
+
+        # resumed, unknown to service so submitted again, then failed
+        resubmitted = run.create_task('b')
+        resubmitted.record_resumed('t2')
+        resubmitted.record_submitted('t3')
+        samples = _get_samples(exporter.get_exposition())
+        self.assertEqual('1', samples['cdiquerygenestoterm_'
+                                      'tasks_inflight'])
+        resubmitted.incr('polls', 4)
+        resubmitted.add_time('total', 5.0)
+        resubmitted.finish(False)
+
+        samples = _get_samples(exporter.get_exposition())
+        prefix = 'cdiquerygenestoterm_'
+        self.assertEqual('1', samples[prefix + 'tasks_submitted_total'])
+        self.assertEqual('1', samples[prefix + 'tasks_completed_total'])
+        self.assertEqual('1', samples[prefix + 'tasks_failed_total'])
+        self.assertEqual('0', samples[prefix + 'tasks_inflight'])
+        self.assertEqual('0', samples[prefix + 'task_polls_bucket{le="1"}'])
+        self.assertEqual('2', samples[prefix + 'task_polls_bucket{le="5"}'])
+        self.assertEqual('2', samples[prefix + 'task_polls_count'])
+        self.assertEqual('1', samples[prefix + 'task_latency_seconds_'
+                                               'bucket{le="1.0"}'])
+        self.assertEqual('2', samples[prefix + 'task_latency_seconds_'
+                                               'count'])
+
+    def test_write_textfile(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            exporter = PrometheusExporter()
+            path = os.path.join(temp_dir, 'iquery.prom')
+            exporter.write_textfile(path)
+            with open(path, 'r') as f:
+                self.assertEqual(exporter.get_exposition(), f.read())
+            self.assertEqual(['iquery.prom'], os.listdir(temp_dir))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_create_http_server(self):
+        exporter = PrometheusExporter()
+        server = create_http_server(exporter, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:' + str(server.server_address[1])
+        try:
+            with urllib.request.urlopen(url + '/metrics') as res:
+                self.assertEqual(200, res.status)
+                self.assertEqual(exporter.get_exposition(),
+                                 res.read().decode('utf-8'))
+            try:
+                urllib.request.urlopen(url + '/')
+                self.fail('Expected HTTPError')
+            except urllib.error.HTTPError as e:
+                self.assertEqual(404, e.code)
+        finally:
+            server.shutdown()
+            server.server_close()
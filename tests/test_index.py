@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_index
+----------------------------------
+
+Tests for `cdiquerygenestoterm.index` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm import index
+
+
+GENESETS = [['A', 'B', 'C'], ['C', 'D', 'E', 'F'], ['X'], [],
+            ['C', 'É']]
+
+
+class TestIndex(unittest.TestCase):
+
+    def _check_index(self, theindex):
+        self.assertEqual(8, theindex.get_gene_count())
+        self.assertEqual(5, theindex.get_network_count())
+        self.assertEqual([3, 4, 1, 0, 2],
+                         [theindex.get_size(i) for i in range(5)])
+        self.assertEqual([0, 1, 4], list(theindex.get_networks('C')))
+        self.assertEqual([0], list(theindex.get_networks('A')))
+        self.assertEqual([4], list(theindex.get_networks('É')))
+        self.assertEqual([2], list(theindex.get_networks('X')))
+        for missing in ['', 'Q', '0', 'ZZZ', 'c']:
+            self.assertEqual([], list(theindex.get_networks(missing)))
+
+    def test_symbol_table(self):
+        table = index.SymbolTable.from_symbols(['B', 'A', 'É', 'AB'])
+        self.assertEqual(4, len(table))
+        self.assertEqual(['A', 'AB', 'B', 'É'],
+                         [table[i] for i in range(len(table))])
+        self.assertEqual(1, table.get_id('AB'))
+        self.assertEqual(3, table.get_id('É'))
+        self.assertEqual(None, table.get_id('AA'))
+        self.assertEqual(None, table.get_id('Z'))
+        empty = index.SymbolTable.from_symbols([])
+        self.assertEqual(0, len(empty))
+        self.assertEqual(None, empty.get_id('A'))
+
+    def test_uint32(self):
+        data = index.to_uint32_bytes([0, 1, 2 ** 32 - 1])
+        self.assertEqual(b'\x00\x00\x00\x00\x01\x00\x00\x00'
+                         b'\xff\xff\xff\xff', data)
+        self.assertEqual([0, 1, 2 ** 32 - 1],
+                         list(index.as_uint32(memoryview(data))))
+
+    def test_build(self):
+        self._check_index(index.GeneIndex.build(GENESETS))
+
+    def test_write_and_load(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            indexfile = os.path.join(temp_dir, 'index.bin')
+            index.GeneIndex.build(GENESETS).write(indexfile)
+            self.assertEqual(['index.bin'], os.listdir(temp_dir))
+            self._check_index(index.GeneIndex.load(indexfile))
+
+            empty = os.path.join(temp_dir, 'empty.bin')
+            index.GeneIndex.build([]).write(empty)
+            theindex = index.GeneIndex.load(empty)
+            self.assertEqual(0, theindex.get_network_count())
+            self.assertEqual([], list(theindex.get_networks('A')))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_invalid(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            badfile = os.path.join(temp_dir, 'bad.bin')
+            for data in [b'', b'{"networks": []}' * 4,
+                         index.INDEX_MAGIC + b'\xff' * 8]:
+                with open(badfile, 'wb') as f:
+                    f.write(data)
+                self.assertRaises(ValueError, index.GeneIndex.load,
+                                  badfile)
+            index.write_sections(badfile, index.INDEX_MAGIC,
+                                 [b'a', b'bc'])
+            self.assertRaises(ValueError, index.GeneIndex.load,
+                              badfile)
+            sections = index.map_sections(badfile, index.INDEX_MAGIC)
+            self.assertEqual([b'a', b'bc'], [bytes(s) for s in sections])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_journal
+----------------------------------
+
+Tests for `cdiquerygenestoterm.journal` module.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm.journal import TaskJournal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._temp_dir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_records_survive_reopen(self):
+        with TaskJournal(self._path) as journal:
+            self.assertEqual(None, journal.get('a'))
+            journal.record_submitted('a', 't1')
+            journal.record_submitted('b', 't2')
+            journal.record_submitted('c', 't3')
+            journal.record_done('a', 't1', {'name': 'x'})
+            journal.record_failed('b', 't2')
+
+        with TaskJournal(self._path, fsync=True) as journal:
+            self.assertEqual(3, len(journal.get_records()))
+            rec = journal.get('a')
+            self.assertEqual(TaskJournal.STATE_DONE,
+                             rec[TaskJournal.STATE])
+            self.assertEqual({'name': 'x'}, rec[TaskJournal.RESULT])
+            self.assertEqual(TaskJournal.STATE_FAILED,
+                             journal.get('b')[TaskJournal.STATE])
+            rec = journal.get('c')
+            self.assertEqual(TaskJournal.STATE_SUBMITTED,
+                             rec[TaskJournal.STATE])
+            self.assertEqual('t3', rec[TaskJournal.TASKID])
+
+    def test_partial_last_record_is_ignored(self):
+        with open(self._path, 'w') as f:
+            f.write(json.dumps({'key': 'a', 'taskid': 't1',
+                                'state': 'submitted'}) + '\n')
+            f.write('{"key": "b", "task')
+
+        with TaskJournal(self._path) as journal:
+            self.assertEqual(['a'], list(journal.get_records().keys()))
+            journal.record_done('a', 't1', None)
+
+        with TaskJournal(self._path) as journal:
+            rec = journal.get('a')
+            self.assertEqual(TaskJournal.STATE_DONE,
+                             rec[TaskJournal.STATE])
+            self.assertEqual(None, rec[TaskJournal.RESULT])
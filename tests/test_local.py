@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_local
+----------------------------------
+
+Tests for `cdiquerygenestoterm.local` module.
+"""
+
+import os
+import math
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm import local
+from tests.helpers import NETWORKS
+
+
+def _reference_sf(k, total, successes, draws):
+    return sum([math.comb(successes, i) *
+                math.comb(total - successes, draws - i)
+                for i in range(k, min(draws, successes) + 1)]) /\
+        math.comb(total, draws)
+
+
+class TestLocal(unittest.TestCase):
+
+    def test_hypergeometric_sf(self):
+        logfact = local.get_log_factorials(1000)
+        self.assertEqual(0.0, logfact[1])
+        self.assertAlmostEqual(math.log(120), logfact[5])
+        for k, total, successes, draws in [(3, 1000, 50, 20),
+                                           (1, 100, 10, 5),
+                                           (5, 100, 10, 5),
+                                           (10, 1000, 30, 40),
+                                           (2, 10, 8, 5)]:
+            expected = _reference_sf(k, total, successes, draws)
+            self.assertTrue(math.isclose(expected,
+                                         local.hypergeometric_sf(
+                                             k, total, successes, draws,
+                                             logfact),
+                                         rel_tol=1e-9))
+        self.assertEqual(1.0, local.hypergeometric_sf(0, 10, 5, 5,
+                                                      logfact))
+        self.assertEqual(0.0, local.hypergeometric_sf(6, 10, 5, 5,
+                                                      logfact))
+
+    def test_engine_query(self):
+        engine = local.LocalEnrichmentEngine(NETWORKS)
+        self.assertEqual(4, engine.get_network_count())
+        self.assertEqual(7, engine.get_universe_size())
+        self.assertEqual({}, engine.get_hits(['Q']))
+        self.assertEqual({0: ['B', 'C'], 1: ['C']},
+                         engine.get_hits(['B', 'C']))
+
+        res = engine.query(['B', 'C', 'Q'])
+        results = sorted(res['sources'][0]['results'],
+                         key=lambda r: r['url'])
+        self.assertEqual(2, len(results))
+        self.assertEqual('src: one', results[0]['description'])
+        self.assertEqual(10, results[0]['nodes'])
+        self.assertEqual(['B', 'C'], results[0]['hitGenes'])
+        self.assertAlmostEqual(2 / math.sqrt(3 * 3),
+                               results[0]['details']['similarity'])
+        self.assertAlmostEqual(_reference_sf(2, 7, 3, 3),
+                               results[0]['details']['PValue'])
+        self.assertEqual(4, results[1]['nodes'])
+        self.assertAlmostEqual(1 / math.sqrt(3 * 4),
+                               results[1]['details']['similarity'])
+
+        engine = local.LocalEnrichmentEngine(NETWORKS, universe_size=100)
+        self.assertEqual(100, engine.get_universe_size())
+        res = engine.query(['X'])['sources'][0]['results']
+        self.assertEqual('NA: three', res[0]['description'])
+        self.assertAlmostEqual(0.01, res[0]['details']['PValue'])
+
+    def test_engine_query_top_k(self):
+        networks = NETWORKS + [{'name': 'four', 'url': 'url4',
+                                'genes': ['c', 'x']},
+                               {'name': 'five', 'url': 'url5',
+                                'genes': ['b', 'x']}]
+        engine = local.LocalEnrichmentEngine(networks)
+        genes = ['X', 'C', 'B', 'F']
+        full = engine.query(genes)['sources'][0]['results']
+        self.assertEqual(5, len(full))
+        for k in range(1, 7):
+            # best k by similarity, earlier results winning ties,
+            # in the order of the full results
+            ranked = sorted(range(len(full)),
+                            key=lambda i: (-full[i]['details']
+                                           ['similarity'], i))[:k]
+            expected = [full[i] for i in sorted(ranked)]
+            self.assertEqual(expected, engine.query(genes, k=k)
+                             ['sources'][0]['results'])
+        self.assertEqual([], engine.query(['Q'], k=1)
+                         ['sources'][0]['results'])
+
+    def test_engine_query_top_k_without_numpy(self):
+        networks = NETWORKS + [{'name': 'four', 'url': 'url4',
+                                'genes': ['c', 'x']},
+                               {'name': 'five', 'url': 'url5',
+                                'genes': ['b', 'x']}]
+        engine = local.LocalEnrichmentEngine(networks)
+        genes = ['X', 'C', 'B', 'F']
+        expected = [engine.query(genes, k=k) for k in range(1, 7)]
+        # empty tuple marks numpy as unavailable
+        engine._arrays = ()
+        self.assertEqual(expected,
+                         [engine.query(genes, k=k) for k in range(1, 7)])
+
+    def test_load_snapshot(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshotfile = os.path.join(temp_dir, 'snapshot.json.gz')
+            with gzip.open(snapshotfile, 'wt') as f:
+                json.dump({'universe_size': 20000,
+                           'networks': NETWORKS}, f)
+            engine = local.load_snapshot(snapshotfile)
+            self.assertEqual(4, engine.get_network_count())
+            self.assertEqual(20000, engine.get_universe_size())
+
+            for bad in [[], {'networks': {}}, {'networks': [{}]}]:
+                with open(snapshotfile, 'w') as f:
+                    json.dump(bad, f)
+                self.assertRaises(ValueError, local.load_snapshot,
+                                  snapshotfile)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_load_snapshot_with_index(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshotfile = os.path.join(temp_dir, 'snapshot.json')
+            with open(snapshotfile, 'w') as f:
+                json.dump({'networks': NETWORKS}, f)
+            indexfile = os.path.join(temp_dir, 'snapshot.idx')
+            expected = local.load_snapshot(snapshotfile).query(['B', 'C'])
+            engine = local.load_snapshot(snapshotfile, indexfile=indexfile)
+            self.assertTrue(os.path.isfile(indexfile))
+            self.assertEqual(expected, engine.query(['B', 'C']))
+
+            # index is memory mapped when it is newer than snapshot
+            mtime = os.path.getmtime(indexfile)
+            engine = local.load_snapshot(snapshotfile, indexfile=indexfile)
+            self.assertEqual(mtime, os.path.getmtime(indexfile))
+            self.assertEqual(expected, engine.query(['B', 'C']))
+            self.assertEqual(7, engine.get_universe_size())
+
+            # stale index is rebuilt
+            with open(snapshotfile, 'w') as f:
+                json.dump({'networks': NETWORKS[:2]}, f)
+            os.utime(snapshotfile, (mtime + 10, mtime + 10))
+            engine = local.load_snapshot(snapshotfile, indexfile=indexfile)
+            self.assertEqual(2, engine.get_index().get_network_count())
+            self.assertEqual(2, local.load_snapshot(
+                snapshotfile, indexfile=indexfile).get_network_count())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_engine_with_index_of_other_networks(self):
+        theindex = local.LocalEnrichmentEngine(NETWORKS[:2]).get_index()
+        self.assertRaises(ValueError, local.LocalEnrichmentEngine,
+                          NETWORKS, index=theindex)
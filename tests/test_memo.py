@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_memo
+----------------------------------
+
+Tests for `cdiquerygenestoterm.memo` module.
+"""
+
+import sys
+import threading
+import unittest
+
+from cdiquerygenestoterm.memo import MappedTermMemo
+
+
+class TestMemo(unittest.TestCase):
+
+    def test_get_put_and_stats(self):
+        memo = MappedTermMemo(maxsize=2)
+        self.assertEqual(None, memo.get('a'))
+        memo.put('a', {'name': 'a'})
+        memo.put('b', {'name': 'b'})
+        memo.put('c', None)
+        self.assertEqual({'name': 'a'}, memo.get('a'))
+
+        # b is least recently used so it is evicted
+        memo.put('c', {'name': 'c'})
+        self.assertEqual(None, memo.get('b'))
+        self.assertEqual({'name': 'a'}, memo.get('a'))
+        self.assertEqual({'name': 'c'}, memo.get('c'))
+        self.assertEqual({'hits': 3, 'misses': 2, 'shared': 0,
+                          'size': 2}, memo.get_stats())
+
+    def test_zero_maxsize(self):
+        memo = MappedTermMemo(maxsize=0)
+        memo.put('a', {'name': 'a'})
+        self.assertEqual(None, memo.get('a'))
+
+    def test_get_or_compute(self):
+        memo = MappedTermMemo()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {'name': 'x'}
+
+        self.assertEqual({'name': 'x'}, memo.get_or_compute('a', compute))
+        self.assertEqual({'name': 'x'}, memo.get_or_compute('a', compute))
+        self.assertEqual(1, len(calls))
+
+        # None is not stored
+        self.assertEqual(None, memo.get_or_compute('b', lambda: None))
+        self.assertEqual(None, memo.get('b'))
+
+    def test_get_or_compute_error(self):
+        memo = MappedTermMemo()
+
+        def compute():
+            raise ValueError('hi')
+        try:
+            memo.get_or_compute('a', compute)
+            self.fail('Expected ValueError')
+        except ValueError:
+            pass
+        self.assertEqual({'name': 'y'},
+                         memo.get_or_compute('a', lambda: {'name': 'y'}))
+
+    def test_get_or_compute_collapses_concurrent_calls(self):
+        memo = MappedTermMemo()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'name': 'x'}
+
+        results = []
+
+        def worker():
+            results.append(memo.get_or_compute('a', compute))
+
+        leader = threading.Thread(target=worker)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=worker) for i in range(3)]
+        for t in followers:
+            t.start()
+        while memo.get_stats()['shared'] < 3:
+            threading.Event().wait(0.001)
+        release.set()
+        for t in [leader] + followers:
+            t.join(5)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([{'name': 'x'}] * 4, results)
+        self.assertEqual(3, memo.get_stats()['shared'])
+
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `cdiquerygenestoterm.metrics` module.
+"""
+
+import json
+import pickle
+import unittest
+from unittest.mock import MagicMock
+
+from cdiquerygenestoterm.metrics import Timing
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.metrics import NULL_TASK_METRICS
+from tests.helpers import FakeClock
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timing(self):
+        timing = Timing()
+        self.assertEqual({'count': 0, 'total': 0.0, 'mean': None,
+                          'min': None, 'max': None}, timing.to_dict())
+        timing.add(2)
+        timing.add(4)
+        other = Timing()
+        timing.merge(other)
+        other.add(0.5)
+        timing.merge(other)
+        self.assertEqual({'count': 3, 'total': 6.5, 'mean': 6.5 / 3,
+                          'min': 0.5, 'max': 4}, timing.to_dict())
+
+    def test_task_and_run_metrics(self):
+        clock = FakeClock()
+        run = RunMetrics(clock=clock)
+        task = run.create_task('a')
+        with task.span('submit'):
+            clock.now += 1
+        with task.span('poll'):
+            clock.now += 0.5
+        task.incr('polls')
+        task.incr('polls', 2)
+        res = MagicMock()
+        res.status_code = 200
+        res.content = b'12345'
+        task.record_response(res)
+        task.record_response(res)
+        task.taskid = 't1'
+
+        other = run.create_task('a')
+        other.add_time('poll', 1.5)
+        res.status_code = 429
+        res.content = None
+        other.record_response(res)
+        run.create_task()
+
+        summary = run.get_summary()
+        json.dumps(summary)
+        self.assertEqual(1.5, summary['elapsed'])
+        self.assertEqual(['a', '1', '2'], list(summary['tasks'].keys()))
+        thetask = summary['tasks']['a']
+        self.assertEqual('t1', thetask['taskid'])
+        self.assertEqual(1, thetask['spans']['submit']['total'])
+        self.assertEqual({'polls': 3, 'bytes_received': 10},
+                         thetask['counters'])
+        self.assertEqual({'200': 2}, thetask['status_codes'])
+
+        agg = summary['aggregate']
+        self.assertEqual(3, agg['tasks'])
+        self.assertEqual(2, agg['spans']['poll']['count'])
+        self.assertEqual(2.0, agg['spans']['poll']['total'])
+        self.assertEqual(1.5, agg['spans']['poll']['max'])
+        self.assertEqual({'200': 2, '429': 1}, agg['status_codes'])
+
+    def test_add_resumed_task(self):
+        worker = RunMetrics()
+        task = worker.create_task('a')
+        task.record_resumed('t1')
+        task.finish(True)
+        self.assertEqual(('t1', True, True),
+                         (task.taskid, task.submitted, task.resumed))
+
+        listener = MagicMock()
+        run = RunMetrics(listener=listener)
+        for thetask in pickle.loads(pickle.dumps(worker.get_tasks())):
+            run.add_task(thetask)
+        self.assertEqual(0, listener.task_submitted.call_count)
+        self.assertEqual(1, listener.task_resumed.call_count)
+        self.assertEqual(1, listener.task_finished.call_count)
+
+    def test_add_task_and_record_worker(self):
+        worker = RunMetrics()
+        task = worker.create_task('a')
+        task.record_submitted('t1')
+        task.add_time('total', 2)
+        task.finish(True)
+        notsubmitted = worker.create_task('b')
+        notsubmitted.finish(False)
+
+        listener = MagicMock()
+        run = RunMetrics(listener=listener)
+        self.assertTrue('workers' not in run.get_summary())
+        for thetask in pickle.loads(pickle.dumps(worker.get_tasks())):
+            run.add_task(thetask)
+        self.assertEqual(1, listener.task_submitted.call_count)
+        self.assertEqual(2, listener.task_finished.call_count)
+        run.record_worker(123, 2, 0.5)
+        run.record_worker(123, 6, 1.5)
+        run.record_worker(456, 1, 0.0)
+
+        summary = run.get_summary()
+        json.dumps(summary)
+        self.assertEqual(['a', 'b'], list(summary['tasks'].keys()))
+        self.assertEqual('t1', summary['tasks']['a']['taskid'])
+        self.assertEqual({'123': {'shards': 2, 'genesets': 8,
+                                  'busy': 2.0,
+                                  'genesets_per_second': 4.0},
+                          '456': {'shards': 1, 'genesets': 1,
+                                  'busy': 0.0,
+                                  'genesets_per_second': None}},
+                         summary['workers'])
+
+    def test_null_task_metrics(self):
+        with NULL_TASK_METRICS.span('submit'):
+            pass
+        NULL_TASK_METRICS.incr('polls')
+        NULL_TASK_METRICS.add_time('poll', 1)
+        NULL_TASK_METRICS.record_response(MagicMock())
+        self.assertEqual({'taskid': None, 'spans': {}, 'counters': {},
+                          'status_codes': {}}, NULL_TASK_METRICS.to_dict())
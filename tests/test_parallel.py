@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_parallel
+----------------------------------
+
+Tests for `cdiquerygenestoterm.parallel` module.
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import requests_mock
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm import parallel
+from cdiquerygenestoterm.metrics import RunMetrics
+from cdiquerygenestoterm.snapshot import write_binary_snapshot
+from tests.helpers import NETWORKS
+
+
+GENESETS = [('1', ['a', 'b']), ('2', ['d', 'e']), ('3', ['z']),
+            ('4', ['x']), ('5', ['c', 'f', 'e']), ('6', []),
+            ('7', ['b', 'a']), ('8', ['X', 'c'])]
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._snapshotfile = os.path.join(self._temp_dir, 'snapshot.bin')
+        write_binary_snapshot(self._snapshotfile, NETWORKS)
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_run_iquery_genesets_applies_chained_aliases_once(self):
+        aliasfile = os.path.join(self._temp_dir, 'aliases.tsv')
+        with open(aliasfile, 'w') as f:
+            f.write('X\tA\nA\tG\n')
+        theargs = cdiquerygenestotermcmd.\
+            _parse_arguments('desc', ['foo', '--snapshot',
+                                      self._snapshotfile, '--aliases',
+                                      aliasfile])
+        canonicalizer = cdiquerygenestotermcmd.\
+            create_canonicalizer_from_args(theargs)
+        engine = cdiquerygenestotermcmd.create_engine_from_args(theargs)
+        for processes in [1, 2]:
+            res = cdiquerygenestotermcmd.\
+                run_iquery_genesets([('1', ['x', 'b'])], theargs,
+                                    canonicalizer=canonicalizer,
+                                    engine=engine, processes=processes)
+            self.assertEqual('one', res['1']['name'])
+            self.assertEqual(['A', 'b'], res['1']['intersections'])
+
+    def test_iter_shards(self):
+        self.assertEqual([], list(parallel._iter_shards([], 2)))
+        self.assertEqual([[1, 2], [3, 4], [5]],
+                         list(parallel._iter_shards(range(1, 6), 2)))
+        self.assertEqual([[1, 2]],
+                         list(parallel._iter_shards([1, 2], 5)))
+
+    def test_iter_iquery_results_parallel_keeps_order(self):
+        theargs = cdiquerygenestotermcmd.\
+            _parse_arguments('desc', ['foo', '--snapshot',
+                                      self._snapshotfile])
+        engine = cdiquerygenestotermcmd.create_engine_from_args(theargs)
+        expected = dict(cdiquerygenestotermcmd.
+                        iter_iquery_results(GENESETS, theargs,
+                                            engine=engine))
+        metrics = RunMetrics()
+        res = list(parallel.
+                   iter_iquery_results_parallel(GENESETS, theargs, 2,
+                                                metrics=metrics,
+                                                shard_size=3))
+        self.assertEqual([setid for setid, _ in GENESETS],
+                         [setid for setid, _ in res])
+        self.assertEqual(expected, dict(res))
+        self.assertEqual('one', dict(res)['1'].name)
+        self.assertEqual(None, dict(res)['3'])
+
+        summary = metrics.get_summary()
+        self.assertEqual(8, summary['aggregate']['tasks'])
+        self.assertEqual(set([setid for setid, _ in GENESETS]),
+                         set(summary['tasks'].keys()))
+        workers = summary['workers']
+        self.assertTrue(1 <= len(workers) <= 2)
+        self.assertEqual(3, sum([w['shards'] for w in workers.values()]))
+        self.assertEqual(8, sum([w['genesets']
+                                 for w in workers.values()]))
+        for worker in workers.values():
+            self.assertTrue(worker['genesets_per_second'] > 0)
+
+    def test_iter_iquery_results_parallel_with_iquery(self):
+        theargs = cdiquerygenestotermcmd.\
+            _parse_arguments('desc', ['foo', '--url', 'http://foo',
+                                      '--polling_interval', '0'])
+        qres = {'sources': [{'results': [{'description': 'x: y',
+                                          'details': {'PValue': 5,
+                                                      'similarity': 0.5},
+                                          'url': 'someurl',
+                                          'nodes': 4,
+                                          'hitGenes': ['A']}]}]}
+        # workers are forked so they inherit the mocked transport
+        with requests_mock.Mocker() as m:
+            m.post('http://foo/integratedsearch/v1/', status_code=202,
+                   json={'id': 't'})
+            m.get('http://foo/integratedsearch/v1/t/status',
+                  json={'progress': 100, 'status': 'complete'})
+            m.get('http://foo/integratedsearch/v1/t', json=qres)
+            res = list(parallel.iter_iquery_results_parallel(
+                [('a', ['x']), ('b', []), ('c', ['y'])], theargs, 2,
+                shard_size=1,
+                mp_context=multiprocessing.get_context('fork')))
+        self.assertEqual(['a', 'b', 'c'], [setid for setid, _ in res])
+        self.assertEqual('y', res[0][1].name)
+        self.assertEqual(None, res[1][1])
+        self.assertEqual('y', res[2][1].name)
+
+    def test_main_batch_with_processes(self):
+        inputfile = os.path.join(self._temp_dir, 'input.txt')
+        with open(inputfile, 'w') as f:
+            for setid, genes in GENESETS:
+                f.write(setid + '\t' + ','.join(genes) + '\n')
+        outputs = {}
+        for output_format in ['json', 'jsonl']:
+            for processes in ['1', '3']:
+                orig_stdout = sys.stdout
+                orig_stderr = sys.stderr
+                sys.stdout = io.StringIO()
+                sys.stderr = io.StringIO()
+                try:
+                    res = cdiquerygenestotermcmd.main(
+                        ['prog', inputfile, '--batch', '--snapshot',
+                         self._snapshotfile, '--output_format',
+                         output_format, '--processes', processes,
+                         '--shard_size', '2'])
+                    out = sys.stdout.getvalue()
+                finally:
+                    sys.stdout = orig_stdout
+                    sys.stderr = orig_stderr
+                self.assertEqual(0, res)
+                outputs[(output_format, processes)] = out
+        self.assertEqual(outputs[('json', '1')], outputs[('json', '3')])
+        byid = json.loads(outputs[('json', '3')])
+        self.assertEqual(['1', '2', '4', '5', '7', '8'],
+                         [k for k, v in byid.items() if v is not None])
+        lines = [json.loads(line) for line in
+                 outputs[('jsonl', '3')].splitlines()]
+        self.assertEqual([setid for setid, _ in GENESETS],
+                         [line['id'] for line in lines])
+        self.assertEqual(byid, dict([(line['id'], line['result'])
+                                     for line in lines]))
+
+    def test_main_processes_with_journal_fails(self):
+        inputfile = os.path.join(self._temp_dir, 'input.txt')
+        with open(inputfile, 'w') as f:
+            f.write('1\ta,b\n')
+        orig_stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            res = cdiquerygenestotermcmd.main(
+                ['prog', inputfile, '--batch', '--processes', '2',
+                 '--journal', os.path.join(self._temp_dir, 'journal')])
+            err = sys.stderr.getvalue()
+        finally:
+            sys.stderr = orig_stderr
+        self.assertEqual(2, res)
+        self.assertTrue('--journal' in err)
+
+
+if __name__ == '__main__':
+    unittest.main()
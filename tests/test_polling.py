@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_polling
+----------------------------------
+
+Tests for `cdiquerygenestoterm.polling` module.
+"""
+
+import sys
+import random
+import unittest
+
+from cdiquerygenestoterm.polling import PollingStrategy
+from cdiquerygenestoterm.polling import FixedPollingStrategy
+from cdiquerygenestoterm.polling import BackoffPollingStrategy
+from cdiquerygenestoterm.polling import PollTimer
+from tests.helpers import FakeClock
+
+
+class TestPolling(unittest.TestCase):
+
+    def test_base_strategy(self):
+        try:
+            PollingStrategy().get_delay(1)
+            self.fail('Expected NotImplementedError')
+        except NotImplementedError:
+            pass
+
+    def test_fixed_strategy(self):
+        strategy = FixedPollingStrategy(interval=3)
+        self.assertEqual(3, strategy.get_delay(1))
+        self.assertEqual(3, strategy.get_delay(50, progress=20,
+                                               elapsed=10))
+
+    def test_backoff_strategy_no_jitter(self):
+        strategy = BackoffPollingStrategy(initial_delay=0.5, max_delay=3,
+                                          jitter=0)
+        self.assertEqual(0.5, strategy.get_delay(1))
+        self.assertEqual(1.0, strategy.get_delay(2))
+        self.assertEqual(2.0, strategy.get_delay(3))
+        self.assertEqual(3, strategy.get_delay(4))
+        self.assertEqual(3, strategy.get_delay(400))
+
+    def test_backoff_strategy_uses_progress(self):
+        strategy = BackoffPollingStrategy(initial_delay=0.5, max_delay=10,
+                                          jitter=0)
+        # 2 seconds for 50% means about 2 seconds remain
+        self.assertEqual(1.0, strategy.get_delay(1, progress=50,
+                                                 elapsed=2))
+        # almost done so wait only initial delay
+        self.assertEqual(0.5, strategy.get_delay(5, progress=99,
+                                                 elapsed=2))
+        # estimate capped at max delay
+        self.assertEqual(10, strategy.get_delay(1, progress=1,
+                                                elapsed=60))
+        # 0 progress falls back to backoff
+        self.assertEqual(1.0, strategy.get_delay(2, progress=0,
+                                                 elapsed=60))
+
+    def test_backoff_strategy_jitter(self):
+        strategy = BackoffPollingStrategy(initial_delay=1, max_delay=10,
+                                          jitter=0.2,
+                                          rng=random.Random(1))
+        for attempt in range(1, 4):
+            delay = strategy.get_delay(attempt)
+            base = 2 ** (attempt - 1)
+            self.assertTrue(base * 0.8 <= delay <= base * 1.2)
+
+    def test_poll_timer_max_polls(self):
+        clock = FakeClock(now=100.0)
+        timer = PollTimer(FixedPollingStrategy(interval=2), max_polls=2,
+                          clock=clock)
+        self.assertTrue(timer.is_due())
+        self.assertFalse(timer.is_expired())
+        timer.record_poll()
+        self.assertEqual(1, timer.get_poll_count())
+        self.assertFalse(timer.is_due())
+        self.assertEqual(2, timer.get_time_until_next_poll())
+        clock.now += 2
+        self.assertTrue(timer.is_due())
+        timer.record_poll()
+        self.assertTrue(timer.is_expired())
+
+    def test_poll_timer_max_wait(self):
+        clock = FakeClock(now=100.0)
+        timer = PollTimer(FixedPollingStrategy(interval=5), max_wait=3,
+                          clock=clock)
+        timer.record_poll(progress=10)
+        self.assertFalse(timer.is_expired())
+        # next poll is capped at deadline
+        self.assertEqual(3, timer.get_time_until_next_poll())
+        clock.now += 3
+        self.assertTrue(timer.is_expired())
+
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())
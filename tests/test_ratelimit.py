@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_ratelimit
+----------------------------------
+
+Tests for `cdiquerygenestoterm.ratelimit` module.
+"""
+
+import io
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+import requests
+from requests.adapters import HTTPAdapter
+
+from cdiquerygenestoterm.ratelimit import TokenBucket
+from cdiquerygenestoterm.ratelimit import RateLimitedAdapter
+from cdiquerygenestoterm.ratelimit import get_retry_after
+from tests.helpers import FakeClock
+
+
+def _get_response(status_code, headers=None):
+    res = requests.Response()
+    res.status_code = status_code
+    res.raw = io.BytesIO(b'')
+    if headers is not None:
+        res.headers.update(headers)
+    return res
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_token_bucket_rate_and_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=2, clock=clock,
+                             sleep=clock.sleep)
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(0.5, bucket.acquire())
+        self.assertAlmostEqual(0.5, bucket.acquire())
+        self.assertAlmostEqual(1.0, clock.now)
+
+        # debt is shared, so reservations queue up
+        self.assertAlmostEqual(0.5, bucket.reserve())
+        self.assertAlmostEqual(1.0, bucket.reserve())
+
+    def test_token_bucket_unlimited_and_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(clock=clock, sleep=clock.sleep)
+        self.assertEqual(None, bucket.get_rate())
+        for i in range(10):
+            self.assertEqual(0, bucket.acquire())
+        bucket.pause(3)
+        bucket.pause(1)
+        self.assertEqual(3, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+
+    def test_get_retry_after(self):
+        self.assertEqual(None, get_retry_after(_get_response(429)))
+        self.assertEqual(5, get_retry_after(
+            _get_response(429, {'Retry-After': '5'})))
+        self.assertEqual(0, get_retry_after(
+            _get_response(429, {'Retry-After': '-2'})))
+        self.assertEqual(None, get_retry_after(
+            _get_response(429, {'Retry-After': 'soon'})))
+        res = get_retry_after(_get_response(503, {'Retry-After':
+                                                  'Wed, 21 Oct 2015 '
+                                                  '07:28:10 GMT'}),
+                              clock=lambda: 1445412480)
+        self.assertEqual(10, res)
+
+    def test_adapter_retries_throttled_requests(self):
+        clock = FakeClock()
+        submit_bucket = TokenBucket(rate=1, clock=clock,
+                                    sleep=clock.sleep)
+        poll_bucket = TokenBucket(clock=clock, sleep=clock.sleep)
+        adapter = RateLimitedAdapter(submit_bucket=submit_bucket,
+                                     poll_bucket=poll_bucket,
+                                     throttle_retries=2,
+                                     backoff_factor=0.5)
+        responses = [_get_response(429, {'Retry-After': '4'}),
+                     _get_response(503),
+                     _get_response(202)]
+        post = requests.Request('POST', 'http://foo/integratedsearch/v1/',
+                                json={}).prepare()
+        with patch.object(HTTPAdapter, 'send',
+                          MagicMock(side_effect=responses)) as mock_send:
+            res = adapter.send(post)
+            self.assertEqual(202, res.status_code)
+            self.assertEqual(3, mock_send.call_count)
+        # Retry-After then backoff of 1 second for second attempt
+        self.assertEqual([4, 1], clock.sleeps)
+
+        # give up once retries are used
+        clock.sleeps = []
+        status = requests.Request('GET', 'http://foo/integratedsearch/'
+                                         'v1/t/status').prepare()
+        with patch.object(HTTPAdapter, 'send',
+                          MagicMock(side_effect=[_get_response(429)] * 3)):
+            res = adapter.send(status)
+            self.assertEqual(429, res.status_code)
+        self.assertEqual([0.5, 1], clock.sleeps)
+
+        # other requests are neither limited nor retried
+        get = requests.Request('GET', 'http://foo/integratedsearch/'
+                                      'v1/t').prepare()
+        with patch.object(HTTPAdapter, 'send',
+                          MagicMock(return_value=_get_response(500))):
+            self.assertEqual(500, adapter.send(get).status_code)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_reader
+----------------------------------
+
+Tests for `cdiquerygenestoterm.reader` module.
+"""
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import cdiquerygenestoterm
+from cdiquerygenestoterm import reader
+
+
+class TestReader(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _write(self, data, name='input', compress=False):
+        path = os.path.join(self._temp_dir, name)
+        if compress is True:
+            with gzip.open(path, 'wt') as f:
+                f.write(data)
+        else:
+            with open(path, 'w') as f:
+                f.write(data)
+        return path
+
+    def test_open_inputfile(self):
+        path = self._write('a,b\n', compress=True)
+        with reader.open_inputfile(path) as f:
+            self.assertEqual('a,b\n', f.read())
+        path = self._write('', name='empty')
+        with reader.open_inputfile(path) as f:
+            self.assertEqual('', f.read())
+
+    def test_get_genes_from_string(self):
+        self.assertEqual(None, reader.get_genes_from_string(''))
+        self.assertEqual(None, reader.get_genes_from_string(',\n'))
+        self.assertEqual(['a', ' b'], reader.get_genes_from_string('a, b,'))
+
+    def test_import_does_not_import_cmd(self):
+        code = ('import sys\n'
+                'from cdiquerygenestoterm import reader, vectorized\n'
+                'print(\'cdiquerygenestoterm.cdiquerygenestotermcmd\' '
+                'in sys.modules)\n')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+            os.path.abspath(cdiquerygenestoterm.__file__)))
+        res = subprocess.run([sys.executable, '-c', code], env=env,
+                             stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True)
+        self.assertEqual('False', res.stdout.strip())
+
+    def test_detect_format(self):
+        self.assertEqual(reader.FORMAT_LINES,
+                         reader.detect_format(self._write('\n a,b\n')))
+        self.assertEqual(reader.FORMAT_LINES,
+                         reader.detect_format(self._write('')))
+        self.assertEqual(reader.FORMAT_JSONL,
+                         reader.detect_format(self._write(
+                             '{"genes": ["a"]}\n{"genes": "b"}\n',
+                             compress=True)))
+        self.assertEqual(reader.FORMAT_JSON,
+                         reader.detect_format(self._write(
+                             '{\n "x": ["a"]\n}\n')))
+        self.assertEqual(reader.FORMAT_JSON,
+                         reader.detect_format(self._write(
+                             '{"x": ["a"]}')))
+
+    def test_iter_genesets_lines(self):
+        path = self._write('a,b\n\nc1\tc,d\n,\n', compress=True)
+        self.assertEqual([('1', ['a', 'b']), ('c1', ['c', 'd']),
+                          ('4', None)],
+                         list(reader.iter_genesets(path)))
+
+    def test_iter_genesets_jsonl(self):
+        path = self._write('{"id": "x", "genes": ["a", "b"]}\n\n'
+                           '{"genes": "c,d"}\n'
+                           '{"id": 5, "genes": []}\n')
+        self.assertEqual([('x', ['a', 'b']), ('3', ['c', 'd']),
+                          ('5', None)],
+                         list(reader.iter_genesets(path)))
+
+        path = self._write('{"genes": ["a"]}\n[1]\n')
+        genesets = reader.iter_genesets(path)
+        self.assertEqual(('1', ['a']), next(genesets))
+        self.assertRaises(ValueError, next, genesets)
+
+    def test_iter_genesets_newline(self):
+        path = self._write('a\n b \n\n\nc\n')
+        self.assertEqual([('1', ['a', 'b']), ('2', ['c'])],
+                         list(reader.iter_genesets(
+                             path, input_format=reader.FORMAT_NEWLINE)))
+
+    def test_iter_genesets_json(self):
+        path = self._write('{"5": ["a", "b"], "x": "c,d", "y": []}')
+        self.assertEqual([('5', ['a', 'b']), ('x', ['c', 'd']),
+                          ('y', None)],
+                         list(reader.iter_genesets(path)))
+        self.assertRaises(ValueError, list,
+                          reader.iter_genesets(path, input_format='foo'))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_snapshot
+----------------------------------
+
+Tests for `cdiquerygenestoterm.snapshot` module.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cdiquerygenestoterm import local
+from cdiquerygenestoterm import index
+from cdiquerygenestoterm import snapshot
+from tests.helpers import NETWORKS
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_write_and_load(self):
+        snapshotfile = os.path.join(self._temp_dir, 'snapshot.bin')
+        snapshot.write_binary_snapshot(snapshotfile, NETWORKS,
+                                       universe_size=100)
+        self.assertTrue(snapshot.is_binary_snapshot(snapshotfile))
+        engine = snapshot.load_binary_snapshot(snapshotfile)
+        self.assertEqual(4, engine.get_network_count())
+        self.assertEqual(100, engine.get_universe_size())
+
+        networks = engine.get_networks()
+        self.assertEqual({'name': 'one', 'source': 'src',
+                          'url': 'url1', 'nodes': 10}, networks[0])
+        self.assertEqual({'name': 'twö', 'source': 'src',
+                          'url': 'url2', 'nodes': 4}, networks[1])
+        self.assertEqual({'name': 'three', 'source': 'NA',
+                          'url': None, 'nodes': 1}, networks[2])
+        self.assertEqual(['A', 'B', 'C'], networks.get_genes(0))
+        self.assertEqual(['C', 'D', 'E', 'F'], networks.get_genes(1))
+        self.assertEqual([], networks.get_genes(3))
+
+        expected = local.LocalEnrichmentEngine(NETWORKS,
+                                               universe_size=100)
+        for genes in [['B', 'C'], ['X'], ['C', 'F', 'Q'], ['Q']]:
+            self.assertEqual(expected.query(genes), engine.query(genes))
+            self.assertEqual(expected.query(genes, k=1),
+                             engine.query(genes, k=1))
+
+    def test_universe_size_defaults_to_genes(self):
+        snapshotfile = os.path.join(self._temp_dir, 'snapshot.bin')
+        snapshot.write_binary_snapshot(snapshotfile, NETWORKS)
+        self.assertEqual(7, snapshot.load_binary_snapshot(
+            snapshotfile).get_universe_size())
+
+    def test_convert_and_load_snapshot(self):
+        jsonfile = os.path.join(self._temp_dir, 'snapshot.json')
+        with open(jsonfile, 'w') as f:
+            json.dump({'universe_size': 50, 'networks': NETWORKS}, f)
+        self.assertFalse(snapshot.is_binary_snapshot(jsonfile))
+        snapshotfile = os.path.join(self._temp_dir, 'snapshot.bin')
+        self.assertEqual(4, snapshot.convert_snapshot(jsonfile,
+                                                      snapshotfile))
+        engine = local.load_snapshot(snapshotfile)
+        self.assertTrue(isinstance(engine.get_networks(),
+                                   snapshot.SnapshotNetworks))
+        self.assertEqual(50, engine.get_universe_size())
+        self.assertEqual(local.load_snapshot(jsonfile).query(['C', 'A']),
+                         engine.query(['C', 'A']))
+
+    def test_load_invalid(self):
+        snapshotfile = os.path.join(self._temp_dir, 'snapshot.bin')
+        index.GeneIndex.build([['A']]).write(snapshotfile)
+        self.assertRaises(ValueError, snapshot.load_binary_snapshot,
+                          snapshotfile)
+        index.write_sections(snapshotfile, snapshot.SNAPSHOT_MAGIC,
+                             [b''] * 3)
+        self.assertRaises(ValueError, snapshot.load_binary_snapshot,
+                          snapshotfile)
+        self.assertRaises(ValueError, local.load_snapshot,
+                          snapshotfile)
+
+
+if __name__ == '__main__':
+    unittest.main()
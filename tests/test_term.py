@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_term
+----------------------------------
+
+Tests for `cdiquerygenestoterm.term` module.
+"""
+
+import io
+import json
+import unittest
+
+from cdiquerygenestoterm.term import MappedTerm
+from cdiquerygenestoterm.term import JsonLinesWriter
+from cdiquerygenestoterm.term import to_jsonable
+from cdiquerygenestoterm.term import from_jsonable
+
+
+RESULT = {'description': 'x: y',
+          'details': {'PValue': 5, 'similarity': 0.002},
+          'url': 'someurl',
+          'nodes': 4,
+          'hitGenes': ['hi']}
+
+
+class TestTerm(unittest.TestCase):
+
+    def test_mapped_term(self):
+        term = MappedTerm.from_result(RESULT)
+        self.assertFalse(hasattr(term, '__dict__'))
+        self.assertEqual({'name': 'y', 'source': 'x', 'p_value': 5,
+                          'description': 'someurl', 'term_size': 4,
+                          'intersections': ['hi']}, term.to_dict())
+        self.assertEqual(term, MappedTerm.from_dict(term.to_dict()))
+        self.assertNotEqual(term, MappedTerm(name='y'))
+        self.assertTrue(repr(term).startswith("MappedTerm(name='y'"))
+
+        res = dict(RESULT)
+        res['description'] = 'nocolon'
+        term = MappedTerm.from_result(res)
+        self.assertEqual('NA', term.source)
+        self.assertEqual('nocolon', term.name)
+
+    def test_to_and_from_jsonable(self):
+        term = MappedTerm.from_result(RESULT)
+        self.assertEqual(None, to_jsonable(None))
+        self.assertEqual(term.to_dict(), to_jsonable(term))
+        self.assertEqual([term.to_dict(), term.to_dict()],
+                         to_jsonable([term, term.to_dict()]))
+        self.assertEqual(None, from_jsonable(None))
+        self.assertEqual(term, from_jsonable(term.to_dict()))
+        self.assertEqual([term], from_jsonable([term.to_dict()]))
+
+        term.resolution = 'local'
+        self.assertEqual('local', to_jsonable(term)['resolution'])
+        self.assertEqual('local',
+                         from_jsonable(to_jsonable(term)).resolution)
+
+    def test_json_lines_writer(self):
+        out = io.StringIO()
+        writer = JsonLinesWriter(out)
+        term = MappedTerm.from_result(RESULT)
+        writer.write('a', term)
+        writer.write('b', None)
+        writer.write('c', [term.to_dict(), term])
+        self.assertEqual(3, writer.get_count())
+        lines = out.getvalue().split('\n')
+        self.assertEqual('', lines[-1])
+        self.assertEqual({'id': 'a', 'result': term.to_dict()},
+                         json.loads(lines[0]))
+        self.assertEqual('{"id":"b","result":null}', lines[1])
+        self.assertEqual([term.to_dict(), term.to_dict()],
+                         json.loads(lines[2])['result'])
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_vectorized
+----------------------------------
+
+Tests for `cdiquerygenestoterm.vectorized` module.
+"""
+
+import sys
+import random
+import unittest
+
+from cdiquerygenestoterm import cdiquerygenestotermcmd
+from cdiquerygenestoterm import vectorized
+
+
+def _get_random_result(rng, numsources=3, maxresults=50):
+    sources = []
+    for sindex in range(numsources):
+        results = []
+        for rindex in range(rng.randint(0, maxresults)):
+            results.append({'description': 's' + str(sindex) +
+                                           ': r' + str(rindex),
+                            'details': {'PValue': rng.choice([0.01, 0.5,
+                                                              rng.random()]),
+                                        'similarity':
+                                            rng.choice([0.1, 0.2,
+                                                        rng.random()])},
+                            'url': 'url',
+                            'nodes': rindex,
+                            'hitGenes': ['g'] * rng.randint(0, 5)})
+        sources.append({'results': results})
+    return {'sources': sources}
+
+
+@unittest.skipUnless(vectorized.is_available(), 'numpy not installed')
+class TestVectorized(unittest.TestCase):
+
+    def test_extract_result_arrays(self):
+        qres = {'sources': [{'results': [{'details': {'PValue': 0.1,
+                                                      'similarity': 0.2},
+                                          'nodes': 4,
+                                          'hitGenes': ['a', 'b']}]},
+                            {'results': [{'details': {'PValue': 0.3,
+                                                      'similarity': 0.4},
+                                          'nodes': 5,
+                                          'hitGenes': ['a']}]}]}
+        arrays = vectorized.extract_result_arrays(qres)
+        self.assertEqual(2, len(arrays))
+        self.assertEqual([0.2, 0.4], arrays.similarity.tolist())
+        self.assertEqual([0.1, 0.3], arrays.pvalue.tolist())
+        self.assertEqual([4, 5], arrays.nodes.tolist())
+        self.assertEqual([2, 1], arrays.hits.tolist())
+
+    def test_adjust_pvalues_bh(self):
+        self.assertEqual([], vectorized.adjust_pvalues_bh([]).tolist())
+        res = vectorized.adjust_pvalues_bh([0.01, 0.04, 0.03, 0.02, 0.9])
+        expected = [0.05, 0.05, 0.05, 0.05, 0.9]
+        for exp, val in zip(expected, res.tolist()):
+            self.assertAlmostEqual(exp, val)
+        res = vectorized.adjust_pvalues_bh([0.5, 0.6])
+        self.assertEqual([0.6, 0.6], res.tolist())
+        res = vectorized.adjust_pvalues_bh([0.9, 0.95, 0.99])
+        self.assertAlmostEqual(0.99, max(res.tolist()))
+
+    def test_get_scores_invalid(self):
+        try:
+            vectorized.get_scores(None, None, rankby='foo')
+            self.fail('Expected ValueError')
+        except ValueError:
+            pass
+
+    def test_matches_pure_python_ranking(self):
+        rng = random.Random(3)
+        for trial in range(30):
+            qres = _get_random_result(rng)
+            for rankby in cdiquerygenestotermcmd.RANK_BY_CHOICES:
+                for k in [1, 3, 1000]:
+                    expected = cdiquerygenestotermcmd.\
+                        get_top_results(qres, k=k, rankby=rankby)
+                    res = vectorized.get_top_results(qres, k=k,
+                                                     rankby=rankby)
+                    self.assertEqual([id(r) for r in expected],
+                                     [id(r[0]) for r in res])
+
+    def test_get_top_results_filters(self):
+        qres = {'sources': [{'results': [{'description': 'a',
+                                          'details': {'PValue': 0.01,
+                                                      'similarity': 0.5},
+                                          'hitGenes': ['1']},
+                                         {'description': 'b',
+                                          'details': {'PValue': 0.02,
+                                                      'similarity': 0.4},
+                                          'hitGenes': ['1', '2']},
+                                         {'description': 'c',
+                                          'details': {'PValue': 0.2,
+                                                      'similarity': 0.9},
+                                          'hitGenes': ['1', '2']}]}]}
+        res = vectorized.get_top_results(qres, k=0)
+        self.assertEqual([], res)
+        res = vectorized.get_top_results(qres, k=5, max_pvalue=0.05)
+        self.assertEqual(['a', 'b'], [r[0]['description'] for r in res])
+        self.assertEqual([0.01, 0.02], [r[1] for r in res])
+        res = vectorized.get_top_results(qres, k=5, min_hits=2)
+        self.assertEqual(['c', 'b'], [r[0]['description'] for r in res])
+        res = vectorized.get_top_results(qres, k=5, max_pvalue=0.01,
+                                         min_hits=2)
+        self.assertEqual([], res)
+
+        res = vectorized.get_top_results(qres, k=5, max_pvalue=0.03,
+                                         pvalue_adjust='bh')
+        self.assertEqual(['a', 'b'], [r[0]['description'] for r in res])
+        self.assertAlmostEqual(0.03, res[0][1])
+        self.assertAlmostEqual(0.03, res[1][1])
+        try:
+            vectorized.get_top_results(qres, pvalue_adjust='foo')
+            self.fail('Expected ValueError')
+        except ValueError:
+            pass
+
+    def test_get_output_for_result_vectorized(self):
+        qres = {'sources': [{'results': [{'description': 'x: a',
+                                          'details': {'PValue': 0.5,
+                                                      'similarity': 0.3},
+                                          'url': 'u1',
+                                          'nodes': 1,
+                                          'hitGenes': ['1']},
+                                         {'description': 'x: b',
+                                          'details': {'PValue': 0.001,
+                                                      'similarity': 0.2},
+                                          'url': 'u2',
+                                          'nodes': 2,
+                                          'hitGenes': ['2']}]}]}
+        p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                    ['x', '--rankby',
+                                                     'pvalue', '--topk',
+                                                     '2'])
+        self.assertFalse(cdiquerygenestotermcmd.is_vectorized(p))
+        p = cdiquerygenestotermcmd._parse_arguments('desc',
+                                                    ['x', '--max_pvalue',
+                                                     '0.1'])
+        self.assertTrue(cdiquerygenestotermcmd.is_vectorized(p))
+        self.assertFalse(cdiquerygenestotermcmd.is_prunable(p))
+        res = cdiquerygenestotermcmd.get_output_for_result(qres, p)
+        self.assertEqual('b', res['name'])
+        self.assertEqual(0.001, res['p_value'])
+        p.max_pvalue = 0.0001
+        self.assertEqual(None,
+                         cdiquerygenestotermcmd.get_output_for_result(qres,
+                                                                      p))
+        p.topk = 2
+        self.assertEqual([],
+                         cdiquerygenestotermcmd.get_output_for_result(qres,
+                                                                      p))
+
+
+if __name__ == '__main__':
+    sys.exit(unittest.main())